@@ -1,89 +1,83 @@
 import argparse
 
-from mcidle.networking.auth import Auth
-from mcidle.networking.listen_thread import ListenThread
-from mcidle.networking.connection import MinecraftConnection
+from mcidle.session import Account, run_accounts
+from mcidle.supervisor import Supervisor
+from mcidle.networking.packets.registry import registry
 
 parser = argparse.ArgumentParser(add_help=True)
 parser.add_argument('--ip', help='The ip address of the server to connect to (e.g localhost)')
 parser.add_argument('--port', default=25565, type=int, help='The port of the server to connect to (default=25565)')
-parser.add_argument('--protocol', default=340, type=int, help='The protocol version of the server to connect to (default=340)')
+parser.add_argument('--protocol', default=340, type=int, help='The protocol version of the server to connect to, 338 or 340 (default=340)')
 parser.add_argument('--username', help='Your Mojang account username (an email or legacy name)')
 parser.add_argument('--password', help='Your Mojang account password')
 parser.add_argument('--dport', default=1337, type=int, help='The port to connect to with mcidle (default=1337)')
 parser.add_argument('--bindip', default='', help='The IP to bind to with mcidle')
 parser.add_argument('--reconnect', default=10, type=int, help='The reconnect rate in seconds')
+parser.add_argument('--accounts', help='A JSON file of accounts to idle at once, each with its own ip, port and dport')
+parser.add_argument('--batch-size', default=1 << 18, type=int, help='The most bytes to coalesce into one socket write (default=262144)')
+parser.add_argument('--engine', default='threaded', choices=['threaded', 'asyncio'], \
+                    help='Run sessions with a thread per connection or as coroutines on one event loop (default=threaded)')
+parser.add_argument('--flush-latency', default=0.0, type=float, help='Seconds to wait for more packets before writing a batch (default=0)')
+parser.add_argument('--shards', default=0, type=int, \
+                    help='Spread the accounts over this many worker processes, restarting any that crash (default=0, no workers)')
+parser.add_argument('--key-rotation', default=0, type=int, \
+                    help='Generate a new RSA keypair for local clients after this many logins (default=0, never)')
+parser.add_argument('--chunk-budget', default=0, type=float, \
+                    help='The most megabytes of chunks to cache per account, farthest are dropped first (default=0, no limit)')
+parser.add_argument('--chunk-radius', default=0, type=int, \
+                    help='Drop cached chunks farther than this many chunks from the player (default=0, keep all)')
+parser.add_argument('--spill-dir', help='Keep cached chunks and entities in files in this directory instead of in memory')
+parser.add_argument('--client-queue-limit', default=0, type=float, \
+                    help='The most megabytes of packets to queue for a local client (default=0, no limit)')
+parser.add_argument('--client-queue-policy', default='drop', choices=['block', 'drop', 'disconnect'], \
+                    help='What to do when the client queue is full: stop reading from the server until it drains, drop entity movement or disconnect the client (default=drop)')
+parser.add_argument('--server-queue-limit', default=0, type=float, \
+                    help='The most megabytes of packets to queue for the server (default=0, no limit)')
+parser.add_argument('--server-queue-policy', default='block', choices=['block', 'drop', 'disconnect'], \
+                    help='What to do when the server queue is full (default=block)')
+parser.add_argument('--compression-level', default=-1, type=int, choices=range(-1, 10), metavar='{-1..9}', \
+                    help='The zlib level of packets mcidle compresses for the server (default=-1, zlib\'s default)')
+parser.add_argument('--client-compression-level', default=1, type=int, choices=range(-1, 10), metavar='{-1..9}', \
+                    help='The zlib level of packets mcidle compresses for a local client, 0 sends them uncompressed (default=1)')
+parser.add_argument('--workers', default=2, type=int, \
+                    help='Threads that inflate cached chunks and encrypt large batches, 0 does it inline (default=2)')
+parser.add_argument('--loopback-uncompressed', action='store_true', \
+                    help='Send packets mcidle serialises uncompressed to a local client on this machine')
+parser.add_argument('--metrics-port', default=0, type=int, \
+                    help='Serve Prometheus metrics of every account on this port at /metrics (default=0, off)')
+parser.add_argument('--metrics-ip', default='127.0.0.1', help='The IP to serve metrics on (default=127.0.0.1)')
 args = parser.parse_args()
 
 
-def update_credentials(username, password):
-    if not Auth.has_credentials():
-        if username is None or username is None:
-            raise ValueError("Please provide both your username and password.")
-
-        auth = Auth()
-        Auth.save_to_disk(auth.authenticate(username=username, password=password))
-
-
-def try_auth(username, password):
-    try:
-        credentials = Auth.read_from_disk()
-    except FileNotFoundError:
-        print("Credentials not found..", flush=True)
-        try:
-            update_credentials(username, password)
-            credentials = Auth.read_from_disk()
-        except Exception as e:
-            return None
-
-    auth = Auth().assign_profile(credentials)
-
-    if not auth.validate():
-        Auth.delete_credentials()
-        return None # Invalid credentials
-    else:
-        print("Credentials are valid!", flush=True)
-    return credentials
-
-
 def main():
-    if args.ip is None:
-        raise RuntimeError("Please specify an ip address!")
-
-    # We use this to listen for incoming connections
-    listen_thread = ListenThread(address=(args.bindip, args.dport))
-    listen_thread.start()
-
-    # We do this loop because the session information may be invalidated at any point
-    # Due to restarting the Minecraft client over and over
-    # So when we reconnect we need to generate potentially new credentials to avoid session errors
-    import time
-
-    while True:
-        print("Trying to auth..", flush=True)
-        try:
-            credentials = try_auth(args.username, args.password)  # Make sure we can still auth
-        except:
-            print("Invalid password or blocked from auth server for reconnecting too fast..", flush=True)
-
-        print("Finished auth", flush=True)
-        if credentials:
-            print("Starting..", flush=True)
-            listen_thread.set_server(None)
-            conn = MinecraftConnection(ip=args.ip, port=args.port, server_port=args.dport, protocol=args.protocol, \
-                                       username=credentials['selectedProfile']['name'], profile=credentials, \
-                                       listen_thread=listen_thread)
-            conn.run_handler()
-            conn.stop()
-            print("Disconnected..reconnecting in %s seconds" % args.reconnect, flush=True)
-            time.sleep(args.reconnect)
-            print("Reconnecting..", flush=True)
-        else:
-            if not args.username or not args.password:
-                print("Can't re-auth user because no user or password provided!", flush=True)
-                return
-            print("Username or password wrong, waiting 15 seconds before reconnecting..")
-            time.sleep(15)
+    if args.accounts:
+        accounts = Account.load(args.accounts)
+    else:
+        accounts = [Account(ip=args.ip, port=args.port, dport=args.dport, protocol=args.protocol, \
+                            username=args.username, password=args.password, bindip=args.bindip, \
+                            reconnect=args.reconnect)]
+
+    for account in accounts:
+        if not registry.supports(account.protocol):
+            parser.error("protocol %s is not supported, use one of %s" % (account.protocol, registry.protocols()))
+
+    connection_options = {'max_batch_size': args.batch_size, 'flush_latency': args.flush_latency, \
+                          'key_rotation': args.key_rotation, 'worker_threads': args.workers, \
+                          'chunk_budget': int(args.chunk_budget * (1 << 20)), \
+                          'chunk_radius': args.chunk_radius, 'spill_dir': args.spill_dir, \
+                          'client_queue_limit': int(args.client_queue_limit * (1 << 20)), \
+                          'client_queue_policy': args.client_queue_policy, \
+                          'server_queue_limit': int(args.server_queue_limit * (1 << 20)), \
+                          'server_queue_policy': args.server_queue_policy, \
+                          'compression_level': args.compression_level, \
+                          'client_compression_level': args.client_compression_level, \
+                          'loopback_uncompressed': args.loopback_uncompressed}
+    metrics_address = (args.metrics_ip, args.metrics_port) if args.metrics_port else None
+    if args.shards > 0:
+        Supervisor(accounts, args.shards, engine=args.engine, metrics_address=metrics_address, \
+                   **connection_options).run()
+    else:
+        run_accounts(accounts, engine=args.engine, metrics_address=metrics_address, **connection_options)
 
 
 if __name__ == '__main__':
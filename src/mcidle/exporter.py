@@ -0,0 +1,144 @@
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from mcidle.networking.metrics import OVERFLOW
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# (metric, type, help, key in a SessionStatus snapshot)
+SESSION_METRICS = (
+    ('mcidle_connected', 'gauge', 'Whether the account is connected to its server', 'connected'),
+    ('mcidle_client_attached', 'gauge', 'Whether a local client is attached to the account', 'client_attached'),
+    ('mcidle_chunks', 'gauge', 'Chunks cached for the account', 'chunks'),
+    ('mcidle_chunk_bytes', 'gauge', 'Bytes taken up by the cached chunks', 'chunk_bytes'),
+    ('mcidle_entities', 'gauge', 'Entities tracked for the account', 'entities'),
+    ('mcidle_entity_bytes', 'gauge', 'Bytes taken up by the metadata of the tracked entities', 'entity_bytes'),
+    ('mcidle_keep_alive_age_seconds', 'gauge', 'Seconds since the server last sent a KeepAlive', 'keep_alive_age'),
+    ('mcidle_reconnects_total', 'counter', 'Times the account reconnected to its server', 'reconnects'),
+    ('mcidle_client_queue_bytes', 'gauge', 'Bytes waiting to be sent to the local client', 'client_queue'),
+    ('mcidle_server_queue_bytes', 'gauge', 'Bytes waiting to be sent to the server', 'server_queue'),
+    ('mcidle_dropped_packets_total', 'counter', 'Packets dropped because a queue was full', 'dropped'),
+    ('mcidle_dropped_bytes_total', 'counter', 'Bytes dropped because a queue was full', 'dropped_bytes'),
+    ('mcidle_queue_overflows_total', 'counter', 'Times a full queue disconnected a socket', 'queue_overflows'),
+)
+
+HISTOGRAMS = {
+    'decode': 'Seconds spent decoding a frame into a packet',
+    'process': 'Seconds spent applying a packet from the server to the game state',
+    'join': 'Seconds spent replaying the world to a joining client',
+}
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                          .replace('\n', '\\n')) for key, value in labels.items())
+
+
+class Exposition:
+    """ Samples grouped by metric family, written out in the Prometheus text format """
+    def __init__(self):
+        self.families = {}  # Metric -> (type, help, sample lines)
+
+    def add(self, name, kind, help, value, labels=None, suffix=''):
+        family = self.families.setdefault(name, (kind, help, []))
+        family[2].append('%s%s%s %s' % (name, suffix, format_labels(labels), format_value(value)))
+
+    def histogram(self, name, help, histogram, labels):
+        """ A metrics Histogram snapshot, its buckets become cumulative like Prometheus expects """
+        total = 0
+        for bound, count in zip(histogram['bounds'], histogram['counts']):
+            total += count
+            self.add(name, 'histogram', help, total, dict(labels, le=format_value(float(bound))), '_bucket')
+        self.add(name, 'histogram', help, histogram['count'], dict(labels, le='+Inf'), '_bucket')
+        self.add(name, 'histogram', help, histogram['sum'], labels, '_sum')
+        self.add(name, 'histogram', help, histogram['count'], labels, '_count')
+
+    def text(self):
+        lines = []
+        for name, (kind, help, samples) in self.families.items():
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+def render(sessions, auth_requests=None, extra=()):
+    """ The text exposition of SessionStatus snapshots, labelled by account
+        auth_requests is {endpoint: requests} and extra holds (metric, type, help, value) to add as-is
+    """
+    exposition = Exposition()
+    for session in sessions:
+        labels = {'account': session['name']}
+        for name, kind, help, key in SESSION_METRICS:
+            value = session.get(key)
+            if value is not None:
+                exposition.add(name, kind, help, value, labels)
+
+        metrics = session.get('metrics')
+        if not metrics:
+            continue
+
+        exposition.add('mcidle_worker_queue_packets', 'gauge', 'Packets from the server waiting to be processed', \
+                       metrics['gauges'].get('worker_queue', 0), labels)
+        for direction, counters in sorted(metrics['packets'].items()):
+            for packet_id, (count, nbytes) in sorted(counters.items()):
+                packet_labels = dict(labels, direction=direction, \
+                                     id='other' if packet_id == OVERFLOW else '0x%02X' % packet_id)
+                exposition.add('mcidle_packets_total', 'counter', 'Packets read per direction and packet ID', \
+                               count, packet_labels)
+                exposition.add('mcidle_packet_bytes_total', 'counter', 'Bytes read per direction and packet ID', \
+                               nbytes, packet_labels)
+        for name, histogram in sorted(metrics['histograms'].items()):
+            exposition.histogram('mcidle_%s_seconds' % name, HISTOGRAMS.get(name, name), histogram, labels)
+
+    for endpoint, count in sorted((auth_requests or {}).items()):
+        exposition.add('mcidle_auth_requests_total', 'counter', 'Requests made to the auth and session servers', \
+                       count, {'endpoint': endpoint})
+
+    for name, kind, help, value in extra:
+        exposition.add(name, kind, help, value)
+    return exposition.text()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+
+        body = self.server.collect().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Don't print a line for every scrape
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """ Serves the text returned by collect() at /metrics from a daemon thread """
+    daemon_threads = True
+
+    def __init__(self, address, collect):
+        HTTPServer.__init__(self, address, MetricsHandler)
+        self.collect = collect
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name='mcidle-metrics', daemon=True).start()
+        print("Serving metrics on http://%s:%s/metrics" % self.server_address[:2], flush=True)
+        return self
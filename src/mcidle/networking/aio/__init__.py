@@ -0,0 +1,3 @@
+from .stream import PacketStream
+from .connection import AsyncMinecraftConnection
+from .listener import AsyncListener
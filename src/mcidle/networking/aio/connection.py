@@ -0,0 +1,340 @@
+import asyncio
+import time
+import zlib
+
+import requests
+
+from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
+
+from mcidle.networking.auth import Auth
+from mcidle.networking.auth.exceptions import YggdrasilError
+from mcidle.networking.encryption import (
+    encrypt_token_and_secret, generate_verification_hash, generate_shared_secret, get_keypair
+)
+from mcidle.networking.connection import JOIN_PACKETS, DROPPABLE_CLIENTBOUND, DROPPABLE_SERVERBOUND, is_loopback
+from mcidle.networking.game_state import GameState
+from mcidle.networking.metrics import Metrics
+from mcidle.networking.anti_afk import anti_afk_steps
+from mcidle.networking.upstream import batches, BLOCK, DROP
+from mcidle.networking.packet_handler import ClientboundProcessor, ServerboundProcessor
+from mcidle.networking.packets.serverbound import (
+    Handshake, LoginStart, EncryptionResponse, ClientStatus, TeleportConfirm
+)
+from mcidle.networking.packets.clientbound import EncryptionRequest, SetCompression, LoginSuccess
+from mcidle.networking.packets.registry import registry, PLAY, CLIENTBOUND, SERVERBOUND
+from mcidle.networking.packets.exceptions import InvalidPacketID
+
+from .stream import PacketStream
+
+
+class AsyncMinecraftConnection:
+    """ One idle session run as coroutines on an event loop instead of threads
+
+        Behaves like MinecraftConnection: logs in to the target server, processes
+        and forwards its packets, keeps the player from being kicked for being AFK
+        and replays the cached world to local clients that attach
+    """
+    def __init__(self, username, ip, protocol, port=25565, profile=None, listener=None, anti_afk_rate=30, \
+                 chunk_budget=0, chunk_radius=0, spill_dir=None, client_queue_limit=0, client_queue_policy=DROP, \
+                 server_queue_limit=0, server_queue_policy=BLOCK, compression_level=-1, client_compression_level=1, \
+                 loopback_uncompressed=False, max_batch_size=1 << 18):
+        self.address = (ip, port)
+        self.username = username
+        self.protocol = protocol
+        self.listener = listener
+        self.anti_afk_rate = anti_afk_rate
+
+        self.packets = registry.resolve(protocol, PLAY, CLIENTBOUND)
+        self.droppable_clientbound = set(self.packets.ids(*DROPPABLE_CLIENTBOUND))
+        self.droppable_serverbound = set(registry.resolve(protocol, PLAY, SERVERBOUND).ids(*DROPPABLE_SERVERBOUND))
+        self.game_state = GameState(self.packets.ids(*JOIN_PACKETS), chunk_budget, chunk_radius, spill_dir, \
+                                    self.packets)
+        self.packet_processor = ClientboundProcessor(self.game_state, protocol)
+        self.serverbound_processor = ServerboundProcessor(self.game_state, protocol)
+
+        self.auth = Auth(username, profile)
+
+        self.compression_threshold = None
+        # zlib levels of what we serialise for the server and for the local client, see Packet.write
+        self.compression_level = compression_level
+        self.client_compression = (client_compression_level, loopback_uncompressed)
+        self.max_batch_size = max_batch_size
+        self.VerifyToken = None
+
+        self.server = None  # Stream to the target server
+        self.client = None  # Stream of the attached local client
+        self.client_joining = False
+
+        self.queue = None
+
+        # Write buffer limits of the streams to the client and to the server, and what they dropped
+        self.client_queue = (client_queue_limit, client_queue_policy)
+        self.server_queue = (server_queue_limit, server_queue_policy)
+        self.client_stats = {'dropped': 0, 'dropped_bytes': 0, 'overflows': 0}
+        self.server_stats = {'dropped': 0, 'dropped_bytes': 0, 'overflows': 0}
+
+        self.metrics = Metrics()
+        self.metrics.gauge('worker_queue', lambda: self.queue.qsize() if self.queue is not None else 0)
+        self.metrics.gauge('client_queue', lambda: self.queue_stats()['client_queue'])
+        self.metrics.gauge('server_queue', lambda: self.queue_stats()['server_queue'])
+
+    def client_attached(self):
+        return self.client is not None
+
+    def queue_stats(self):
+        """ Bytes waiting to be sent to the client and to the server, and what was dropped """
+        client, server = self.client, self.server
+        return {
+            'client_queue': client.depth() if client is not None else 0,
+            'server_queue': server.depth() if server is not None else 0,
+            'dropped': self.client_stats['dropped'] + self.server_stats['dropped'],
+            'dropped_bytes': self.client_stats['dropped_bytes'] + self.server_stats['dropped_bytes'],
+            'queue_overflows': self.client_stats['overflows'] + self.server_stats['overflows'],
+        }
+
+    async def run(self):
+        """ Run the session until the target server disconnects us """
+        loop = asyncio.get_event_loop()
+
+        # Make sure the access token we are using is still valid
+        # Other sessions share the loop, a failure here only ends this one so it can reconnect
+        try:
+            await loop.run_in_executor(None, self.auth.validate)
+        except (YggdrasilError, ConnectionError, requests.RequestException) as e:
+            print("Failed to validate the access token: %s" % e, flush=True)
+            self.game_state.close()
+            return
+
+        try:
+            self.server = await PacketStream.open(*self.address, max_batch_size=self.max_batch_size)
+            self.server.set_limit(*self.server_queue, stats=self.server_stats)
+            self.server.frames.timer = self.metrics.decode
+            print("Connected MinecraftConnection", flush=True)
+        except OSError:
+            print("Cannot connect to target server, connection refused!", flush=True)
+            self.game_state.close()
+            return
+
+        try:
+            if not await self.login():
+                print("Failed to log in!", flush=True)
+                return
+
+            print("Switched to idling.", flush=True)
+            self.queue = asyncio.Queue()
+            tasks = [asyncio.ensure_future(self.process()), asyncio.ensure_future(self.anti_afk())]
+
+            # Start accepting local clients only once we're officially connected
+            if self.listener:
+                self.listener.set_session(self)
+
+            try:
+                await self.idle()
+            finally:
+                for task in tasks:
+                    task.cancel()
+        finally:
+            if self.listener:
+                self.listener.set_session(None)
+            if self.client:
+                self.client.close()
+                self.client = None
+            self.server.close()
+            self.game_state.close()
+
+    async def login(self):
+        """ Do all the authentication and logging in """
+        loop = asyncio.get_event_loop()
+        try:
+            print("Sending handshake", flush=True)
+            self.server.write_packet(Handshake(ProtocolVersion=self.protocol, ServerAddress=self.address[0], \
+                                               ServerPort=self.address[1], NextState=2))
+            self.server.write_packet(LoginStart(Name=self.username))
+
+            encryption_request = EncryptionRequest().read((await self.server.read_packet()).packet_buffer)
+            self.VerifyToken = encryption_request.VerifyToken
+
+            # Generate the encryption response to send over
+            shared_secret = generate_shared_secret()
+            (encrypted_token, encrypted_secret) = encrypt_token_and_secret(encryption_request.PublicKey,
+                                                                           encryption_request.VerifyToken, shared_secret)
+
+            # Generate an auth token, serverID is always empty
+            server_id_hash = generate_verification_hash(encryption_request.ServerID, shared_secret,
+                                                        encryption_request.PublicKey)
+
+            # Client auth, a blocking HTTP request so keep it off the event loop
+            await loop.run_in_executor(None, self.auth.join, server_id_hash)
+
+            self.server.write_packet(EncryptionResponse(SharedSecret=encrypted_secret, VerifyToken=encrypted_token))
+            self.server.enable_encryption(shared_secret)
+            print("Enabled encryption", flush=True)
+
+            # We aren't sure if compression will be sent, or LoginSuccess immediately after
+            packet = await self.server.read_packet()
+            if packet.id == SetCompression.id:
+                self.compression_threshold = SetCompression().read(packet.packet_buffer).Threshold
+                self.server.compression_threshold = self.compression_threshold
+                self.server.compression_level = self.compression_level
+                print("Set compression threshold to %s" % self.compression_threshold, flush=True)
+                packet = await self.server.read_packet()
+            else:
+                self.compression_threshold = -1  # disabled
+
+            login_success = LoginSuccess().read(packet.packet_buffer)
+            self.game_state.client_uuid = login_success.UUID
+            self.game_state.client_username = login_success.Username
+            print(login_success.UUID, login_success.Username, flush=True)
+        except (EOFError, ValueError, AttributeError, InvalidPacketID, YggdrasilError, ConnectionError, \
+                requests.RequestException, zlib.error):
+            return False
+        return True
+
+    async def idle(self):
+        """ Read packets from the target server, process them and forward them to the client """
+        while True:
+            try:
+                packet = await self.server.read_packet()
+            except (EOFError, ConnectionError):
+                print("Disconnected from server, closing", flush=True)
+                return
+            except (ValueError, zlib.error) as e:
+                print("Invalid packet from server (%s), closing" % e, flush=True)
+                return
+
+            self.metrics.clientbound.count(packet.id, len(packet.frame))
+            # The processor forwards it to the client once it's applied
+            self.queue.put_nowait(packet)
+
+            # With the block policy a slow client holds up reading from the server, the
+            # packets already read are still processed so KeepAlive's keep being answered
+            client = self.client
+            if client is not None:
+                try:
+                    await client.pace()
+                except ConnectionError:
+                    pass
+
+    async def process(self):
+        """ Mutate the game state, answer the packets that need a response and forward them
+
+            Forwarding only after a packet is applied means a joining client, which is
+            attached right after its replay snapshot, gets every packet exactly once
+        """
+        while True:
+            packet = await self.queue.get()
+            try:
+                start = time.perf_counter()
+                response = self.packet_processor.process_packet(packet)
+                self.metrics.process.since(start)
+            except Exception as e:
+                # Nothing waits on this task, dying here would leave KeepAlive's unanswered
+                print("Failed to process packet 0x%02X: %r" % (packet.id, e), flush=True)
+                continue
+
+            if response:
+                self.server.write_packet(response)
+
+            # Ignore KeepAlive's because those are answered here
+            client = self.client
+            if client is not None and packet.id != self.packets.KeepAlive.id:
+                client.forward(packet.frame, packet.id in self.droppable_clientbound)
+
+    async def anti_afk(self):
+        """ Move around while no client is attached to prevent AFK kicks """
+        while True:
+            if self.game_state.received_position and self.client is None:
+                for packet, delay in anti_afk_steps(self.game_state):
+                    self.server.write_packet(packet)
+                    if delay:
+                        await asyncio.sleep(delay)
+            await asyncio.sleep(self.anti_afk_rate)
+
+    async def serve_client(self, client):
+        """ Log a local client in, replay the world to it and forward what it sends """
+        if self.client is not None or self.client_joining:
+            print("Rejected client, client already connected", flush=True)
+            client.close()
+            return
+
+        client.frames.timer = self.metrics.decode
+        self.client_joining = True
+        try:
+            joined = await self.join_client(client)
+        finally:
+            self.client_joining = False
+
+        if not joined:
+            client.close()
+            return
+
+        try:
+            while True:
+                packet = await client.read_packet()
+                self.metrics.serverbound.count(packet.id, len(packet.frame))
+                if packet.id != TeleportConfirm.id:  # Sending these will crash us
+                    self.serverbound_processor.process_packet(packet)
+                    self.server.forward(packet.frame, packet.id in self.droppable_serverbound)
+                    await self.server.pace()
+        except (EOFError, ValueError, ConnectionError):
+            print("Client disconnected. Closing client", flush=True)
+        finally:
+            if self.client is client:
+                self.client = None
+            client.close()
+
+    async def join_client(self, client):
+        loop = asyncio.get_event_loop()
+        try:
+            print("Reading handshake", flush=True)
+            Handshake().read((await client.read_packet()).packet_buffer)
+            LoginStart().read((await client.read_packet()).packet_buffer)
+
+            privkey, pubkey = await loop.run_in_executor(None, get_keypair)
+            client.write_packet(EncryptionRequest(ServerID='', PublicKey=pubkey, VerifyToken=self.VerifyToken))
+
+            encryption_response = EncryptionResponse().read((await client.read_packet()).packet_buffer)
+
+            # Decrypt and verify the verify token
+            verify_token = privkey.decrypt(encryption_response.VerifyToken, PKCS1v15())
+            assert (verify_token == self.VerifyToken)
+
+            # Decrypt the shared secret and enable encryption with it
+            client.enable_encryption(privkey.decrypt(encryption_response.SharedSecret, PKCS1v15()))
+
+            if self.compression_threshold >= 0:
+                client.write_packet(SetCompression(Threshold=self.compression_threshold))
+                client.compression_threshold = self.compression_threshold
+                level, loopback_uncompressed = self.client_compression
+                client.compression_level = 0 if loopback_uncompressed and is_loopback(client.socket()) else level
+
+            client.write_packet(LoginSuccess(Username=self.game_state.client_username, \
+                                             UUID=self.game_state.client_uuid))
+            client.max_batch_size = self.max_batch_size
+
+            print("Joining world", flush=True)
+            # Nothing else runs until we yield to the loop, so the snapshot and attaching the
+            # client happen at one version of the game state and no forwarded packet is missed
+            # Those are held back until the replay is written, which yields while it's encrypted
+            start = time.perf_counter()
+            with self.game_state.state_lock:
+                snapshot = self.game_state.replay.snapshot(client.compression_threshold, client.compression_level)
+            frames = snapshot.frames()
+            client.hold()
+            self.client = client
+            await client.write_batches(batches(frames, client.max_batch_size))
+            await client.release()
+            self.metrics.join.since(start)
+
+            # Player sends ClientStatus, this is important for respawning if died
+            self.server.write_packet(ClientStatus(ActionID=0))
+
+            await client.drain()
+            # Only bound the buffer once the replay is out, the limit is for forwarded packets
+            client.set_limit(*self.client_queue, stats=self.client_stats)
+            print("Finished joining world", flush=True)
+        except (ValueError, EOFError, InvalidPacketID, AttributeError, AssertionError, ConnectionError):
+            if self.client is client:
+                self.client = None
+            return False
+        return True
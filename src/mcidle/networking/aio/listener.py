@@ -0,0 +1,36 @@
+import asyncio
+
+from .stream import PacketStream
+
+
+class AsyncListener:
+    """ Accepts local clients and hands them to the current session
+        It outlives sessions so the port stays bound across reconnects
+    """
+    def __init__(self, address):
+        self.address = address
+        self.session = None
+        self.server = None
+
+    def set_session(self, session):
+        self.session = session
+        return self
+
+    async def start(self):
+        host, port = self.address
+        self.server = await asyncio.start_server(self.accept, host or None, port)
+
+    def close(self):
+        if self.server:
+            self.server.close()
+
+    async def accept(self, reader, writer):
+        client = PacketStream(reader, writer)
+        session = self.session
+        if session is None:
+            print("Rejected client, not connected to the target server", flush=True)
+            client.close()
+            return
+
+        print("Client connected", flush=True)
+        await session.serve_client(client)
@@ -0,0 +1,136 @@
+import asyncio
+
+from mcidle.networking.encryption import create_AES_cipher
+from mcidle.networking.packet_handler import PacketStreamReader
+from mcidle.networking.upstream import batches, BLOCK, DROP, POLICIES
+from mcidle.networking.workers import workers
+
+
+class PacketStream:
+    """ Reads and writes packets over an asyncio StreamReader/StreamWriter pair
+        Frames are parsed by the same PacketStreamReader the threaded engine uses
+
+        Forwarded frames go through forward(), which keeps the transport's write buffer
+        under max_bytes (0 is unbounded) following the same policies as UpstreamThread.
+        Batches of frames are written max_batch_size bytes at a time
+    """
+    _read_size = 1 << 16
+
+    def __init__(self, reader, writer, max_batch_size=1 << 18):
+        self.reader = reader
+        self.writer = writer
+        self.max_batch_size = max_batch_size
+        self.frames = PacketStreamReader()
+        self.compression_threshold = None
+        self.compression_level = -1
+        self.encryptor = None
+        self.decryptor = None
+
+        self.max_bytes = 0
+        self.policy = BLOCK
+        self.stats = {'dropped': 0, 'dropped_bytes': 0, 'overflows': 0}
+
+        self.held = None  # Forwarded frames held back by hold() until release()
+
+    @staticmethod
+    async def open(host, port, max_batch_size=1 << 18):
+        reader, writer = await asyncio.open_connection(host, port)
+        return PacketStream(reader, writer, max_batch_size)
+
+    def enable_encryption(self, shared_secret):
+        cipher = create_AES_cipher(shared_secret)
+        self.encryptor = cipher.encryptor()
+        self.decryptor = cipher.decryptor()
+        # Anything buffered past the last frame was read before decryption
+        self.frames.set_stream(None, self.decryptor)
+
+    async def read_packet(self):
+        packet = self.frames.next_packet(self.compression_threshold)
+        while packet is None:
+            data = await self.reader.read(self._read_size)
+            if not data:
+                raise EOFError("Unexpected end of stream.")
+
+            if self.decryptor is not None:
+                # Reads are awaited one at a time so the decryptor still sees them in order
+                data = await workers.run(self.decryptor.update, data)
+            self.frames.feed(data)
+            packet = self.frames.next_packet(self.compression_threshold)
+        return packet
+
+    def set_limit(self, max_bytes, policy, stats=None):
+        """ Bound the write buffer, drops and overflows are counted in `stats` """
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy %s" % policy)
+        self.max_bytes = max_bytes
+        self.policy = policy
+        if stats is not None:
+            self.stats = stats
+        if max_bytes:
+            # drain() waits while more than this is buffered
+            self.writer.transport.set_write_buffer_limits(high=max_bytes)
+
+    def depth(self):
+        """ Bytes written but not sent yet """
+        return self.writer.transport.get_write_buffer_size()
+
+    def write(self, data):
+        if self.encryptor is not None:
+            data = self.encryptor.update(data)
+        self.writer.write(data)
+
+    async def write_batches(self, chunks):
+        """ Write chunks, encrypting the large ones on the worker pool while the loop carries on
+            Nothing else may write to the stream until this returns or the cipher gets out of order
+        """
+        for data in chunks:
+            if self.encryptor is not None:
+                data = await workers.run(self.encryptor.update, data)
+            self.writer.write(data)
+
+    def hold(self):
+        """ Queue up forwarded frames instead of writing them, e.g while the world replay is written """
+        self.held = []
+
+    async def release(self):
+        """ Write the frames held back since hold() in order and go back to writing them directly """
+        while self.held:
+            held, self.held = self.held, []
+            await self.write_batches(batches(held, self.max_batch_size))
+        self.held = None
+
+    def forward(self, data, droppable=False):
+        """ Write a forwarded frame, returns False if it was dropped because the buffer is full """
+        if self.held is not None:
+            self.held.append(data)
+            return True
+        if self.policy == BLOCK or not self.max_bytes or self.depth() + len(data) <= self.max_bytes:
+            self.write(data)
+            return True
+
+        self.stats['dropped'] += 1
+        self.stats['dropped_bytes'] += len(data)
+        if self.policy == DROP and droppable:
+            return False
+
+        self.stats['overflows'] += 1
+        print("Write buffer is full (%s bytes), disconnecting" % self.depth(), flush=True)
+        self.writer.transport.abort()
+        return False
+
+    async def pace(self):
+        """ Wait for the buffer to drain when it's over the limit and the policy is to block """
+        if self.policy == BLOCK and self.max_bytes and self.depth() > self.max_bytes:
+            await self.writer.drain()
+
+    def write_packet(self, packet):
+        self.write(packet.write(self.compression_threshold, self.compression_level).bytes)
+
+    async def drain(self):
+        await self.writer.drain()
+
+    def socket(self):
+        return self.writer.get_extra_info('socket')
+
+    def close(self):
+        self.writer.close()
@@ -6,6 +6,30 @@ from mcidle.networking.packets.serverbound import Animation, ChatMessage, Player
 from random import randint, uniform
 
 
+def anti_afk_steps(game_state):
+    """ Yields (packet to send, seconds to wait afterwards) for one round of anti-AFK """
+    print("Sent AntiAFK packet", flush=True)
+    # Try spamming /help
+    yield ChatMessage(Message="/help"), 0
+    # Swing arm randomly
+    yield Animation(Hand=randint(0, 1)), 0
+
+    if game_state.player_pos:
+        # Move 3 blocks ahead and back
+        for off in range(0, 30):
+            pos = game_state.player_pos
+            yield PlayerPosition(X=pos[0] + 0.1 * off, Y=pos[1] + 0.1, Z=pos[2], OnGround=True), 0.1
+
+        for off in range(30, 0, -1):
+            pos = game_state.player_pos
+            yield PlayerPosition(X=pos[0] + 0.1 * off, Y=pos[1] + 0.1, Z=pos[2], OnGround=True), 0.1
+
+    print(game_state.player_pos, flush=True)
+
+    # Look around
+    yield PlayerLook(Yaw=uniform(0, 360), Pitch=uniform(0, 360), OnGround=True), 0
+
+
 class AntiAFKThread(threading.Thread):
     def __init__(self, connection, rate=30):
         threading.Thread.__init__(self, daemon=True)
@@ -20,30 +44,8 @@ class AntiAFKThread(threading.Thread):
         while self.running:
             if self.connection.game_state.received_position \
                     and not (self.connection.client_upstream and self.connection.client_upstream.connected()):
-                print("Sent AntiAFK packet", flush=True)
-                # Try spamming /help
-                self.connection.send_packet(ChatMessage(Message="/help"))
-                # Swing arm randomly
-                self.connection.send_packet(Animation(Hand=randint(0, 1)))
-
-                if self.connection.game_state.player_pos:
-                    # Move 3 blocks ahead and back
-                    for off in range(0, 30):
-                        pos = self.connection.game_state.player_pos
-                        self.connection.send_packet(PlayerPosition(X=pos[0] + 0.1 * off, \
-                                                                   Y=pos[1] + 0.1, Z=pos[2], OnGround=True))
-                        time.sleep(0.1)
-
-                    for off in range(30, 0, -1):
-                        pos = self.connection.game_state.player_pos
-                        self.connection.send_packet(PlayerPosition(X=pos[0] + 0.1 * off, \
-                                                                   Y=pos[1] + 0.1, Z=pos[2], OnGround=True))
-                        time.sleep(0.1)
-
-                print(self.connection.game_state.player_pos, flush=True)
-
-                # Look around
-                self.connection.send_packet(PlayerLook(Yaw=uniform(0, 360), Pitch=uniform(0, 360), OnGround=True))
+                for packet, delay in anti_afk_steps(self.connection.game_state):
+                    self.connection.send_packet(packet)
+                    if delay:
+                        time.sleep(delay)
             time.sleep(self.rate)
-
-
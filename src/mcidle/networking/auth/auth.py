@@ -12,6 +12,12 @@ CONTENT_TYPE = "application/json"
 HEADERS = {"content-type": CONTENT_TYPE}
 CREDENTIALS_FILENAME = './credentials.json'
 
+# One HTTP session (and connection pool) shared by every account in the process
+_session = requests.Session()
+
+# Requests made to the auth and session servers by endpoint, for every account in the process
+request_counts = {}
+
 
 class Auth:
     """
@@ -74,21 +80,21 @@ class Auth:
 
         return True
 
-    def save_to_disk(credentials):
-        with open(CREDENTIALS_FILENAME, 'w') as outfile:
+    def save_to_disk(credentials, filename=CREDENTIALS_FILENAME):
+        with open(filename, 'w') as outfile:
             json.dump(credentials, outfile)
 
-    def read_from_disk():
-        with open(CREDENTIALS_FILENAME, 'r') as infile:
+    def read_from_disk(filename=CREDENTIALS_FILENAME):
+        with open(filename, 'r') as infile:
             return json.load(infile)
 
-    def has_credentials():
+    def has_credentials(filename=CREDENTIALS_FILENAME):
         import os
-        return os.path.isfile(CREDENTIALS_FILENAME)
+        return os.path.isfile(filename)
 
-    def delete_credentials():
+    def delete_credentials(filename=CREDENTIALS_FILENAME):
         import os
-        os.remove(CREDENTIALS_FILENAME)
+        os.remove(filename)
 
     def authenticate(self, username, password):
         """
@@ -277,7 +283,8 @@ def _make_request(server, endpoint, data):
     Returns:
         A `requests.Request` object.
     """
-    res = requests.post(server + "/" + endpoint, data=json.dumps(data),
+    request_counts[endpoint] = request_counts.get(endpoint, 0) + 1
+    res = _session.post(server + "/" + endpoint, data=json.dumps(data),
                         headers=HEADERS)
     return res
 
@@ -0,0 +1,178 @@
+from math import floor
+from zlib import compress, decompress
+
+from .workers import workers
+
+
+def nearest_first(keys, center):
+    """ Chunk keys sorted by their distance from `center`, rings are ordered from their middle out
+        Without a center this is the order they're in
+    """
+    if center is None:
+        return list(keys)
+    cx, cz = center
+
+    def order(key):
+        dx, dz = key[0] - cx, key[1] - cz
+        return max(abs(dx), abs(dz)), dx * dx + dz * dz
+    return sorted(keys, key=order)
+
+
+class ChunkStore:
+    """ Cached ChunkData frames keyed by (ChunkX, ChunkZ)
+
+        Only the on-wire frame is kept, ready to be replayed as-is. When the server
+        left a chunk uncompressed (compression disabled or a huge threshold) a zlib
+        copy is kept instead and inflated again at replay time.
+
+        Chunks are ordered by their distance from the chunk the player is in (the center).
+        With a budget (in bytes) the farthest chunks are evicted once the stored frames
+        take up more than the budget, 0 means no budget. Enough are evicted to get down
+        to low_water of the budget so the chunks aren't sorted again for every chunk added.
+        With a radius (in chunks) everything beyond it is dropped whenever the budget is
+        exceeded or the player moves into another chunk, which also cleans up chunks
+        whose UnloadChunk was missed.
+
+        The stored bytes go into `storage`, a dict by default. Chunks are only read when
+        a client joins so a SpillFile can keep them on disk instead.
+    """
+    def __init__(self, budget=0, radius=0, level=6, storage=None, low_water=0.9):
+        self.budget = budget
+        self.low_water = low_water
+        self.radius = radius
+        self.level = level
+
+        # (ChunkX, ChunkZ) -> stored bytes
+        self.storage = storage if storage is not None else {}
+        # (ChunkX, ChunkZ) -> (stored size, whether the stored bytes are a zlib copy of the frame)
+        self.frames_ = {}
+        self.nbytes = 0
+        self.evicted = 0
+
+        self.center = None  # (ChunkX, ChunkZ) of the player, None until we know where they are
+
+        # Called whenever the stored chunks or their order change
+        self.on_change = None
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def __len__(self):
+        return len(self.frames_)
+
+    def __contains__(self, key):
+        return key in self.frames_
+
+    def __delitem__(self, key):
+        size, _ = self.frames_.pop(key)
+        del self.storage[key]
+        self.nbytes -= size
+        self.changed()
+
+    def keys(self):
+        return self.frames_.keys()
+
+    def set_center(self, x, z):
+        """ Move the center to the chunk containing block coordinates x, z """
+        center = (int(floor(x)) >> 4, int(floor(z)) >> 4)
+        if center != self.center:
+            self.center = center
+            self.changed()
+            if self.radius:
+                self.evict(self.beyond(self.radius))
+
+    def distance(self, key):
+        """ Chebyshev distance in chunks from the center, view distance is a square too """
+        if self.center is None:
+            return 0
+        return max(abs(key[0] - self.center[0]), abs(key[1] - self.center[1]))
+
+    def nearest(self):
+        """ Keys sorted nearest first, rings are ordered from their middle out
+            Without a center this is insertion order
+        """
+        return nearest_first(self.frames_, self.center)
+
+    def beyond(self, radius):
+        return [key for key in self.frames_ if self.distance(key) > radius]
+
+    def evict(self, keys):
+        for key in keys:
+            del self[key]
+            self.evicted += 1
+        if keys:
+            print("Evicted %s chunk(s), %s left" % (len(keys), len(self.frames_)), flush=True)
+
+    def add(self, key, packet):
+        """ Cache a chunk's RawPacket, keeping only its frame """
+        data, packed = packet.frame, False
+        if not packet.data_length:
+            packed_data = compress(data, self.level)
+            if len(packed_data) < len(data):
+                data, packed = packed_data, True
+
+        if key in self.frames_:
+            self.nbytes -= self.frames_[key][0]
+        self.storage[key] = data
+        self.frames_[key] = (len(data), packed)
+        self.nbytes += len(data)
+        self.changed()
+        self.enforce_budget()
+
+    def enforce_budget(self):
+        if not self.budget or self.nbytes <= self.budget:
+            return
+
+        if self.radius:
+            self.evict(self.beyond(self.radius))
+
+        if self.nbytes <= self.budget:
+            return
+
+        # Still over budget, drop the farthest chunks but never the last one
+        evicted = []
+        keys = self.nearest()
+        over = self.nbytes - int(self.budget * self.low_water)
+        while over > 0 and len(keys) > 1:
+            key = keys.pop()
+            evicted.append(key)
+            over -= self.frames_[key][0]
+        self.evict(evicted)
+
+    def frame(self, key):
+        """ The frame of a cached chunk, exactly as the server sent it
+            This is a memoryview over the mapped file when the chunks are spilled to disk
+        """
+        data = self.storage[key]
+        return decompress(data) if self.frames_[key][1] else data
+
+    def snapshot(self):
+        """ The center and (key, stored bytes, whether they're a zlib copy) of every cached chunk
+            Only references are taken so this is quick enough to do under the game state's lock,
+            stored bytes are replaced and never changed so they stay valid. Pass it to build()
+        """
+        storage = self.storage
+        return self.center, [(key, storage[key], packed) for key, (_, packed) in self.frames_.items()]
+
+    @staticmethod
+    def build(snapshot):
+        """ The frames of a snapshot(), nearest to the player first
+            The zlib copies are inflated on the worker pool
+        """
+        center, chunks = snapshot
+        stored = {key: (data, packed) for key, data, packed in chunks}
+        keys = nearest_first(stored, center)
+        frames = [stored[key][0] for key in keys]
+        packed = [i for i, key in enumerate(keys) if stored[key][1]]
+        for i, frame in zip(packed, workers.map(decompress, [frames[i] for i in packed])):
+            frames[i] = frame
+        return frames
+
+    def frames(self):
+        """ Every cached frame, nearest to the player first """
+        return self.build(self.snapshot())
+
+    def memory(self):
+        """ Bytes taken up by the stored frames """
+        return self.nbytes
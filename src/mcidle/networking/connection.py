@@ -1,3 +1,4 @@
+import ipaddress
 import socket
 import threading
 
@@ -9,17 +10,34 @@ from .encryption import (
 
 from .packet_handler.serverbound import LoginHandler as ServerboundLoginHandler
 from .packet_handler.clientbound import LoginHandler as ClientboundLoginHandler
-from .packets.clientbound import Respawn, JoinGame
+from .packets.registry import registry, PLAY, CLIENTBOUND, SERVERBOUND
 
-from .packet_handler import WorkerProcessor, ClientboundProcessor
+from .packet_handler import WorkerProcessor, ClientboundProcessor, PacketStreamReader
 
-from .upstream import UpstreamThread
+from .upstream import UpstreamThread, BLOCK, DROP
 from .anti_afk import AntiAFKThread
 from .game_state import GameState
+from .metrics import Metrics
+
+# Packets replayed first to a joining client, in this order
+JOIN_PACKETS = ('JoinGame', 'ServerDifficulty', 'SpawnPosition', 'Respawn', 'SetExperience')
+
+# Packets that may be dropped when the queue they go into is full
+DROPPABLE_CLIENTBOUND = ('EntityRelativeMove', 'EntityLookAndRelativeMove', 'EntityLook', 'EntityHeadLook', \
+                         'EntityVelocity')
+DROPPABLE_SERVERBOUND = ('Animation',)
+
+
+def is_loopback(sock):
+    """ Whether the other end of a socket is on this machine """
+    try:
+        return ipaddress.ip_address(sock.getpeername()[0]).is_loopback
+    except (OSError, ValueError, TypeError, IndexError):
+        return False
 
 
 class Connection(threading.Thread):
-    def __init__(self, ip=None, port=None, upstream=None):
+    def __init__(self, ip=None, port=None, upstream=None, metrics=None):
         threading.Thread.__init__(self, daemon=True)
         self.threshold = None
         self.address = (ip, port)
@@ -27,11 +45,16 @@ class Connection(threading.Thread):
 
         self.socket = None
         self.stream = None
+        self.reader = None
 
         self.upstream_lock = threading.RLock()
         self.upstream = upstream
 
         self.compression_threshold = None
+        # The zlib level of packets we serialise ourselves, see Packet.write
+        self.compression_level = -1
+
+        self.metrics = metrics
 
         # By default we generate a new socket for our upstream
         # But this is replaced in MinecraftServer with the client
@@ -53,7 +76,9 @@ class Connection(threading.Thread):
 
     def initialize_socket(self, sock):
         self.socket = sock
-        self.stream = self.socket.makefile('rb')
+        # Unbuffered, the reader does its own buffering
+        self.stream = self.socket.makefile('rb', buffering=0)
+        self.reader = PacketStreamReader(self.stream, timer=self.metrics.decode if self.metrics else None)
 
     def destroy_socket(self):
         try:
@@ -61,6 +86,7 @@ class Connection(threading.Thread):
                 self.socket.close()
             self.socket = None
             self.stream = None
+            self.reader = None
             print("Socket shutdown and closed.", flush=True)
         except OSError:
             print("Failed to reset socket", flush=True)
@@ -79,6 +105,8 @@ class Connection(threading.Thread):
             if self.upstream:
                 self.upstream.set_socket(self.socket)
         self.stream = EncryptedFileObjectWrapper(self.stream, decryptor)
+        # Anything the reader buffered past the last frame was read before decryption
+        self.reader.set_stream(self.stream, decryptor)
 
     def initialize_connection(self):
         return True
@@ -90,20 +118,20 @@ class Connection(threading.Thread):
         self.destroy_socket()
 
     def send_packet_buffer_raw(self, packet_buffer):
-        self.socket.send(packet_buffer.bytes)
+        self.socket.sendall(packet_buffer.bytes)
 
     def send_packet_raw(self, packet):
-        self.socket.send(packet.write(self.compression_threshold).bytes)
+        self.socket.sendall(packet.write(self.compression_threshold, self.compression_level).bytes)
 
     def send_packet(self, packet):
         with self.upstream_lock:
             if self.upstream:
-                self.upstream.put(packet.write(self.compression_threshold).bytes)
+                self.upstream.put(packet.write(self.compression_threshold, self.compression_level).bytes)
 
-    def send_packet_buffer(self, packet_buffer):
+    def send_packet_buffer(self, packet_buffer, droppable=False):
         with self.upstream_lock:
             if self.upstream:
-                self.upstream.put(packet_buffer.bytes)
+                self.upstream.put(packet_buffer.bytes, droppable)
 
     def send_packet_dict(self, id_, m):
         if id_ in m:
@@ -139,8 +167,14 @@ class Connection(threading.Thread):
 
 # Assume that a MinecraftConnection has to stay active at all times
 class MinecraftConnection(Connection):
-    def __init__(self, username, ip, protocol, port=25565, server_port=1001, profile=None, listen_thread=None):
-        super().__init__(ip, port, UpstreamThread())
+    def __init__(self, username, ip, protocol, port=25565, server_port=1001, profile=None, listen_thread=None, \
+                 max_batch_size=1 << 18, flush_latency=0.0, chunk_budget=0, \
+                 chunk_radius=0, spill_dir=None, client_queue_limit=0, client_queue_policy=DROP, \
+                 server_queue_limit=0, server_queue_policy=BLOCK, compression_level=-1, client_compression_level=1, \
+                 loopback_uncompressed=False):
+        super().__init__(ip, port, UpstreamThread(max_batch_size, flush_latency, server_queue_limit, server_queue_policy), \
+                         Metrics())
+        self.compression_level = compression_level
 
         self.username = username
         self.protocol = protocol
@@ -148,21 +182,28 @@ class MinecraftConnection(Connection):
         self.server_port = server_port
         self.listen_thread = listen_thread
 
-        # JoinGame, ServerDifficulty, SpawnPosition, Respawn, Experience
-        join_ids = [JoinGame.id, 0x0D, 0x46, Respawn.id, 0x40]
-        self.game_state = GameState(join_ids)
+        # Packet classes and IDs of the server's protocol version
+        self.packets = registry.resolve(protocol, PLAY, CLIENTBOUND)
+        self.droppable_clientbound = set(self.packets.ids(*DROPPABLE_CLIENTBOUND))
+        self.droppable_serverbound = set(registry.resolve(protocol, PLAY, SERVERBOUND).ids(*DROPPABLE_SERVERBOUND))
 
-        self.packet_processor = ClientboundProcessor(self.game_state)
+        self.game_state = GameState(self.packets.ids(*JOIN_PACKETS), chunk_budget, chunk_radius, spill_dir, \
+                                    self.packets)
+
+        self.packet_processor = ClientboundProcessor(self.game_state, protocol)
 
         self.client_connection = None
 
         self.local_client_upstream = None
         self.client_upstream_lock = threading.RLock()
 
+        # zlib level of what we serialise for the local client, 0 (uncompressed) on a loopback link if asked for
+        self.client_compression = (client_compression_level, loopback_uncompressed)
+
         # Keeping the child server's upstream alive as long as possible prevents the BrokenPipeError bug
         # So pass it in as a construction argument instead of something it spawns itself
         # Then we can just redirect its socket if need be
-        self.server_upstream = UpstreamThread()
+        self.server_upstream = UpstreamThread(max_batch_size, flush_latency, client_queue_limit, client_queue_policy)
         self.server_upstream.start()
 
         self.auth = Auth(username, profile)
@@ -179,6 +220,10 @@ class MinecraftConnection(Connection):
         # Process packets in another thread
         self.worker_processor = WorkerProcessor(self, self.packet_processor)
 
+        self.metrics.gauge('worker_queue', lambda: len(self.worker_processor.queue))
+        self.metrics.gauge('client_queue', self.server_upstream.depth)
+        self.metrics.gauge('server_queue', self.upstream.depth)
+
     @property
     def client_upstream(self):
         with self.client_upstream_lock:
@@ -188,12 +233,47 @@ class MinecraftConnection(Connection):
         with self.client_upstream_lock:
             self.local_client_upstream = upstream
 
-    # Sends to the client through its upstream if we have one
-    # Guarantees upstream is not set to None while putting
-    def send_to_client(self, packet):
+    def client_attached(self):
+        upstream = self.client_upstream
+        return upstream is not None and upstream.connected()
+
+    def client_target(self):
+        """ The client's upstream (or None) and its generation, taken while applying a packet
+            so it can be forwarded with send_to_client() once the game state's lock is released
+        """
         with self.client_upstream_lock:
-            if self.local_client_upstream:
-                self.local_client_upstream.put(packet.compressed_buffer.bytes)
+            upstream = self.local_client_upstream
+            return (upstream, upstream.generation()) if upstream else (None, None)
+
+    # Sends to the client that was attached when the packet was applied
+    # It's dropped if that client's queue was cleared since, a new client got it in its replay
+    def send_to_client(self, packet, target):
+        upstream, generation = target
+        if upstream:
+            upstream.put(packet.compressed_buffer.bytes, packet.id in self.droppable_clientbound, generation)
+
+    def pace(self):
+        """ Called by the reader, with the block policy a client that isn't keeping up holds up reading
+            from the server while the packets already read are still processed and KeepAlive's answered
+        """
+        upstream = self.client_upstream
+        if upstream is not None:
+            upstream.pace()
+
+    def client_compression_level(self, sock):
+        """ The zlib level to use for a local client connected through `sock` """
+        level, loopback_uncompressed = self.client_compression
+        return 0 if loopback_uncompressed and is_loopback(sock) else level
+
+    def queue_stats(self):
+        """ Bytes waiting in the queues to the client and to the server, and what they dropped """
+        return {
+            'client_queue': self.server_upstream.depth(),
+            'server_queue': self.upstream.depth(),
+            'dropped': self.server_upstream.dropped + self.upstream.dropped,
+            'dropped_bytes': self.server_upstream.dropped_bytes + self.upstream.dropped_bytes,
+            'queue_overflows': self.server_upstream.overflows + self.upstream.overflows,
+        }
 
     """ Connect to the socket and start a connection thread """
     def connect(self):
@@ -235,7 +315,7 @@ class MinecraftConnection(Connection):
 class MinecraftServer(Connection):
     """ Used for listening on a port for a connection """
     def __init__(self, mc_connection, port=25565, listen_thread=None, upstream=None):
-        super().__init__('localhost', port, upstream)
+        super().__init__('localhost', port, upstream, mc_connection.metrics)
         self.mc_connection = mc_connection
         self.packet_handler = ClientboundLoginHandler(self, mc_connection)
 
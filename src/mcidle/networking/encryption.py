@@ -1,17 +1,126 @@
 import os
+import threading
+import time
+from collections import deque
 from hashlib import sha1
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives.asymmetric.padding import PKCS1v15
 from cryptography.hazmat.primitives.serialization import load_der_public_key
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 
 from threading import RLock
 
+from .workers import workers
+
 
 def generate_shared_secret():
     return os.urandom(16)
 
 
+def generate_keypair():
+    """Generates a dummy RSA keypair for the login handshake with a local client.
+
+    :return: A tuple containing (private key, DER encoded public key)
+    """
+    privkey = rsa.generate_private_key(public_exponent=65537, key_size=2048, backend=default_backend())
+    pubkey = privkey.public_key().public_bytes(encoding=serialization.Encoding.DER,
+                                               format=serialization.PublicFormat.SubjectPublicKeyInfo)
+    return privkey, pubkey
+
+
+class KeyPool(object):
+    """Hands out the dummy RSA keypairs for local client logins.
+
+    Generating a 2048 bit key takes tens to hundreds of milliseconds, which a reattaching
+    client would otherwise wait on. Keys are generated ahead of time on a background thread
+    and the same keypair is reused for every login until it is rotated.
+
+    :param size: How many keypairs to keep ready when rotating, including the one in use
+    :param max_uses: Rotate a keypair after this many logins, 0 never rotates
+    :param max_age: Rotate a keypair after this many seconds, 0 never rotates
+    """
+    def __init__(self, size=2, max_uses=0, max_age=0):
+        self.size = size
+        self.max_uses = max_uses
+        self.max_age = max_age
+
+        # Entries are [privkey, pubkey, uses, created], the first one is in use
+        self.keys = deque()
+        self.lock = threading.Lock()
+        self.refilling = False
+
+    def configure(self, size=None, max_uses=None, max_age=None):
+        with self.lock:
+            if size is not None:
+                self.size = size
+            if max_uses is not None:
+                self.max_uses = max_uses
+            if max_age is not None:
+                self.max_age = max_age
+
+    def rotates(self):
+        return bool(self.max_uses or self.max_age)
+
+    # Without rotation the first keypair is used forever so there's no point in spares
+    def target(self):
+        return max(1, self.size) if self.rotates() else 1
+
+    def expired(self, entry, now):
+        return bool((self.max_uses and entry[2] >= self.max_uses) or (self.max_age and now - entry[3] >= self.max_age))
+
+    def get(self):
+        """Returns a (private key, DER encoded public key) tuple, generating one only if none is ready"""
+        with self.lock:
+            now = time.time()
+            while self.keys and self.expired(self.keys[0], now):
+                self.keys.popleft()
+
+            entry = self.keys[0] if self.keys else None
+            if entry:
+                entry[2] += 1
+
+        if entry is None:
+            privkey, pubkey = generate_keypair()
+            entry = [privkey, pubkey, 1, time.time()]
+            with self.lock:
+                self.keys.appendleft(entry)
+
+        self.warm()
+        return entry[0], entry[1]
+
+    def warm(self):
+        """Start generating keypairs in the background if the pool is short"""
+        with self.lock:
+            if self.refilling or len(self.keys) >= self.target():
+                return
+            self.refilling = True
+        threading.Thread(target=self.refill, daemon=True).start()
+
+    def refill(self):
+        try:
+            while True:
+                with self.lock:
+                    if len(self.keys) >= self.target():
+                        return
+                privkey, pubkey = generate_keypair()
+                with self.lock:
+                    self.keys.append([privkey, pubkey, 0, time.time()])
+        finally:
+            with self.lock:
+                self.refilling = False
+
+
+# Shared by every session in the process
+keypool = KeyPool()
+
+
+def get_keypair():
+    """Returns a pooled (private key, DER encoded public key) tuple for a local client login"""
+    return keypool.get()
+
+
 def create_AES_cipher(shared_secret):
     cipher = Cipher(algorithms.AES(shared_secret), modes.CFB8(shared_secret),
                     backend=default_backend())
@@ -65,14 +174,73 @@ def _number_from_bytes(b, signed=False):
 
 
 class EncryptedFileObjectWrapper(object):
-    def __init__(self, file_object, decryptor):
+    """Decrypts a stream that is read in large chunks.
+
+    Every read off the underlying stream is as large as it can be and is decrypted with a single
+    update(). What the caller didn't ask for stays in a decrypted buffer that later reads, readinto
+    and peeks are served from, so a small read (like a VarInt length prefix) doesn't cost a read
+    off the socket and a cryptography call each. Large readintos skip the buffer and decrypt the
+    caller's buffer in place.
+
+    select() can't see the buffered bytes, available() counts them.
+    Only the connection's reader thread reads from it, so there's no lock.
+    """
+    def __init__(self, file_object, decryptor, read_size=1 << 16):
         self.actual_file_object = file_object
         self.decryptor = decryptor
-        self.lock = RLock()
+        self.read_size = read_size
+        self.scratch = bytearray(read_size)
+
+        # Decrypted bytes that weren't read yet are buffer[position:]
+        self.buffer = bytearray()
+        self.position = 0
+
+    def available(self):
+        """Decrypted bytes that can be read without touching the stream"""
+        return len(self.buffer) - self.position
+
+    def fill(self):
+        """Do one read off the stream and decrypt it into the buffer, returns the bytes read (0 at EOF)"""
+        read = self.actual_file_object.readinto(self.scratch)
+        if read:
+            if self.position:
+                del self.buffer[:self.position]
+                self.position = 0
+            self.buffer += self.decryptor.update(memoryview(self.scratch)[:read])
+        return read
+
+    def take(self, length):
+        data = bytes(self.buffer[self.position:self.position + length])
+        self.position += len(data)
+        return data
+
+    def peek(self, length=1):
+        """Up to `length` bytes without consuming them, only reads off the stream if nothing is buffered"""
+        if not self.available():
+            self.fill()
+        return bytes(self.buffer[self.position:self.position + length])
 
     def read(self, length):
-        with self.lock:
-            return self.decryptor.update(self.actual_file_object.read(length))
+        """Up to `length` bytes with at most one read off the stream, like a raw stream"""
+        if not self.available():
+            self.fill()
+        return self.take(length)
+
+    def readinto(self, b):
+        view = memoryview(b)
+        if not self.available():
+            if len(view) >= self.read_size:
+                # Nothing to copy over first, so decrypt in the caller's buffer
+                read = self.actual_file_object.readinto(view)
+                if read:
+                    view[:read] = self.decryptor.update(view[:read])
+                return read
+            if not self.fill():
+                return 0
+
+        data = self.take(len(view))
+        view[:len(data)] = data
+        return len(data)
 
     def fileno(self):
         return self.actual_file_object.fileno()
@@ -92,9 +260,19 @@ class EncryptedSocketWrapper(object):
         with self.lock:
             return self.decryptor.update(self.actual_socket.recv(length))
 
-    def send(self, data):
+    # The cipher is a stream, every encrypted byte has to go out
+    # so partial sends are never allowed
+    def sendall(self, data):
+        with self.lock:
+            self.actual_socket.sendall(self.encryptor.update(data))
+
+    send = sendall
+
+    def sendall_many(self, chunks):
+        """ sendall() every chunk in order, encrypting the next chunk on the worker pool during each send """
         with self.lock:
-            self.actual_socket.send(self.encryptor.update(data))
+            for data in workers.pipeline(self.encryptor.update, chunks):
+                self.actual_socket.sendall(data)
 
     def fileno(self):
         return self.actual_socket.fileno()
@@ -0,0 +1,373 @@
+import struct
+from math import floor
+
+from mcidle.networking.types import VarInt
+from mcidle.networking.packets.registry import registry, PLAY, CLIENTBOUND
+
+
+# Fixed-width metadata values by type, the rest are skipped by skip_metadata_value
+METADATA_SIZES = {0: 1, 2: 4, 6: 1, 7: 12, 8: 8}
+# Fixed-width NBT payloads by tag type
+NBT_SIZES = {1: 1, 2: 2, 3: 4, 4: 8, 5: 4, 6: 8}
+
+
+def skip_nbt_payload(buf, offset, tag):
+    if tag in NBT_SIZES:
+        return offset + NBT_SIZES[tag]
+    if tag == 7:  # Byte array
+        return offset + 4 + struct.unpack_from('>i', buf, offset)[0]
+    if tag == 8:  # String
+        return offset + 2 + struct.unpack_from('>H', buf, offset)[0]
+    if tag == 9:  # List
+        item, length = struct.unpack_from('>Bi', buf, offset)
+        offset += 5
+        for _ in range(length):
+            offset = skip_nbt_payload(buf, offset, item)
+        return offset
+    if tag == 10:  # Compound, named tags up to a TAG_End
+        while True:
+            item = buf[offset]
+            offset += 1
+            if item == 0:
+                return offset
+            offset += 2 + struct.unpack_from('>H', buf, offset)[0]
+            offset = skip_nbt_payload(buf, offset, item)
+    if tag == 11:  # Int array
+        return offset + 4 + 4 * struct.unpack_from('>i', buf, offset)[0]
+    if tag == 12:  # Long array
+        return offset + 4 + 8 * struct.unpack_from('>i', buf, offset)[0]
+    raise ValueError("Unknown NBT tag %s" % tag)
+
+
+def skip_nbt(buf, offset):
+    """ Skip an optional root tag, a lone TAG_End means there is none """
+    tag = buf[offset]
+    offset += 1
+    if tag == 0:
+        return offset
+    offset += 2 + struct.unpack_from('>H', buf, offset)[0]
+    return skip_nbt_payload(buf, offset, tag)
+
+
+def skip_metadata_value(buf, offset, type_):
+    if type_ in METADATA_SIZES:
+        return offset + METADATA_SIZES[type_]
+    if type_ in (1, 10, 12):  # VarInt, Direction, OptBlockID
+        return VarInt.read_buffer(buf, offset)[1]
+    if type_ in (3, 4):  # String, Chat
+        length, offset = VarInt.read_buffer(buf, offset)
+        return offset + length
+    if type_ == 5:  # Slot
+        item_id = struct.unpack_from('>h', buf, offset)[0]
+        offset += 2
+        if item_id == -1:
+            return offset
+        return skip_nbt(buf, offset + 3)  # Past the count and damage
+    if type_ == 9:  # OptPosition
+        return offset + 1 + (8 if buf[offset] else 0)
+    if type_ == 11:  # OptUUID
+        return offset + 1 + (16 if buf[offset] else 0)
+    if type_ == 13:  # NBT
+        return skip_nbt(buf, offset)
+    raise ValueError("Unknown metadata type %s" % type_)
+
+
+def metadata_entries(buf):
+    """ The raw entries of an entity metadata blob as an index -> bytes dict """
+    entries = {}
+    offset = 0
+    while offset < len(buf) and buf[offset] != 0xFF:
+        start = offset
+        type_, offset = VarInt.read_buffer(buf, offset + 1)
+        offset = skip_metadata_value(buf, offset, type_)
+        entries[buf[start]] = bytes(buf[start:offset])
+    return entries
+
+
+def merge_metadata(old, new):
+    """ Entries of `old` overwritten by those of `new`, both without the 0xFF terminator
+        Falls back to keeping both when one can't be parsed, the client applies them in order
+    """
+    try:
+        entries = metadata_entries(old)
+        entries.update(metadata_entries(new))
+    except (ValueError, IndexError, struct.error):
+        return bytes(old) + bytes(new)
+    return b''.join(entries.values())
+
+
+def strip_metadata(buf):
+    """ A metadata field without its 0xFF terminator """
+    buf = bytes(buf)
+    return buf[:-1] if buf.endswith(b'\xff') else buf
+
+
+class Entity:
+    """ Everything needed to spawn an entity where it is now
+
+        Coordinates are kept like the client does, as integers in 1/4096 of a block,
+        so relative moves add up exactly. Angles are the raw 1/256 turn steps.
+        The entity's metadata lives in the tracker's storage under its ID.
+    """
+    __slots__ = ('spawn_id', 'entity_id', 'uuid', 'type', 'x', 'y', 'z', 'yaw', 'pitch', 'head_yaw',
+                 'velocity', 'extra')
+
+    def __init__(self, spawn_id, entity_id, uuid=None, type_=None, x=0.0, y=0.0, z=0.0, yaw=0, pitch=0,
+                 head_yaw=0, velocity=(0, 0, 0), extra=None):
+        self.spawn_id = spawn_id
+        self.entity_id = entity_id
+        self.uuid = uuid
+        self.type = type_
+        self.yaw = yaw
+        self.pitch = pitch
+        self.head_yaw = head_yaw
+        self.velocity = velocity
+        self.extra = extra  # Object data, orb count or a painting's spawn frame
+        self.teleport(x, y, z)
+
+    def copy(self):
+        entity = Entity.__new__(Entity)
+        for name in self.__slots__:
+            setattr(entity, name, getattr(self, name))
+        return entity
+
+    def teleport(self, x, y, z):
+        self.x = int(floor(x * 4096))
+        self.y = int(floor(y * 4096))
+        self.z = int(floor(z * 4096))
+
+    def move(self, dx, dy, dz):
+        self.x += dx
+        self.y += dy
+        self.z += dz
+
+    @property
+    def position(self):
+        return self.x / 4096.0, self.y / 4096.0, self.z / 4096.0
+
+
+class EntityTracker:
+    """ Every spawned entity as a compact record kept up to date by the movement packets
+
+        Instead of the spawn packet the server sent (stale after the first move), a joining
+        client gets one spawn packet per entity built from its current record, followed by
+        its merged metadata when the spawn packet has no room for it.
+
+        Metadata is the only part that isn't fixed-size, it goes into `storage` (a dict
+        by default or a SpillFile) as the merged entries keyed by entity ID.
+    """
+    def __init__(self, storage=None, packets=None):
+        self.records = {}  # Entity ID -> Entity
+        self.storage = storage if storage is not None else {}
+        self.nbytes = 0  # Bytes of metadata in storage, counted so the status can read it without the lock
+
+        # Clientbound play packets of the server's protocol version
+        self.packets = packets = packets if packets is not None else registry.resolve(340, PLAY, CLIENTBOUND)
+
+        self.spawners = {
+            packets.SpawnObject.id: self.spawn_object,
+            packets.SpawnExperienceOrb.id: self.spawn_orb,
+            packets.SpawnMob.id: self.spawn_mob,
+            packets.SpawnPainting.id: self.spawn_painting,
+            packets.SpawnPlayer.id: self.spawn_player,
+        }
+        self.updaters = {
+            packets.EntityRelativeMove.id: self.relative_move,
+            packets.EntityLookAndRelativeMove.id: self.look_and_relative_move,
+            packets.EntityLook.id: self.look,
+            packets.EntityTeleport.id: self.teleport,
+            packets.EntityVelocity.id: self.velocity,
+            packets.EntityMetadata.id: self.metadata,
+            packets.EntityHeadLook.id: self.head_look,
+        }
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, entity_id):
+        return entity_id in self.records
+
+    def __delitem__(self, entity_id):
+        del self.records[entity_id]
+        self.set_metadata(entity_id, None)
+
+    def close(self):
+        if hasattr(self.storage, 'close'):
+            self.storage.close()
+        self.records.clear()
+        self.nbytes = 0
+
+    def memory(self):
+        """ Bytes of stored metadata """
+        return self.nbytes
+
+    def set_metadata(self, entity_id, data):
+        if entity_id in self.storage:
+            self.nbytes -= len(self.storage[entity_id])
+            if not data:
+                del self.storage[entity_id]
+        if data:
+            self.storage[entity_id] = data
+            self.nbytes += len(data)
+
+    def spawn(self, packet):
+        """ Track the entity spawned by a RawPacket, returns the new record or None """
+        spawner = self.spawners.get(packet.id)
+        if spawner is None:
+            return None
+
+        entity, metadata = spawner(packet)
+        # A spawn for an ID we know replaces it, the old entity's destroy was missed
+        if entity.entity_id in self.records:
+            del self[entity.entity_id]
+        self.records[entity.entity_id] = entity
+        if metadata:
+            self.set_metadata(entity.entity_id, metadata)
+        return entity
+
+    # Spawners return the new record and its metadata, None when the spawn packet has none
+
+    def spawn_object(self, packet):
+        spawn = self.packets.SpawnObject().read(packet.packet_buffer)
+        return Entity(packet.id, spawn.EntityID, spawn.ObjectUUID, spawn.Type, spawn.X, spawn.Y, spawn.Z,
+                      spawn.Yaw, spawn.Pitch, velocity=(spawn.VelocityX, spawn.VelocityY, spawn.VelocityZ),
+                      extra=spawn.Data), None
+
+    def spawn_orb(self, packet):
+        spawn = self.packets.SpawnExperienceOrb().read(packet.packet_buffer)
+        return Entity(packet.id, spawn.EntityID, x=spawn.X, y=spawn.Y, z=spawn.Z, extra=spawn.Count), None
+
+    def spawn_mob(self, packet):
+        spawn = self.packets.SpawnMob().read(packet.packet_buffer)
+        return Entity(packet.id, spawn.EntityID, spawn.EntityUUID, spawn.Type, spawn.X, spawn.Y, spawn.Z,
+                      spawn.Yaw, spawn.Pitch, spawn.HeadPitch,
+                      (spawn.VelocityX, spawn.VelocityY, spawn.VelocityZ)), strip_metadata(spawn.Metadata)
+
+    def spawn_painting(self, packet):
+        # Paintings never move, their frame is replayed as it is
+        spawn = self.packets.SpawnPainting().read(packet.packet_buffer)
+        return Entity(packet.id, spawn.EntityID, spawn.EntityUUID, extra=bytes(packet.frame)), None
+
+    def spawn_player(self, packet):
+        spawn = self.packets.SpawnPlayer().read(packet.packet_buffer)
+        return Entity(packet.id, spawn.EntityID, spawn.PlayerUUID, x=spawn.X, y=spawn.Y, z=spawn.Z,
+                      yaw=spawn.Yaw, pitch=spawn.Pitch), strip_metadata(spawn.Metadata)
+
+    def update(self, packet):
+        """ Apply a movement, velocity or metadata RawPacket
+            Returns whether a tracked entity changed
+        """
+        updater = self.updaters.get(packet.id)
+        if updater is None:
+            return False
+        return updater(packet)
+
+    def relative_move(self, packet):
+        move = self.packets.EntityRelativeMove().read(packet.packet_buffer)
+        entity = self.records.get(move.EntityID)
+        if entity is None:
+            return False
+        entity.move(move.DeltaX, move.DeltaY, move.DeltaZ)
+        return True
+
+    def look_and_relative_move(self, packet):
+        move = self.packets.EntityLookAndRelativeMove().read(packet.packet_buffer)
+        entity = self.records.get(move.EntityID)
+        if entity is None:
+            return False
+        entity.move(move.DeltaX, move.DeltaY, move.DeltaZ)
+        entity.yaw, entity.pitch = move.Yaw, move.Pitch
+        return True
+
+    def look(self, packet):
+        look = self.packets.EntityLook().read(packet.packet_buffer)
+        entity = self.records.get(look.EntityID)
+        if entity is None:
+            return False
+        entity.yaw, entity.pitch = look.Yaw, look.Pitch
+        return True
+
+    def teleport(self, packet):
+        teleport = self.packets.EntityTeleport().read(packet.packet_buffer)
+        entity = self.records.get(teleport.EntityID)
+        if entity is None:
+            return False
+        entity.teleport(teleport.X, teleport.Y, teleport.Z)
+        entity.yaw, entity.pitch = teleport.Yaw, teleport.Pitch
+        return True
+
+    def velocity(self, packet):
+        velocity = self.packets.EntityVelocity().read(packet.packet_buffer)
+        entity = self.records.get(velocity.EntityID)
+        if entity is None:
+            return False
+        entity.velocity = (velocity.VelocityX, velocity.VelocityY, velocity.VelocityZ)
+        return True
+
+    def metadata(self, packet):
+        metadata = self.packets.EntityMetadata().read(packet.packet_buffer)
+        entity_id = metadata.EntityID
+        if entity_id not in self.records:
+            return False
+        new = strip_metadata(metadata.Metadata)
+        old = self.storage[entity_id] if entity_id in self.storage else None
+        self.set_metadata(entity_id, merge_metadata(old, new) if old is not None else new)
+        return True
+
+    def head_look(self, packet):
+        head_look = self.packets.EntityHeadLook().read(packet.packet_buffer)
+        entity = self.records.get(head_look.EntityID)
+        if entity is None:
+            return False
+        entity.head_yaw = head_look.HeadYaw
+        return True
+
+    def snapshot(self):
+        """ A copy of every record with its stored metadata, to build() the spawn frames from
+            Records are small so this is quick enough to do under the game state's lock,
+            stored metadata is replaced and never changed so it stays valid
+        """
+        storage = self.storage
+        return [(entity.copy(), storage[entity_id] if entity_id in storage else b'') \
+                for entity_id, entity in self.records.items()]
+
+    def frames(self, compression_threshold=None, compression_level=-1):
+        """ A spawn frame for every entity as it is now, plus its metadata if the spawn can't carry it """
+        return self.build(self.snapshot(), compression_threshold, compression_level)
+
+    def build(self, snapshot, compression_threshold=None, compression_level=-1):
+        """ The frames of a snapshot(), see frames() """
+        packets = self.packets
+        frames = []
+        for entity, metadata in snapshot:
+            entity_id = entity.entity_id
+            metadata = bytes(metadata)
+            x, y, z = entity.position
+            vx, vy, vz = entity.velocity
+
+            if entity.spawn_id == packets.SpawnMob.id:
+                frames.append(packets.SpawnMob(EntityID=entity_id, EntityUUID=entity.uuid, Type=entity.type, X=x, Y=y, Z=z,
+                                       Yaw=entity.yaw, Pitch=entity.pitch, HeadPitch=entity.head_yaw,
+                                       VelocityX=vx, VelocityY=vy, VelocityZ=vz,
+                                       Metadata=metadata + b'\xff').write(compression_threshold, compression_level).bytes)
+                continue
+            if entity.spawn_id == packets.SpawnPlayer.id:
+                frames.append(packets.SpawnPlayer(EntityID=entity_id, PlayerUUID=entity.uuid, X=x, Y=y, Z=z,
+                                          Yaw=entity.yaw, Pitch=entity.pitch,
+                                          Metadata=metadata + b'\xff').write(compression_threshold, compression_level).bytes)
+                continue
+
+            if entity.spawn_id == packets.SpawnObject.id:
+                frames.append(packets.SpawnObject(EntityID=entity_id, ObjectUUID=entity.uuid, Type=entity.type, X=x, Y=y, Z=z,
+                                          Pitch=entity.pitch, Yaw=entity.yaw, Data=entity.extra,
+                                          VelocityX=vx, VelocityY=vy, VelocityZ=vz).write(compression_threshold, compression_level).bytes)
+            elif entity.spawn_id == packets.SpawnExperienceOrb.id:
+                frames.append(packets.SpawnExperienceOrb(EntityID=entity_id, X=x, Y=y, Z=z,
+                                                 Count=entity.extra).write(compression_threshold, compression_level).bytes)
+            else:
+                frames.append(entity.extra)
+
+            if metadata:
+                frames.append(packets.EntityMetadata(EntityID=entity_id,
+                                             Metadata=metadata + b'\xff').write(compression_threshold, compression_level).bytes)
+        return frames
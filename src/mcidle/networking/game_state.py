@@ -1,8 +1,17 @@
 from threading import RLock
 
+from .chunk_store import ChunkStore
+from .spill import SpillFile
+from .entity_tracker import EntityTracker
+from .replay import ReplayBuffer
+from .packets.registry import registry, PLAY, CLIENTBOUND
+
 
 class GameState:
-    def __init__(self, join_ids=[]):
+    def __init__(self, join_ids=[], chunk_budget=0, chunk_radius=0, spill_dir=None, packets=None):
+        # Clientbound play packets of the server's protocol version
+        self.packets = packets if packets is not None else registry.resolve(340, PLAY, CLIENTBOUND)
+
         self.held_item_slot = 0
         self.last_pos_packet = None
         self.last_yaw = 0
@@ -16,23 +25,58 @@ class GameState:
 
         self.abilities = None
 
-        self.player_pos = None
+        self.player_pos_ = None
 
         self.state_lock = RLock()
 
         self.received_position = False
+        self.last_keep_alive = None  # time.monotonic() of the last KeepAlive from the server
         self.update_health = None
 
         # Every other packet goes here
         self.packet_log = {}
 
         self.main_inventory = {}
-        self.chunks = {}
         self.player_list = {}
-        self.entities = {}
+
+        # Chunk frames and entity metadata are only read when a client joins, so they can live on disk
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            self.chunks = ChunkStore(chunk_budget, chunk_radius, storage=SpillFile(spill_dir, 'mcidle-chunks-'))
+            self.entities = EntityTracker(SpillFile(spill_dir, 'mcidle-entities-'), self.packets)
+        else:
+            self.chunks = ChunkStore(chunk_budget, chunk_radius)
+            self.entities = EntityTracker(packets=self.packets)
 
         self.join_ids = join_ids
 
+        # Ready-to-send frames for joining clients, chunks can change on their own (eviction, re-ordering)
+        self.replay = ReplayBuffer(self)
+        self.chunks.on_change = lambda: self.touch('chunks')
+
+    @property
+    def player_pos(self):
+        return self.player_pos_
+
+    # Chunks are kept and replayed by their distance from the player
+    @player_pos.setter
+    def player_pos(self, pos):
+        self.player_pos_ = pos
+        if pos is not None:
+            self.chunks.set_center(pos[0], pos[2])
+
+    def touch(self, *categories):
+        """ Mark what changed so the replay buffer rebuilds it, the caller must hold the lock """
+        for category in categories:
+            self.replay.invalidate(category)
+
+    def close(self):
+        """ Remove the spill files once the session is over """
+        with self.state_lock:
+            if self.spill_dir is not None:
+                self.chunks.storage.close()
+            self.entities.close()
+
     def acquire(self):
         self.state_lock.acquire()
 
@@ -1,33 +1,60 @@
+import selectors
 import socket
 import threading
 
 
-class ListenThread(threading.Thread):
+class ListenPort:
+    """ A bound local port, accepted clients are handed to its current server """
     def __init__(self, address):
         self.address = address
-        threading.Thread.__init__(self, daemon=True)
         self.socket = socket.socket()
         self.server = None
         self.server_lock = threading.RLock()
-        self.running = True
+
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.address)
+        self.socket.listen(1)  # Listen for 1 incoming connection
 
     def set_server(self, server):
         with self.server_lock:
             self.server = server
             return self
 
-    def run(self):
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.socket.bind(self.address)
-        self.socket.listen(1)  # Listen for 1 incoming connection
+    def accept(self):
+        (connection, address) = self.socket.accept()
+
+        with self.server_lock:
+            if self.server:
+                print("Client connected", flush=True)
+                self.server.start_with_socket(connection)
+            else:
+                connection.close()
+
+
+class ListenThread(threading.Thread):
+    """ Accepts clients on any number of local ports from a single thread """
+    _timeout = 0.5
+
+    def __init__(self, address=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.selector = selectors.DefaultSelector()
+        self.running = True
+
+        # The port used through set_server() when listening on a single address
+        self.port = self.listen(address) if address is not None else None
+
+    def listen(self, address):
+        port = ListenPort(address)
+        self.selector.register(port.socket, selectors.EVENT_READ, port)
+        return port
 
+    def set_server(self, server):
+        return self.port.set_server(server)
+
+    def run(self):
         while self.running:
-            try:
-                (connection, address) = self.socket.accept()
-
-                with self.server_lock:
-                    if self.server:
-                        print("Client connected", flush=True)
-                        self.server.start_with_socket(connection)
-            except OSError:
-                print("Failed to bind socket (race condition?), it's already on", flush=True)
+            for key, _ in self.selector.select(self._timeout):
+                try:
+                    key.data.accept()
+                except OSError:
+                    print("Failed to accept client on %s:%s" % key.data.address, flush=True)
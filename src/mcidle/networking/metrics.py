@@ -0,0 +1,93 @@
+import time
+
+from bisect import bisect_left
+
+from .packets.registry import CLIENTBOUND, SERVERBOUND
+
+
+# Packet IDs are one byte VarInts in the versions we support, anything larger is counted in an extra last slot
+MAX_PACKET_ID = 0xFF
+OVERFLOW = MAX_PACKET_ID + 1
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, \
+                   0.1, 0.25, 0.5, 1.0)
+JOIN_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """ Observations counted into fixed buckets
+
+        counts[i] is how many observations were at most bounds[i] (and more than the bound before it),
+        the last count is everything over the largest bound. Updates aren't locked, the odd increment
+        lost to a race between threads doesn't matter for metrics and keeps observe() cheap
+    """
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def since(self, start):
+        """ Observe the time since `start`, a time.perf_counter() """
+        self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        return {'bounds': list(self.bounds), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+class PacketCounters:
+    """ Packets and bytes in one direction, in flat lists indexed by packet ID """
+    def __init__(self, size=MAX_PACKET_ID + 2):
+        self.packets = [0] * size
+        self.bytes = [0] * size
+
+    def count(self, packet_id, nbytes):
+        if not 0 <= packet_id <= MAX_PACKET_ID:
+            packet_id = OVERFLOW
+        self.packets[packet_id] += 1
+        self.bytes[packet_id] += nbytes
+
+    def snapshot(self):
+        """ {packet ID: (packets, bytes)} of the IDs that were seen """
+        return {packet_id: (count, self.bytes[packet_id]) for packet_id, count in enumerate(self.packets) if count}
+
+
+class Metrics:
+    """ What one connection has been doing: packets and bytes per direction and packet ID,
+        queue depths and how long decoding, processing and joining take
+
+        Counters are preallocated and updated in place so they can stay on all the time.
+        Gauges are read when a snapshot is taken, each is a function returning its current value.
+    """
+    def __init__(self):
+        self.clientbound = PacketCounters()  # Read from the server
+        self.serverbound = PacketCounters()  # Read from the local client
+
+        self.decode = Histogram()  # Parsing a frame off a stream into a packet
+        self.process = Histogram()  # Applying a clientbound packet to the game state
+        self.join = Histogram(JOIN_BUCKETS)  # Replaying the world to a local client
+
+        self.gauges = {}
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def snapshot(self):
+        gauges = {}
+        for name, value in self.gauges.items():
+            try:
+                gauges[name] = value()
+            except (AttributeError, TypeError):
+                gauges[name] = 0  # What it measures is gone, e.g the connection is closing
+        return {
+            'packets': {CLIENTBOUND: self.clientbound.snapshot(), SERVERBOUND: self.serverbound.snapshot()},
+            'histograms': {'decode': self.decode.snapshot(), 'process': self.process.snapshot(), \
+                           'join': self.join.snapshot()},
+            'gauges': gauges,
+        }
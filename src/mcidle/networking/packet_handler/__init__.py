@@ -1,3 +1,4 @@
+from .packet_stream_reader import PacketStreamReader
 from .packet_handler import PacketHandler
 from .worker_processor import WorkerProcessor
-from .packet_processor import ClientboundProcessor
\ No newline at end of file
+from .packet_processor import ClientboundProcessor, ServerboundProcessor
@@ -1,34 +1,142 @@
-from mcidle.networking.packets.serverbound import KeepAlive as KeepAliveServerbound, TeleportConfirm, ClientStatus
-from mcidle.networking.packets.clientbound import ChunkData, UnloadChunk, SpawnEntity, \
-    DestroyEntities, KeepAlive, ChatMessage, PlayerPositionAndLook, TimeUpdate, \
-    HeldItemChange, SetSlot, PlayerListItem, PlayerAbilities, Respawn, UpdateHealth, JoinGame
+import time
 
-from mcidle.networking.packets.clientbound import GameState as GameStateP
+from mcidle.networking.packets.registry import registry, PLAY, CLIENTBOUND, SERVERBOUND
 
 
 class PacketProcessor:
-    # A packet processor processes packets and mutates the game state
-    def __init__(self, game_state):
+    """ Processes packets and mutates the game state
+
+        Packets are dispatched through a table of packet ID -> handlers built once per
+        protocol version from its packet classes (self.packets). A handler takes the
+        RawPacket and returns a packet to answer the server with, or None. IDs nobody
+        registered for are dropped right away without taking the game state's lock,
+        which is most of what a server sends.
+
+        More handlers can be registered from outside, they run after the ones already there.
+    """
+    direction = None
+
+    def __init__(self, game_state, protocol=340):
         self.game_state = game_state
+        self.protocol = protocol
+        self.packets = registry.resolve(protocol, PLAY, self.direction)
+
+        # Packet ID -> (handlers, whether they need the game state's lock)
+        self.table = {}
+        for packet_id, handler, locked in self.default_handlers():
+            self.register(packet_id, handler, locked)
+
+    # (packet ID, handler, locked) of the handlers this processor starts with
+    def default_handlers(self):
+        return []
+
+    def register(self, packet_id, handler, locked=True):
+        """ Call handler(packet) for every packet with this ID
+            Locked handlers run while holding the game state's lock, pass False
+            for handlers that don't read or change the game state
+        """
+        handlers, lock = self.table.get(packet_id, ((), False))
+        self.table[packet_id] = (handlers + (handler,), lock or locked)
+
+    def tracks(self, packet_id):
+        return packet_id in self.table
+
+    def locks(self, packet_id):
+        """ Whether processing this packet ID needs the game state's lock """
+        entry = self.table.get(packet_id)
+        return entry is not None and entry[1]
 
     # Processes a packet and returns a response packet if needed
     def process_packet(self, packet):
-        return None
+        entry = self.table.get(packet.id)
+        if entry is None:
+            return None
+
+        handlers, locked = entry
+        if locked:
+            with self.game_state.state_lock:
+                return self.dispatch(handlers, packet)
+        return self.dispatch(handlers, packet)
+
+    # Same as process_packet for callers that already hold the game state's lock if locks() says so
+    def apply(self, packet):
+        entry = self.table.get(packet.id)
+        if entry is None:
+            return None
+        return self.dispatch(entry[0], packet)
+
+    @staticmethod
+    def dispatch(handlers, packet):
+        response = None
+        for handler in handlers:
+            response = handler(packet) or response
+        return response
 
 
 class ClientboundProcessor(PacketProcessor):
-    def __init__(self, game_state):
-        super().__init__(game_state)
+    direction = CLIENTBOUND
+
+    def __init__(self, game_state, protocol=340):
+        # Packets sent back to the server
+        self.responses = registry.resolve(protocol, PLAY, SERVERBOUND)
+        super().__init__(game_state, protocol)
+
+    def default_handlers(self):
+        join_ids = self.game_state.join_ids
+        handlers = [
+            (self.packets.Respawn.id, self.respawn, True),
+            (self.packets.JoinGame.id, self.join_game, True),
+        ]
+        handlers.extend((packet_id, self.log_join, True) for packet_id in join_ids)
+
+        tracked = [
+            (self.packets.ChunkData.id, self.chunk_load, True),
+            (self.packets.UnloadChunk.id, self.chunk_unload, True),
+            (self.packets.DestroyEntities.id, self.destroy_entities, True),
+            (self.packets.KeepAlive.id, self.keep_alive, False),
+            (self.packets.ChatMessage.id, self.chat_message, False),
+            (self.packets.PlayerPositionAndLook.id, self.position_and_look, True),
+            (self.packets.TimeUpdate.id, self.time_update, True),
+            (self.packets.HeldItemChange.id, self.held_item_change, True),
+            (self.packets.GameState.id, self.change_game_state, True),
+            (self.packets.SetSlot.id, self.set_slot, True),
+            (self.packets.PlayerListItem.id, self.player_list, True),
+            (self.packets.PlayerAbilities.id, self.player_abilities, True),
+            (self.packets.UpdateHealth.id, self.update_health, True),
+        ]
+        tracked.extend((packet_id, self.spawn_entity, True) for packet_id in self.game_state.entities.spawners)
+        tracked.extend((packet_id, self.update_entity, True) for packet_id in self.game_state.entities.updaters)
+        # Packets that are part of joining the world are only logged
+        handlers.extend(handler for handler in tracked if handler[0] not in join_ids)
+        return handlers
+
+    # In case the gamemode is changed through a respawn packet
+    def respawn(self, packet):
+        respawn = self.packets.Respawn.decode(packet)
+        self.game_state.gamemode = respawn.Gamemode
+        self.game_state.touch('gamemode')
+        print("Set gamemode to", respawn.Gamemode, flush=True)
+
+    def join_game(self, packet):
+        join_game = self.packets.JoinGame.decode(packet)
+        self.game_state.gamemode = join_game.Gamemode & 3 # Bit 4 (0x8) is the hardcore flaga
+        self.game_state.touch('gamemode')
+        print("Set gamemode to", self.game_state.gamemode, "JoinGame", flush=True)
+
+    def log_join(self, packet):
+        self.game_state.packet_log[packet.id] = packet
+        self.game_state.touch('join')
 
     def destroy_entities(self, packet):
-        destroy_entities = DestroyEntities().read(packet.packet_buffer)
+        destroy_entities = self.packets.DestroyEntities().read(packet.packet_buffer)
         for entity_id in destroy_entities.Entities:
             if entity_id in self.game_state.entities:
                 print("Removed entity ID: %s" % entity_id, flush=True)
                 del self.game_state.entities[entity_id] # Delete the entity
+                self.game_state.touch('entities')
 
     def player_list(self, packet):
-        player_list_item = PlayerListItem().read(packet.packet_buffer)
+        player_list_item = self.packets.PlayerListItem.decode(packet)
 
         add_player = 0
         update_gamemode = 1
@@ -38,97 +146,133 @@ class ClientboundProcessor(PacketProcessor):
             uuid = player[0]
             if uuid == self.game_state.client_uuid and player_list_item.Action == update_gamemode:
                 self.game_state.gamemode = player[1]
+                self.game_state.touch('gamemode')
 
             if player_list_item.Action == add_player:
                 self.game_state.player_list[uuid] = packet
+                self.game_state.touch('players')
             elif player_list_item.Action == remove_player:
                 if uuid in self.game_state.packet_log:
                     del self.game_state.player_list[uuid]
+                    self.game_state.touch('players')
 
     def spawn_entity(self, packet):
-        spawn_entity = SpawnEntity().read(packet.packet_buffer)
-        if spawn_entity.EntityID not in self.game_state.entities:
-            self.game_state.entities[spawn_entity.EntityID] = packet
-            print("Added entity ID: %s" % spawn_entity.EntityID, flush=True)
+        entity = self.game_state.entities.spawn(packet)
+        if entity is not None:
+            self.game_state.touch('entities')
+            print("Added entity ID: %s" % entity.entity_id, flush=True)
+
+    def update_entity(self, packet):
+        # Movement, velocity and metadata of entities we track, the rest are ignored
+        if self.game_state.entities.update(packet):
+            self.game_state.touch('entities')
 
     def chunk_unload(self, packet):
-        unload_chunk = UnloadChunk().read(packet.packet_buffer)
+        unload_chunk = self.packets.UnloadChunk().read(packet.packet_buffer)
         chunk_key = (unload_chunk.ChunkX, unload_chunk.ChunkZ)
         if chunk_key in self.game_state.chunks:
             del self.game_state.chunks[chunk_key]
             print("UnloadChunk", unload_chunk.ChunkX, unload_chunk.ChunkZ, flush=True)
 
     def chunk_load(self, packet):
-        chunk_data = ChunkData().read(packet.packet_buffer)
+        # Only the chunk coordinates are needed, don't inflate the whole chunk
+        chunk_data = self.packets.ChunkData.decode(packet)
         chunk_key = (chunk_data.ChunkX, chunk_data.ChunkZ)
         if chunk_key not in self.game_state.chunks:
-            self.game_state.chunks[chunk_key] = packet
+            self.game_state.chunks.add(chunk_key, packet)
             print("ChunkData", chunk_data.ChunkX, chunk_data.ChunkZ, flush=True)
 
-    def process_packet(self, packet):
-        with self.game_state.state_lock:
-            if packet.id == Respawn.id:
-                # In case the gamemode is changed through a respawn packet
-                respawn = Respawn().read(packet.packet_buffer)
-                self.game_state.gamemode = respawn.Gamemode
-                print("Set gamemode to", respawn.Gamemode, flush=True)
-            if packet.id == JoinGame.id:
-                join_game = JoinGame().read(packet.packet_buffer)
-                self.game_state.gamemode = join_game.Gamemode & 3 # Bit 4 (0x8) is the hardcore flaga
-                print("Set gamemode to", self.game_state.gamemode, "JoinGame", flush=True)
-
-            if packet.id in self.game_state.join_ids:
-                self.game_state.packet_log[packet.id] = packet
-            elif packet.id == ChunkData.id:  # ChunkData
-                self.chunk_load(packet)
-            elif packet.id == UnloadChunk.id:  # UnloadChunk
-                self.chunk_unload(packet)
-            elif packet.id in SpawnEntity.ids:
-                self.spawn_entity(packet)
-            elif packet.id == DestroyEntities.id:
-                self.destroy_entities(packet)
-            elif packet.id == KeepAlive.id:  # KeepAlive Clientbound
-                keep_alive = KeepAlive().read(packet.packet_buffer)
-                print("Responded to KeepAlive", keep_alive, flush=True)
-                return KeepAliveServerbound(KeepAliveID=keep_alive.KeepAliveID)
-            elif packet.id == ChatMessage.id:
-                chat_message = ChatMessage().read(packet.packet_buffer)
-                print(chat_message, flush=True)
-            elif packet.id == PlayerPositionAndLook.id:
-                pos_packet = PlayerPositionAndLook().read(packet.packet_buffer)
-
-                # Log the packet
-                self.game_state.packet_log[packet.id] = packet
-                self.game_state.received_position = True
-
-                self.game_state.player_pos = (pos_packet.X, pos_packet.Y, pos_packet.Z)
-
-                # Send back a teleport confirm
-                return TeleportConfirm(TeleportID=pos_packet.TeleportID)
-            elif packet.id == TimeUpdate.id:
-                self.game_state.packet_log[packet.id] = packet
-            elif packet.id == HeldItemChange.id:
-                self.game_state.held_item_slot = HeldItemChange().read(packet.packet_buffer).Slot
-            elif packet.id == GameStateP.id:
-                game_state = GameStateP().read(packet.packet_buffer)
-                if game_state.Reason == 3: # Change Gamemode
-                    print("Set gamemode to ", game_state.Value, flush=True)
-                    self.game_state.gamemode = game_state.Value
-            elif packet.id == SetSlot.id:
-                set_slot = SetSlot().read(packet.packet_buffer)
-                self.game_state.main_inventory[set_slot.Slot] = packet
-            elif packet.id == PlayerListItem.id:
-                self.player_list(packet)
-            elif packet.id == PlayerAbilities.id:
-                self.game_state.abilities = PlayerAbilities().read(packet.packet_buffer)
-            elif packet.id == UpdateHealth.id:
-                update_health = UpdateHealth().read(packet.packet_buffer)
-                self.game_state.update_health = update_health
-                # Respawn the player if they're dead..
-                print("Health: %s" % update_health.Health, flush=True)
-                if update_health.Health == 0:
-                    print("Client died, respawning", flush=True)
-                    return ClientStatus(ActionID=0)
-
-
-        return None
+    def keep_alive(self, packet):
+        keep_alive = self.packets.KeepAlive().read(packet.packet_buffer)
+        self.game_state.last_keep_alive = time.monotonic()
+        print("Responded to KeepAlive", keep_alive, flush=True)
+        return self.responses.KeepAlive(KeepAliveID=keep_alive.KeepAliveID)
+
+    def chat_message(self, packet):
+        print(self.packets.ChatMessage().read(packet.packet_buffer), flush=True)
+
+    def position_and_look(self, packet):
+        pos_packet = self.packets.PlayerPositionAndLook().read(packet.packet_buffer)
+
+        # Log the packet
+        self.game_state.packet_log[packet.id] = packet
+        self.game_state.touch('position')
+        self.game_state.received_position = True
+
+        self.game_state.player_pos = (pos_packet.X, pos_packet.Y, pos_packet.Z)
+
+        # Send back a teleport confirm
+        return self.responses.TeleportConfirm(TeleportID=pos_packet.TeleportID)
+
+    def time_update(self, packet):
+        self.game_state.packet_log[packet.id] = packet
+        self.game_state.touch('time')
+
+    def held_item_change(self, packet):
+        self.game_state.held_item_slot = self.packets.HeldItemChange().read(packet.packet_buffer).Slot
+        self.game_state.touch('held_item')
+
+    def change_game_state(self, packet):
+        game_state = self.packets.GameState().read(packet.packet_buffer)
+        if game_state.Reason == 3: # Change Gamemode
+            print("Set gamemode to ", game_state.Value, flush=True)
+            self.game_state.gamemode = game_state.Value
+            self.game_state.touch('gamemode')
+
+    def set_slot(self, packet):
+        set_slot = self.packets.SetSlot.decode(packet)
+        self.game_state.main_inventory[set_slot.Slot] = packet
+        self.game_state.touch('inventory')
+
+    def player_abilities(self, packet):
+        self.game_state.abilities = self.packets.PlayerAbilities().read(packet.packet_buffer)
+        self.game_state.touch('abilities')
+
+    def update_health(self, packet):
+        update_health = self.packets.UpdateHealth().read(packet.packet_buffer)
+        self.game_state.update_health = update_health
+        self.game_state.touch('health')
+        # Respawn the player if they're dead..
+        print("Health: %s" % update_health.Health, flush=True)
+        if update_health.Health == 0:
+            print("Client died, respawning", flush=True)
+            return self.responses.ClientStatus(ActionID=0)
+
+
+class ServerboundProcessor(PacketProcessor):
+    # Tracks the state a connected client changes through the packets it sends
+    direction = SERVERBOUND
+
+    def default_handlers(self):
+        return [
+            (self.packets.PlayerPositionAndLook.id, self.position_and_look, True),
+            (self.packets.PlayerPosition.id, self.position, True),
+            (self.packets.HeldItemChange.id, self.held_item_change, True),
+            (self.packets.PlayerAbilities.id, self.player_abilities, True),
+        ]
+
+    def player_abilities(self, packet):
+        abilities = self.packets.PlayerAbilities().read(packet.packet_buffer)
+        self.game_state.abilities = self.game_state.packets.PlayerAbilities(Flags=abilities.Flags, \
+                                                                            FlyingSpeed=abilities.FlyingSpeed, \
+                                                                            FOV=abilities.WalkingSpeed)
+        self.game_state.touch('abilities')
+
+    def held_item_change(self, packet):
+        self.game_state.held_item_slot = self.packets.HeldItemChange().read(packet.packet_buffer).Slot
+        self.game_state.touch('held_item')
+
+    def position_and_look(self, packet):
+        pos_packet = self.packets.PlayerPositionAndLook().read(packet.packet_buffer)
+
+        self.game_state.last_yaw = pos_packet.Yaw
+        self.game_state.last_pitch = pos_packet.Pitch
+        self.game_state.player_pos = (pos_packet.X, pos_packet.Y, pos_packet.Z)
+
+        # Replace the currently logged PlayerPositionAndLookClientbound packet
+        self.game_state.last_pos_packet = pos_packet
+        self.game_state.touch('position')
+
+    def position(self, packet):
+        pos_packet = self.packets.PlayerPosition().read(packet.packet_buffer)
+        self.game_state.player_pos = (pos_packet.X, pos_packet.Y, pos_packet.Z)
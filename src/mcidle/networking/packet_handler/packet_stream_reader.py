@@ -0,0 +1,157 @@
+import time
+
+from mcidle.networking.types import VarInt
+from mcidle.networking.packets.packet import RawPacket
+
+
+def _read_header(buf, start, end):
+    """ Parse a frame's length prefix in place, returns (length, data start)
+        or None if the buffer ends before the prefix does
+    """
+    try:
+        return VarInt.read_buffer(buf, start, end)
+    except EOFError:
+        return None
+
+
+class PacketStreamReader:
+    """ Reads length-prefixed frames off a stream through one reusable buffer
+
+        Large chunks are pulled off the stream at once and the length prefix and
+        packet ID are parsed in place. A frame is copied out of the buffer exactly
+        once when it is complete, since packets outlive the buffer (they are queued
+        and cached in the game state).
+
+        The stream only needs a readinto(b) which does a single read, like the raw
+        SocketIO returned by socket.makefile('rb', buffering=0). Without a stream,
+        data can be fed in (e.g from an asyncio StreamReader) with feed().
+
+        With a `timer` (a metrics Histogram) the time it takes to decode each frame is observed.
+    """
+    def __init__(self, stream=None, capacity=1 << 18, timer=None):
+        self.stream = stream
+        self.timer = timer
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # Start of the unread data
+        self.end = 0  # End of the unread data
+
+    def set_stream(self, stream, decryptor=None):
+        """ Swap the underlying stream, decrypting anything read ahead of the swap """
+        if decryptor is not None and self.end > self.start:
+            self.view[self.start:self.end] = decryptor.update(bytes(self.view[self.start:self.end]))
+        self.stream = stream
+
+    def pending(self):
+        """ Amount of buffered bytes not yet consumed """
+        return self.end - self.start
+
+    def available(self):
+        """ Bytes the stream has buffered, which can be read without blocking """
+        available = getattr(self.stream, 'available', None)
+        return available() if available is not None else 0
+
+    def has_packet(self):
+        """ Whether a complete frame is buffered, so reading one won't block """
+        header = _read_header(self.buffer, self.start, self.end)
+        return header is not None and header[1] + header[0] <= self.end
+
+    def reserve(self, size):
+        """ Make room for `size` bytes starting at the unread data """
+        if self.start + size <= len(self.buffer):
+            return
+
+        pending = self.end - self.start
+        if size > len(self.buffer):
+            # A frame larger than the buffer, grow it
+            buffer = bytearray(max(size, len(self.buffer) * 2))
+            buffer[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = buffer
+            self.view = memoryview(buffer)
+        else:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start = 0
+        self.end = pending
+
+    def feed(self, data):
+        """ Append data that was read elsewhere """
+        self.reserve(self.end - self.start + len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def fill(self):
+        """ Do a single read off the stream into the buffer """
+        if self.end == len(self.buffer):
+            self.reserve(self.end - self.start + 1)
+
+        read = self.stream.readinto(self.view[self.end:])
+        if not read:
+            raise EOFError("Unexpected end of stream.")
+        self.end += read
+        return read
+
+    def next_frame(self):
+        """ Slice the next complete frame out of the buffer
+            Returns (frame, data offset) or None if it isn't fully buffered yet
+        """
+        header = _read_header(self.buffer, self.start, self.end)
+        if header is None:
+            return None
+
+        length, data_start = header
+        if length < 0:
+            raise ValueError("Invalid frame length %s" % length)
+
+        end = data_start + length
+        if end > self.end:
+            self.reserve(end - self.start)
+            return None
+
+        frame = bytes(self.view[self.start:end])
+        offset = data_start - self.start
+
+        if end == self.end:
+            self.start = self.end = 0  # Drained, rewind for free
+        else:
+            self.start = end
+
+        return frame, offset
+
+    def next_packet(self, compression_threshold=None):
+        """ The next packet if it is fully buffered, otherwise None """
+        frame = self.next_frame()
+        if frame is None:
+            return None
+        return self.decode_frame(frame, compression_threshold)
+
+    def read_packet(self, compression_threshold=None):
+        """ Read the next packet, blocking until it is fully received """
+        frame = self.next_frame()
+        while frame is None:
+            self.fill()
+            frame = self.next_frame()
+        return self.decode_frame(frame, compression_threshold)
+
+    def decode_frame(self, frame, compression_threshold=None):
+        if self.timer is None:
+            return self.decode(frame[0], frame[1], compression_threshold)
+        start = time.perf_counter()
+        packet = self.decode(frame[0], frame[1], compression_threshold)
+        self.timer.since(start)
+        return packet
+
+    @staticmethod
+    def decode(frame, offset, compression_threshold=None):
+        data_length = 0
+
+        if compression_threshold is not None and compression_threshold >= 0:
+            data_length, offset = VarInt.read_buffer(frame, offset)
+
+        if data_length:
+            # Only inflate as much as the packet ID needs, the rest is done on demand
+            id_ = VarInt.read_buffer(RawPacket.peek(frame, offset, data_length, 5))[0]
+        else:
+            id_ = VarInt.read_buffer(frame, offset)[0]
+
+        return RawPacket(id_, frame, offset, data_length)
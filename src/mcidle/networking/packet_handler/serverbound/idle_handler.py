@@ -1,7 +1,4 @@
 from mcidle.networking.packet_handler import PacketHandler
-from mcidle.networking.packets.clientbound import KeepAlive
-
-import select
 
 
 class IdleHandler(PacketHandler):
@@ -10,20 +7,14 @@ class IdleHandler(PacketHandler):
         while self.running:
             try:
                 # Read a packet from the target server
-                ready_to_read = select.select([self.connection.stream], [], [], self._timeout)[0]
-                if ready_to_read:
+                if self.ready_to_read():
                     packet = self.read_packet_from_stream()
                     if packet:
+                        self.connection.metrics.clientbound.count(packet.id, len(packet.frame))
                         # Entirely thread safe (worker processor only read, not destroyed)
+                        # The worker also forwards the packet if a client is connected
                         self.connection.worker_processor.enqueue(packet)
-
-                        # Forward the packets if a client is connected
-                        # Ignore KeepAlive's because those are processed by worker threads
-                        # This is thread safe because the old connection is only reassigned never deleted
-                        # so while we have a reference it can't be None
-                        # Since client_upstream is set in another thread it is wrapped in an RLock
-                        if packet.id != KeepAlive.id:
-                            self.connection.send_to_client(packet)
+                        self.connection.pace()
                     else:
                         raise EOFError()
             except EOFError:
@@ -1,16 +1,21 @@
 import threading
+import time
 
-from multiprocessing import Queue
+from mcidle.networking.packet_queue import PacketQueue
 
 
 # Starts a worker processor thread to process packets
 # and optionally write any responses in a thread-safe manner
+# The client a packet is forwarded to is picked while it's applied to the game state
+# so a joining client gets every packet exactly once, either in the world replay or forwarded
+# Responses and forwarding happen after the game state's lock is released, neither waits on a slow
+# client, with the block policy the reader waits instead (see MinecraftConnection.pace)
 class WorkerProcessor(threading.Thread):
     def __init__(self, connection, packet_processor):
         threading.Thread.__init__(self, daemon=True)
         self.connection = connection
         self.packet_processor = packet_processor
-        self.queue = Queue()
+        self.queue = PacketQueue()
         self.running = True
 
     def enqueue(self, packet):
@@ -18,12 +23,30 @@ class WorkerProcessor(threading.Thread):
 
     def stop(self):
         self.running = False
+        self.queue.close()
 
     def run(self):
+        keep_alive_id = self.packet_processor.packets.KeepAlive.id
         while self.running:
-            if not self.queue.empty():
-                packet = self.queue.get()
-                response = self.packet_processor.process_packet(packet)
+            # Blocks until packets arrive, then processes all of them
+            for packet in self.queue.get_batch():
+                # Packets that don't touch the game state skip the lock
+                if self.packet_processor.locks(packet.id):
+                    with self.packet_processor.game_state.state_lock:
+                        response, target = self.process(packet)
+                else:
+                    response, target = self.process(packet)
 
+                # Answer the server first
                 if response:
                     self.connection.send_packet(response)
+
+                # Ignore KeepAlive's because those are answered here
+                if packet.id != keep_alive_id:
+                    self.connection.send_to_client(packet, target)
+
+    def process(self, packet):
+        start = time.perf_counter()
+        response = self.packet_processor.apply(packet)
+        self.connection.metrics.process.since(start)
+        return response, self.connection.client_target()
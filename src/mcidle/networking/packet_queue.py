@@ -0,0 +1,97 @@
+import threading
+
+from collections import deque
+
+
+class PacketQueue:
+    """ In-process FIFO that consumers block on instead of polling
+
+        Items are passed by reference (nothing is pickled), and a consumer
+        drains everything pending in one go with get_batch()
+
+        With a `size` function (e.g len for frames) the queued bytes are counted in
+        nbytes, and with max_bytes as well a producer can wait_for_room() before putting more
+
+        `generation` counts the clear()s, a put for an older generation is dropped so
+        whoever decided to queue an item before a clear can't slip it in after
+    """
+    def __init__(self, max_bytes=0, size=None):
+        self.items = deque()
+        self.condition = threading.Condition(threading.Lock())
+        self.not_full = threading.Condition(self.condition)
+        self.closed = False
+
+        self.max_bytes = max_bytes
+        self.size = size
+        self.nbytes = 0
+        self.generation = 0
+
+    def has_room(self, size):
+        """ Whether `size` more bytes fit, a single item always fits an empty queue """
+        return not self.max_bytes or not self.nbytes or self.nbytes + size <= self.max_bytes
+
+    def wait_for_room(self, size=0, timeout=None):
+        """ Wait until `size` more bytes fit or the queue is cleared or closed
+            Returns whether they fit
+        """
+        with self.condition:
+            generation = self.generation
+            while not self.has_room(size) and not self.closed and generation == self.generation:
+                if not self.not_full.wait(timeout):
+                    break
+            return self.has_room(size)
+
+    def put(self, item, generation=None):
+        """ Queue an item, returns False if it was for an older generation and not queued """
+        size = self.size(item) if self.size else 0
+        with self.condition:
+            if generation is not None and generation != self.generation:
+                return False
+            self.items.append(item)
+            self.nbytes += size
+            if len(self.items) == 1:
+                self.condition.notify()
+            return True
+
+    def get_batch(self, timeout=None, max_items=None):
+        """ Wait until something is queued and pop everything pending
+            Returns an empty list on timeout or once the queue is closed
+        """
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+
+            items = self.items
+            if max_items is None or len(items) <= max_items:
+                batch = list(items)
+                items.clear()
+            else:
+                batch = [items.popleft() for _ in range(max_items)]
+
+            if self.size and batch:
+                self.nbytes -= sum(self.size(item) for item in batch)
+                self.not_full.notify_all()
+            return batch
+
+    def clear(self):
+        """ Drop everything pending, returns (items, bytes) dropped """
+        with self.condition:
+            dropped = (len(self.items), self.nbytes)
+            self.items.clear()
+            self.nbytes = 0
+            self.generation += 1
+            self.not_full.notify_all()
+            return dropped
+
+    def close(self):
+        """ Wake up any waiting consumer (and producer waiting for room) for good """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            self.not_full.notify_all()
+
+    def empty(self):
+        return not self.items
+
+    def __len__(self):
+        return len(self.items)
@@ -1,6 +1,7 @@
 from mcidle.networking.packets.packet import Packet
 from mcidle.networking.types import String, VarIntPrefixedByteArray, VarInt, Integer, VarIntArray, \
-    Long, Byte, Double, Float, Boolean, UUID, Short, UnsignedByte
+    Long, Byte, Double, Float, Boolean, UUID, Short, UnsignedByte, Angle, TrailingByteArray, \
+    Position
 
 """
  Note: not using an OrderedDict for `definition` will break
@@ -60,6 +61,7 @@ class JoinGame(Packet):
         "LevelType": String,
         "Debug": Boolean,
     }
+    required = ("Gamemode",)
 
 
 class SetCompression(Packet):
@@ -71,21 +73,15 @@ class SetCompression(Packet):
 
 class SetSlot(Packet):
     id = 0x16
-    definition = {
-        "WindowID": None,
-        "Slot": None,
-        "SlotData": None,
-    }
-
     # This packet changes a lot depending on the current protocol
-    # But only SlotData changes
+    # But only SlotData changes, which we don't need to parse
     # See https://wiki.vg/index.php?title=Slot_Data&oldid=7835 (1.12.2)
-    def read_fields(self, packet_buffer):
-        self.WindowID = Byte.read(packet_buffer)
-        self.Slot = Short.read(packet_buffer)
-
-        # The rest of the packet is SlotData which we don't need to parse
-
+    definition = {
+        "WindowID": Byte,
+        "Slot": Short,
+        "SlotData": TrailingByteArray,
+    }
+    required = ("WindowID", "Slot")
 
 
 class ChunkData(Packet):
@@ -94,6 +90,7 @@ class ChunkData(Packet):
         "ChunkX": Integer,
         "ChunkZ": Integer
     }
+    required = ("ChunkX", "ChunkZ")
 
     def read_fields(self, packet_buffer):
         self.ChunkX = Integer.read(packet_buffer)
@@ -116,6 +113,152 @@ class SpawnEntity(Packet):
     }
 
 
+class SpawnObject(Packet):
+    id = 0x00
+    definition = {
+        "EntityID": VarInt,
+        "ObjectUUID": UUID,
+        "Type": Byte,
+        "X": Double,
+        "Y": Double,
+        "Z": Double,
+        "Pitch": Angle,
+        "Yaw": Angle,
+        "Data": Integer,
+        "VelocityX": Short,
+        "VelocityY": Short,
+        "VelocityZ": Short,
+    }
+
+
+class SpawnExperienceOrb(Packet):
+    id = 0x01
+    definition = {
+        "EntityID": VarInt,
+        "X": Double,
+        "Y": Double,
+        "Z": Double,
+        "Count": Short,
+    }
+
+
+class SpawnMob(Packet):
+    id = 0x03
+    definition = {
+        "EntityID": VarInt,
+        "EntityUUID": UUID,
+        "Type": VarInt,
+        "X": Double,
+        "Y": Double,
+        "Z": Double,
+        "Yaw": Angle,
+        "Pitch": Angle,
+        "HeadPitch": Angle,
+        "VelocityX": Short,
+        "VelocityY": Short,
+        "VelocityZ": Short,
+        "Metadata": TrailingByteArray,
+    }
+
+
+class SpawnPainting(Packet):
+    id = 0x04
+    definition = {
+        "EntityID": VarInt,
+        "EntityUUID": UUID,
+        "Title": String,
+        "Location": Position,
+        "Direction": Byte,
+    }
+
+
+class SpawnPlayer(Packet):
+    id = 0x05
+    definition = {
+        "EntityID": VarInt,
+        "PlayerUUID": UUID,
+        "X": Double,
+        "Y": Double,
+        "Z": Double,
+        "Yaw": Angle,
+        "Pitch": Angle,
+        "Metadata": TrailingByteArray,
+    }
+
+
+class EntityRelativeMove(Packet):
+    id = 0x26
+    definition = {
+        "EntityID": VarInt,
+        "DeltaX": Short,
+        "DeltaY": Short,
+        "DeltaZ": Short,
+        "OnGround": Boolean,
+    }
+
+
+class EntityLookAndRelativeMove(Packet):
+    id = 0x27
+    definition = {
+        "EntityID": VarInt,
+        "DeltaX": Short,
+        "DeltaY": Short,
+        "DeltaZ": Short,
+        "Yaw": Angle,
+        "Pitch": Angle,
+        "OnGround": Boolean,
+    }
+
+
+class EntityLook(Packet):
+    id = 0x28
+    definition = {
+        "EntityID": VarInt,
+        "Yaw": Angle,
+        "Pitch": Angle,
+        "OnGround": Boolean,
+    }
+
+
+class EntityHeadLook(Packet):
+    id = 0x36
+    definition = {
+        "EntityID": VarInt,
+        "HeadYaw": Angle,
+    }
+
+
+class EntityMetadata(Packet):
+    id = 0x3C
+    definition = {
+        "EntityID": VarInt,
+        "Metadata": TrailingByteArray,
+    }
+
+
+class EntityVelocity(Packet):
+    id = 0x3E
+    definition = {
+        "EntityID": VarInt,
+        "VelocityX": Short,
+        "VelocityY": Short,
+        "VelocityZ": Short,
+    }
+
+
+class EntityTeleport(Packet):
+    id = 0x4C
+    definition = {
+        "EntityID": VarInt,
+        "X": Double,
+        "Y": Double,
+        "Z": Double,
+        "Yaw": Angle,
+        "Pitch": Angle,
+        "OnGround": Boolean,
+    }
+
+
 class DestroyEntities(Packet):
     id = 0x32
     definition = {
@@ -130,6 +273,36 @@ class KeepAlive(Packet):
     }
 
 
+class KeepAliveVarInt(KeepAlive):
+    """ KeepAlive before 1.12.2 (protocol 340), the ID was a VarInt """
+    definition = {
+        "KeepAliveID": VarInt
+    }
+
+
+class ServerDifficulty(Packet):
+    id = 0x0D
+    definition = {
+        "Difficulty": UnsignedByte
+    }
+
+
+class SetExperience(Packet):
+    id = 0x40
+    definition = {
+        "ExperienceBar": Float,
+        "Level": VarInt,
+        "TotalExperience": VarInt,
+    }
+
+
+class SpawnPosition(Packet):
+    id = 0x46
+    definition = {
+        "Location": Position
+    }
+
+
 class ChatMessage(Packet):
     id = 0x0F
     definition = {
@@ -146,6 +319,7 @@ class Respawn(Packet):
         "Gamemode": UnsignedByte,
         "LevelType": String,
     }
+    required = ("Gamemode",)
 
 
 class PlayerPositionAndLook(Packet):
@@ -192,8 +366,27 @@ class PlayerListItem(Packet):
         "NumberOfPlayers": None,
         "Players": None
     }
+    # Fields of a player entry decode() reads (UUID, Name, Properties, Gamemode, Ping, DisplayName)
+    # The rest are skipped and left as None, the UUID is always decoded. None decodes them all
+    entry_fields = ("UUID", "Gamemode")
+
+    def decodes(self, field):
+        return self.decoded is None or field in self.decoded
+
+    def read_optional(self, field, data_type, packet_buffer):
+        if self.decodes(field):
+            return data_type.read(packet_buffer)
+        data_type.skip(packet_buffer)
+        return None
 
     def read_fields(self, packet_buffer):
+        self.read_players(packet_buffer, None)
+
+    def read_required(self, packet_buffer):
+        self.read_players(packet_buffer, self.entry_fields)
+
+    def read_players(self, packet_buffer, decoded):
+        self.decoded = decoded
         self.Action = VarInt.read(packet_buffer)
         self.NumberOfPlayers = VarInt.read(packet_buffer)
         self.Players = []
@@ -202,31 +395,38 @@ class PlayerListItem(Packet):
             uuid = UUID.read(packet_buffer)
             player = [uuid]
             if self.Action == 0: # Add Player
-                name = String.read(packet_buffer)
+                name = self.read_optional("Name", String, packet_buffer)
                 number_of_properties = VarInt.read(packet_buffer)
-                properties = []
+                properties = [] if self.decodes("Properties") else None
                 for _ in range(0, number_of_properties):
-                    name = String.read(packet_buffer)
+                    if properties is None:
+                        String.skip(packet_buffer)
+                        String.skip(packet_buffer)
+                        if Boolean.read(packet_buffer): # has signature
+                            String.skip(packet_buffer)
+                        continue
+
+                    property_name = String.read(packet_buffer)
                     value = String.read(packet_buffer)
                     signature = None
                     if Boolean.read(packet_buffer): # has signature
                         signature = String.read(packet_buffer)
-                    properties.append((name, value, signature))
+                    properties.append((property_name, value, signature))
 
-                gamemode = VarInt.read(packet_buffer)
-                ping = VarInt.read(packet_buffer)
+                gamemode = self.read_optional("Gamemode", VarInt, packet_buffer)
+                ping = self.read_optional("Ping", VarInt, packet_buffer)
 
                 display_name = None
                 if Boolean.read(packet_buffer): # has display name
-                    display_name = String.read(packet_buffer)
+                    display_name = self.read_optional("DisplayName", String, packet_buffer)
 
                 player.append((name, properties, gamemode, ping, display_name))
             elif self.Action == 1: # Update Gamemode
-                player.append(VarInt.read(packet_buffer))
+                player.append(self.read_optional("Gamemode", VarInt, packet_buffer))
             elif self.Action == 2: # Update Latency
-                player.append(VarInt.read(packet_buffer))
+                player.append(self.read_optional("Ping", VarInt, packet_buffer))
             elif self.Action == 3: # Update Display Name
                 has_display_name = Boolean.read(packet_buffer)
                 if has_display_name:
-                    player.append(String.read(packet_buffer))
+                    player.append(self.read_optional("DisplayName", String, packet_buffer))
             self.Players.append(player)
@@ -0,0 +1,118 @@
+import struct
+from operator import attrgetter
+
+
+class PacketCodec:
+    """ Reads and writes a packet's fields, compiled once from its definition
+
+        Runs of fixed-width fields (Double, Float, Long, ...) collapse into a single
+        precompiled struct.Struct so they cost one read and one unpack together.
+        Variable-width fields (VarInt, String, ...) go through their Type.
+
+        With `required` fields read_required() only decodes those, the others are
+        skipped by their length (padding in the struct of a fixed-width run) and
+        everything after the last required field isn't looked at. read() decodes all.
+    """
+    def __init__(self, steps, read_steps=None, head_size=None):
+        # Each step is (struct, field names, getter) for a fixed-width run
+        # or (None, field name, data type) for a variable-width field
+        # A read step with no field name skips a value of that type
+        self.steps = steps
+        self.read_steps = steps if read_steps is None else read_steps
+        # Bytes of the body the required fields are within, None if that depends on the values
+        self.head_size = head_size
+
+    @staticmethod
+    def compile(definition, required=None):
+        """ Compile a codec from a packet definition
+            Returns None if the definition has fields without a Type
+        """
+        if not definition or any(data_type is None for data_type in definition.values()):
+            return None
+
+        steps = PacketCodec.compile_steps(definition)
+        if required is None:
+            return PacketCodec(steps)
+
+        read_steps, head_size = PacketCodec.compile_read_steps(definition, required)
+        return PacketCodec(steps, read_steps, head_size)
+
+    @staticmethod
+    def compile_steps(definition):
+        steps = []
+        run = []  # (name, format) of the fixed-width fields being collected
+
+        def flush():
+            if run:
+                names = tuple(name for name, _ in run)
+                compiled = struct.Struct('>' + ''.join(fmt for _, fmt in run))
+                getter = attrgetter(*names) if len(names) > 1 else (lambda packet, name=names[0]: (getattr(packet, name),))
+                steps.append((compiled, names, getter))
+                del run[:]
+
+        for name, data_type in definition.items():
+            if data_type.format is not None:
+                run.append((name, data_type.format))
+            else:
+                flush()
+                steps.append((None, name, data_type))
+        flush()
+
+        return steps
+
+    @staticmethod
+    def compile_read_steps(definition, required):
+        """ Read steps decoding only the required fields, and the head size they need """
+        names = list(definition)
+        last = max(names.index(name) for name in required)
+
+        steps = []
+        run = []  # (name or None, format) of the fixed-width fields being collected
+        head_size = 0
+
+        def flush():
+            if run:
+                compiled = struct.Struct('>' + ''.join(fmt if name else '%sx' % struct.calcsize('>' + fmt)
+                                                       for name, fmt in run))
+                steps.append((compiled, tuple(name for name, _ in run if name), None))
+                del run[:]
+
+        for name in names[:last + 1]:
+            data_type = definition[name]
+            if data_type.format is not None:
+                run.append((name if name in required else None, data_type.format))
+                if head_size is not None:
+                    head_size += struct.calcsize('>' + data_type.format)
+            else:
+                flush()
+                steps.append((None, name if name in required else None, data_type))
+                head_size = None
+        flush()
+
+        return steps, head_size
+
+    def read(self, packet, stream):
+        self.run_read_steps(self.steps, packet, stream)
+
+    def read_required(self, packet, stream):
+        self.run_read_steps(self.read_steps, packet, stream)
+
+    @staticmethod
+    def run_read_steps(steps, packet, stream):
+        fields = packet.__dict__
+        for compiled, names, accessor in steps:
+            if compiled is not None:
+                fields.update(zip(names, compiled.unpack(stream.read(compiled.size))))
+            elif names is None:
+                accessor.skip(stream)
+            else:
+                fields[names] = accessor.read(stream)
+
+    def write(self, packet, stream):
+        length = 0
+        for compiled, names, accessor in self.steps:
+            if compiled is not None:
+                length += stream.write(compiled.pack(*accessor(packet)))
+            else:
+                length += accessor.write(getattr(packet, names), stream)
+        return length
@@ -1,8 +1,9 @@
 from .packet_buffer import PacketBuffer
 from ..types import VarInt
-from zlib import compress
+from zlib import compress, decompress, decompressobj
 from base64 import b64encode
 
+from .codec import PacketCodec
 from .exceptions import InvalidPacketID
 
 
@@ -10,6 +11,15 @@ class Packet:
     id = None
     ids = None
     definition = None
+    codec = None
+    # The fields the processors use, decode() skips over the others. None decodes them all
+    required = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Compile the field codec once per packet class
+        if 'definition' in cls.__dict__ or 'required' in cls.__dict__:
+            cls.codec = PacketCodec.compile(cls.definition, cls.required)
 
     def __init__(self, **kwargs):
         self.packet_buffer_ = PacketBuffer()
@@ -40,25 +50,52 @@ class Packet:
         assert not kwargs or not self.definition or set(kwargs.keys()) == set(self.definition.keys()), "Packet fields do not match definition!"
 
     def read_fields(self, packet_buffer):
+        if self.codec is not None:
+            self.codec.read(self, packet_buffer)
+            return
+
         for var_name, data_type in self.definition.items():
             val = data_type.read(packet_buffer)
             setattr(self, var_name, val)
 
+    def read_required(self, packet_buffer):
+        """ Read just the fields decode() needs, the codec skips over the others """
+        if self.codec is not None:
+            self.codec.read_required(self, packet_buffer)
+        else:
+            self.read_fields(packet_buffer)
+
+    @classmethod
+    def decode(cls, raw_packet):
+        """ Read only the required fields of a RawPacket, inflating only as much of its body as they need
+            The other fields are left unset, read() decodes all of them
+        """
+        if cls.codec is not None and cls.codec.head_size is not None:
+            return cls().read(raw_packet.head(VarInt.size(cls.id) + cls.codec.head_size), True)
+        return cls().read(raw_packet.packet_buffer, True)
+
     """ Read from the packet buffer into the packet's fields """
-    def read(self, packet_buffer):
+    def read(self, packet_buffer, required_only=False):
         id_ = VarInt.read(packet_buffer)
 
         if not (id_ == self.id or (self.ids and id_ in self.ids)): # Invalid packet id
             raise InvalidPacketID('Invalid packet id! Read %s instead of' % hex(id_), hex(self.id), self.ids)
 
-        self.read_fields(packet_buffer)
+        if required_only:
+            self.read_required(packet_buffer)
+        else:
+            self.read_fields(packet_buffer)
 
         self.packet_buffer_ = packet_buffer
         self.packet_buffer_.reset_cursor()
 
         return self
 
-    def write(self, compression_threshold=None):
+    def write(self, compression_threshold=None, compression_level=-1):
+        """ Serialise the packet into a frame
+            compression_level is the zlib level for bodies over the threshold, -1 is zlib's default
+            and 0 sends them uncompressed with a Data Length of 0, which is cheapest on a loopback link
+        """
         if self.id is None:
             raise AttributeError("Packet ID is undefined.")
 
@@ -75,7 +112,8 @@ class Packet:
 
         """ Apply compression if needed """
         if compression_threshold and compression_threshold >= 0:
-            return self.__write_compressed(packet_buffer, data_length, data_length >= compression_threshold)
+            return self.__write_compressed(packet_buffer, data_length, compression_level, \
+                                           compression_level != 0 and data_length >= compression_threshold)
 
         """ Uncompressed packet """
         VarInt.write(data_length, self.packet_buffer_) # Write the packet length
@@ -83,18 +121,18 @@ class Packet:
         return self
 
     """ Write the compressed packet to the buffer """
-    def __write_compressed(self, packet_buffer, data_length, is_compressed):
+    def __write_compressed(self, packet_buffer, data_length, compression_level, is_compressed):
         actual_data_length = 0
         data = packet_buffer.bytes
 
         if is_compressed:
             actual_data_length = data_length
-            data = compress(data)
+            data = compress(data, compression_level)
 
         # Clear the last packet buffer to be overwritten
         packet_buffer.clear()
 
-        packet_length = VarInt.write(actual_data_length, PacketBuffer()) + len(data)
+        packet_length = VarInt.size(actual_data_length) + len(data)
 
         VarInt.write(packet_length, self.packet_buffer_)
         VarInt.write(actual_data_length, self.packet_buffer_)
@@ -103,6 +141,9 @@ class Packet:
         return self
 
     def __write_fields(self, packet_buffer):
+        if self.codec is not None:
+            return self.codec.write(self, packet_buffer)
+
         length = 0
         for var_name, data_type in self.definition.items():
             """ Get the field's data """
@@ -142,3 +183,68 @@ class Packet:
 
     def __repr__(self):
         return str(self)
+
+
+class RawPacket(Packet):
+    """ A packet read off the wire which keeps its raw frame
+
+        The frame is forwarded as-is and its body is only inflated when
+        something actually reads `packet_buffer`
+    """
+    def __init__(self, id, frame, offset, data_length=0):
+        self.id = id
+        self.frame = frame
+        self.offset = offset  # Where the (possibly compressed) body starts in the frame
+        self.data_length = data_length  # Inflated body length, 0 if the body isn't compressed
+        self.packet_buffer_ = None
+
+    @staticmethod
+    def peek(frame, offset, data_length, length):
+        """ The first `length` bytes of a frame's body without inflating all of it
+            The compressed body is fed in growing pieces until there's enough output
+        """
+        if data_length:
+            body = memoryview(frame)[offset:]
+            inflater = decompressobj()
+            data, start, step = b'', 0, 64
+            while len(data) < length and start < len(body):
+                data += inflater.decompress(body[start:start + step], length - len(data))
+                start += step
+                step *= 2
+            return data
+        return frame[offset:offset + length]
+
+    def head(self, length):
+        """ A PacketBuffer over just the first `length` bytes of the body
+            Enough to read the leading fields of a large packet such as ChunkData
+        """
+        if self.packet_buffer_ is not None:
+            return PacketBuffer(self.packet_buffer_.bytes[:length])
+        return PacketBuffer(self.peek(self.frame, self.offset, self.data_length, length))
+
+    @property
+    def packet_buffer(self):
+        if self.packet_buffer_ is None:
+            if self.data_length:
+                # The Data Length is the exact inflated size, so the output is allocated once
+                data = decompress(memoryview(self.frame)[self.offset:], bufsize=self.data_length)
+                assert(len(data) == self.data_length)
+                self.packet_buffer_ = PacketBuffer(data)
+            else:
+                self.packet_buffer_ = PacketBuffer(self.frame, self.offset)
+        return self.packet_buffer_
+
+    @property
+    def buffer(self):
+        return self.packet_buffer
+
+    @property
+    def bytes(self):
+        return self.packet_buffer.bytes
+
+    @property
+    def compressed_buffer(self):
+        # The frame with its length and compression indicator, wrapped without a copy
+        # This packet may or may not actually be compressed
+        # Storing the compressed buffer helps w/ performance since we don't have to re-compress it
+        return PacketBuffer(self.frame)
@@ -2,9 +2,16 @@ from io import BytesIO
 
 
 class PacketBuffer:
-    """ Wrapper around BytesIO """
-    def __init__(self):
-        self.bytes_ = BytesIO()
+    """ Wrapper around BytesIO
+
+        An existing bytes object can be wrapped without copying it, `offset` marks
+        where the buffer's contents start within it (e.g past a frame header)
+    """
+    def __init__(self, data=None, offset=0):
+        self.bytes_ = BytesIO(data) if data is not None else BytesIO()
+        self.offset_ = offset
+        if offset:
+            self.bytes_.seek(offset)
 
     def write(self, value):
         return self.bytes_.write(value)
@@ -12,19 +19,25 @@ class PacketBuffer:
     def read(self, length=None):
         return self.bytes_.read(length)
 
+    def skip(self, length):
+        self.bytes_.seek(length, 1)
+
     def clear(self):
         self.bytes_ = BytesIO()
+        self.offset_ = 0
 
     def reset_cursor(self):
-        self.bytes_.seek(0)
+        self.bytes_.seek(self.offset_)
 
     def __len__(self):
         return len(self.bytes)
 
     @property
     def bytes(self):
+        if self.offset_:
+            return self.bytes_.getvalue()[self.offset_:]
         return self.bytes_.getvalue()
 
     # Hex representation of bytes array
     def __str__(self):
-        return ' '.join(["%02X" % b for b in self.bytes_.getvalue()])
+        return ' '.join(["%02X" % b for b in self.bytes])
@@ -0,0 +1,130 @@
+from mcidle.networking.packets import clientbound, serverbound
+
+
+HANDSHAKING = 'handshaking'
+LOGIN = 'login'
+PLAY = 'play'
+
+CLIENTBOUND = 'clientbound'
+SERVERBOUND = 'serverbound'
+
+
+class UnsupportedProtocol(Exception):
+    pass
+
+
+class PacketTable:
+    """ The packets of one (protocol, state, direction), resolved for constant-time lookups
+
+        Packets are attributes by name (table.KeepAlive) and `by_id` is a flat list from
+        packet ID to packet class. Classes whose ID differs from the one they define are
+        subclassed with this version's ID, so writing them puts the right ID on the wire.
+    """
+    def __init__(self, protocol, state, direction, packets):
+        self.protocol = protocol
+        self.state = state
+        self.direction = direction
+
+        self.by_name = {}
+        self.by_id = [None] * (max([packet_id for _, packet_id in packets.values()] or [-1]) + 1)
+        for name, (packet_class, packet_id) in packets.items():
+            if packet_class.id != packet_id:
+                packet_class = type(packet_class.__name__, (packet_class,), {'id': packet_id})
+            self.by_name[name] = packet_class
+            self.by_id[packet_id] = packet_class
+            setattr(self, name, packet_class)
+
+    def __getitem__(self, packet_id):
+        """ The packet class with this ID or None """
+        if 0 <= packet_id < len(self.by_id):
+            return self.by_id[packet_id]
+        return None
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def ids(self, *names):
+        """ IDs of the named packets this version has """
+        return [self.by_name[name].id for name in names if name in self.by_name]
+
+
+class PacketRegistry:
+    """ Packet classes and their IDs by (protocol, state, direction)
+
+        A version is registered packet by packet or derived from another version
+        with a few packets replaced. Connections resolve the tables they need once.
+    """
+    def __init__(self):
+        self.packets = {}  # (protocol, state, direction) -> {name: (packet class, packet ID)}
+        self.tables = {}
+
+    def register(self, protocol, state, direction, packet_class, packet_id=None, name=None):
+        """ Add a packet, by default under its class name and with the ID it defines """
+        packets = self.packets.setdefault((protocol, state, direction), {})
+        packets[name or packet_class.__name__] = (packet_class, packet_class.id if packet_id is None else packet_id)
+        self.tables.pop((protocol, state, direction), None)
+
+    def derive(self, protocol, base, changes=()):
+        """ Register `protocol` as a copy of `base`
+            changes are (state, direction, name, packet class, packet ID or None) to replace or add
+        """
+        for (version, state, direction), packets in list(self.packets.items()):
+            if version == base:
+                for name, (packet_class, packet_id) in packets.items():
+                    self.register(protocol, state, direction, packet_class, packet_id, name)
+        for state, direction, name, packet_class, packet_id in changes:
+            self.register(protocol, state, direction, packet_class, packet_id, name)
+
+    def protocols(self):
+        return sorted(set(protocol for protocol, _, _ in self.packets))
+
+    def supports(self, protocol):
+        return protocol in self.protocols()
+
+    def resolve(self, protocol, state, direction):
+        """ The PacketTable for a protocol version, built once and shared afterwards """
+        key = (protocol, state, direction)
+        table = self.tables.get(key)
+        if table is None:
+            if not self.supports(protocol):
+                raise UnsupportedProtocol("Protocol %s is not supported, use one of %s" % (protocol, self.protocols()))
+            table = PacketTable(protocol, state, direction, self.packets.get(key, {}))
+            self.tables[key] = table
+        return table
+
+
+registry = PacketRegistry()
+
+# 1.12.2
+for packet_class in (serverbound.Handshake,):
+    registry.register(340, HANDSHAKING, SERVERBOUND, packet_class)
+
+for packet_class in (serverbound.LoginStart, serverbound.EncryptionResponse):
+    registry.register(340, LOGIN, SERVERBOUND, packet_class)
+
+for packet_class in (clientbound.EncryptionRequest, clientbound.LoginSuccess, clientbound.SetCompression):
+    registry.register(340, LOGIN, CLIENTBOUND, packet_class)
+
+for packet_class in (clientbound.SpawnObject, clientbound.SpawnExperienceOrb, clientbound.SpawnMob,
+                     clientbound.SpawnPainting, clientbound.SpawnPlayer, clientbound.ServerDifficulty,
+                     clientbound.SetSlot, clientbound.UnloadChunk, clientbound.Disconnect, clientbound.KeepAlive,
+                     clientbound.ChunkData, clientbound.JoinGame, clientbound.EntityRelativeMove,
+                     clientbound.EntityLookAndRelativeMove, clientbound.EntityLook, clientbound.PlayerAbilities,
+                     clientbound.PlayerListItem, clientbound.PlayerPositionAndLook, clientbound.DestroyEntities,
+                     clientbound.Respawn, clientbound.EntityHeadLook, clientbound.HeldItemChange,
+                     clientbound.EntityMetadata, clientbound.EntityVelocity, clientbound.SetExperience,
+                     clientbound.UpdateHealth, clientbound.SpawnPosition, clientbound.TimeUpdate,
+                     clientbound.EntityTeleport, clientbound.ChatMessage, clientbound.GameState):
+    registry.register(340, PLAY, CLIENTBOUND, packet_class)
+
+for packet_class in (serverbound.TeleportConfirm, serverbound.ClientStatus, serverbound.ChatMessage,
+                     serverbound.ClickWindow, serverbound.KeepAlive, serverbound.Player, serverbound.PlayerPosition,
+                     serverbound.PlayerPositionAndLook, serverbound.PlayerLook, serverbound.PlayerAbilities,
+                     serverbound.EntityAction, serverbound.HeldItemChange, serverbound.Animation):
+    registry.register(340, PLAY, SERVERBOUND, packet_class)
+
+# 1.12.1, the same IDs but KeepAlive IDs are VarInts
+registry.derive(338, 340, [
+    (PLAY, CLIENTBOUND, 'KeepAlive', clientbound.KeepAliveVarInt, None),
+    (PLAY, SERVERBOUND, 'KeepAlive', serverbound.KeepAliveVarInt, None),
+])
@@ -109,6 +109,13 @@ class KeepAlive(Packet):
     }
 
 
+class KeepAliveVarInt(KeepAlive):
+    """ KeepAlive before 1.12.2 (protocol 340), the ID was a VarInt """
+    definition = {
+        "KeepAliveID": VarInt
+    }
+
+
 class PlayerPosition(Packet):
     id = 0x0D
     definition = {
@@ -0,0 +1,164 @@
+class ReplayBuffer:
+    """ The cached world as ready-to-send frames, split into segments by category
+
+        Joining a client replays every segment in CATEGORIES order. Processors call
+        GameState.touch(category) when they change what a segment is built from and only
+        those segments are rebuilt at the next join. Everything else is handed out as
+        the frames that were built before, so a join mostly costs a snapshot of references.
+
+        Segments are copy-on-write: a built segment is an immutable tuple that is replaced,
+        never changed, so a snapshot stays valid while the live game state keeps changing.
+        `version` counts the changes, a snapshot reflects the game state at that version.
+
+        Some segments are built at every join instead: 'position' because every join gets a new
+        teleport ID and 'chunks' because keeping them would hold inflated copies of the zlib-packed
+        chunks and views over spilled ones, the chunk store already keeps ready-to-send frames.
+
+        The DEFERRED segments take time in proportion to the world (inflating chunks, serialising
+        every entity). Under the lock only their immutable records are taken, they're built by
+        ReplaySnapshot.frames() once the lock is released.
+    """
+    UNCACHED = ('position', 'chunks')
+    DEFERRED = ('chunks', 'entities')
+    CATEGORIES = ('join', 'health', 'abilities', 'position', 'time', 'players', 'chunks', 'entities',
+                  'held_item', 'gamemode', 'inventory')
+
+    def __init__(self, game_state):
+        self.game_state = game_state
+        self.segments = {}  # Category -> tuple of frames
+        self.compression_threshold = None
+        self.compression_level = -1
+        self.version = 0
+        self.changes = {}  # Category -> times it was invalidated
+
+    def invalidate(self, category):
+        self.version += 1
+        self.changes[category] = self.changes.get(category, 0) + 1
+        self.segments.pop(category, None)
+
+    def snapshot(self, compression_threshold=None, compression_level=-1):
+        """ What a freshly logged in client needs to join the cached world, as a ReplaySnapshot
+            The caller must hold the game state's lock while taking it, but not to get its frames()
+        """
+        if (compression_threshold, compression_level) != (self.compression_threshold, self.compression_level):
+            # Re-serialised packets depend on the threshold and level
+            self.segments.clear()
+            self.compression_threshold = compression_threshold
+            self.compression_level = compression_level
+
+        parts = []  # (category, frames or None, records to build them from)
+        for category in self.CATEGORIES:
+            segment = self.segments.get(category)
+            if segment is None and category in self.DEFERRED:
+                parts.append((category, None, (self.changes.get(category, 0), getattr(self, 'take_' + category)())))
+                continue
+            if segment is None:
+                segment = tuple(getattr(self, 'build_' + category)())
+                if category not in self.UNCACHED:
+                    self.segments[category] = segment
+            parts.append((category, segment, None))
+        return ReplaySnapshot(self, parts, compression_threshold, compression_level)
+
+    def store(self, category, changes, segment, compression):
+        """ Cache a segment built outside the lock, unless it was invalidated since its records were taken """
+        if category in self.UNCACHED:
+            return
+        with self.game_state.state_lock:
+            if self.changes.get(category, 0) == changes and \
+                    compression == (self.compression_threshold, self.compression_level):
+                self.segments[category] = segment
+
+    def write(self, packet):
+        return packet.write(self.compression_threshold, self.compression_level).bytes
+
+    # Send the player all the packets that lets them join the world
+    def build_join(self):
+        game_state = self.game_state
+        return [game_state.packet_log[id_].frame for id_ in game_state.join_ids if id_ in game_state.packet_log]
+
+    # Send their health
+    def build_health(self):
+        return [self.write(self.game_state.update_health)] if self.game_state.update_health else []
+
+    # Send their player abilities
+    def build_abilities(self):
+        return [self.write(self.game_state.abilities)] if self.game_state.abilities else []
+
+    # Send them their last position/look if it exists
+    def build_position(self):
+        game_state = self.game_state
+        if game_state.packets.PlayerPositionAndLook.id not in game_state.packet_log:
+            return []
+
+        if game_state.last_pos_packet:
+            last_packet = game_state.last_pos_packet
+
+            pos_packet = game_state.packets.PlayerPositionAndLook( \
+                X=last_packet.X, Y=last_packet.Y, Z=last_packet.Z, \
+                Yaw=game_state.last_yaw, Pitch=game_state.last_pitch, Flags=0, \
+                TeleportID=game_state.teleport_id)
+            game_state.teleport_id += 1
+            return [self.write(pos_packet)]
+
+        # Send the last packet that we got
+        return [game_state.packet_log[game_state.packets.PlayerPositionAndLook.id].frame]
+
+    def build_time(self):
+        packet = self.game_state.packet_log.get(self.game_state.packets.TimeUpdate.id)
+        return [packet.frame] if packet else []
+
+    # Send the player list items (to see other players)
+    def build_players(self):
+        return [packet.frame for packet in self.game_state.player_list.values()]
+
+    # Send all loaded chunks, nearest to the player first
+    def take_chunks(self):
+        return self.game_state.chunks.snapshot()
+
+    def build_chunks(self, records, compression_threshold, compression_level):
+        return self.game_state.chunks.build(records)
+
+    # Spawn all the currently loaded entities where they are now
+    def take_entities(self):
+        return self.game_state.entities.snapshot()
+
+    def build_entities(self, records, compression_threshold, compression_level):
+        return self.game_state.entities.build(records, compression_threshold, compression_level)
+
+    # Send their last held item
+    def build_held_item(self):
+        return [self.write(self.game_state.packets.HeldItemChange(Slot=self.game_state.held_item_slot))]
+
+    # Send their current gamemode if it's defined
+    def build_gamemode(self):
+        if self.game_state.gamemode is None:
+            return []
+        return [self.write(self.game_state.packets.GameState(Reason=3, Value=self.game_state.gamemode))]
+
+    # Send their inventory
+    def build_inventory(self):
+        return [packet.frame for packet in self.game_state.main_inventory.values()]
+
+
+class ReplaySnapshot:
+    """ The segments of a ReplayBuffer at one version of the game state
+
+        Built segments are held as they are, deferred ones as the records taken under the lock.
+        frames() builds those without the lock, so a join doesn't hold up processing packets.
+    """
+    def __init__(self, replay, parts, compression_threshold=None, compression_level=-1):
+        self.replay = replay
+        self.parts = parts
+        self.compression = (compression_threshold, compression_level)
+
+    def frames(self):
+        """ Every frame to send in order, call this once and without holding the game state's lock """
+        replay = self.replay
+        frames = []
+        for category, segment, records in self.parts:
+            if segment is None:
+                changes, records = records
+                segment = tuple(getattr(replay, 'build_' + category)(records, *self.compression))
+                replay.store(category, changes, segment, self.compression)
+            frames.extend(segment)
+        return frames
@@ -0,0 +1,157 @@
+import mmap
+import os
+import tempfile
+
+
+class SpillFile:
+    """ A dict of key -> frame whose frames live on disk instead of the heap
+
+        Frames are appended to a segment file and read back through a memory map,
+        only the offset index is kept in memory. Reading gives a memoryview straight
+        over the mapped pages so replaying doesn't copy them onto the heap first.
+
+        Replaced and deleted frames leave dead space behind, the segment is compacted
+        (live frames copied to a fresh file) once there's more dead space than live
+        data and at least min_compact bytes of it.
+
+        Windows won't delete a file that is still open or mapped, and views handed out keep
+        an old map alive. Segments that can't be deleted yet are retried at the next
+        compaction and when the spill file is closed.
+    """
+    def __init__(self, directory=None, prefix='mcidle-', min_compact=1 << 20):
+        self.directory = directory
+        self.prefix = prefix
+        self.min_compact = min_compact
+
+        self.index = {}  # key -> (offset, length)
+        self.live = 0  # Bytes of the segment still referenced by the index
+        self.compactions = 0
+
+        self.path = None
+        self.stale = []  # Paths of old segments that couldn't be deleted yet
+        self.file = None
+        self.size = 0
+        self.map = None
+        self.mapped = 0
+        self.open_segment()
+
+    def open_segment(self):
+        fd, path = tempfile.mkstemp(suffix='.seg', prefix=self.prefix, dir=self.directory)
+        self.file = os.fdopen(fd, 'r+b', buffering=0)
+        self.size = 0
+        self.map = None
+        self.mapped = 0
+
+        # Unlink right away where the OS allows it so nothing is left behind if we crash
+        try:
+            os.unlink(path)
+            self.path = None
+        except OSError:
+            self.path = path
+
+    def close(self):
+        # Views handed out keep the old map alive until they are released, so just drop it
+        self.map = None
+        self.index.clear()
+        self.live = 0
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.path:
+            self.stale.append(self.path)
+            self.path = None
+        self.remove_stale()
+
+    def remove_stale(self):
+        """ Delete the old segments that are no longer in use """
+        stale = []
+        for path in self.stale:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                stale.append(path)  # Still open or mapped
+        self.stale = stale
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def append(self, data):
+        if self.file is None:
+            raise ValueError("Spill file is closed")
+
+        offset = self.size
+        self.file.seek(offset)
+        self.file.write(data)
+        self.size += len(data)
+        return offset
+
+    def __setitem__(self, key, data):
+        if key in self.index:
+            self.live -= self.index[key][1]
+        self.index[key] = (self.append(data), len(data))
+        self.live += len(data)
+        self.maybe_compact()
+
+    def __delitem__(self, key):
+        self.live -= self.index.pop(key)[1]
+        self.maybe_compact()
+
+    def __getitem__(self, key):
+        offset, length = self.index[key]
+        if offset + length > self.mapped:
+            self.remap()
+        return memoryview(self.map)[offset:offset + length]
+
+    def remap(self):
+        self.map = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+        self.mapped = self.size
+
+    def values(self):
+        return [self[key] for key in self.index]
+
+    def items(self):
+        return [(key, self[key]) for key in self.index]
+
+    def memory(self):
+        """ Bytes of live frames on disk """
+        return self.live
+
+    def maybe_compact(self):
+        dead = self.size - self.live
+        if dead >= self.min_compact and dead > self.live:
+            self.compact()
+
+    def compact(self):
+        """ Copy the live frames into a fresh segment and drop the old one """
+        old_file, old_path = self.file, self.path
+        if self.size and self.mapped < self.size:
+            self.remap()
+        old_map = self.map
+
+        self.open_segment()
+        for key, (offset, length) in self.index.items():
+            self.index[key] = (self.append(old_map[offset:offset + length]), length)
+
+        # Release the old segment before deleting it, views handed out may still keep
+        # it mapped in which case deleting it is retried later
+        if old_map is not None:
+            try:
+                old_map.close()
+            except BufferError:
+                pass  # Views are still using it, it's unmapped once they're released
+        old_file.close()
+        if old_path:
+            self.stale.append(old_path)
+        self.remove_stale()
+        self.compactions += 1
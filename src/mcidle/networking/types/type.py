@@ -12,6 +12,9 @@ from .utility import Vector
 class Type:
     __slots__ = ()
 
+    # The struct format of fixed-width types, these can be packed together
+    format = None
+
     @staticmethod
     def read(stream):
         raise NotImplementedError("Base data type not de-serializable")
@@ -20,8 +23,18 @@ class Type:
     def write(value, stream):
         raise NotImplementedError("Base data type not serializable")
 
+    @classmethod
+    def skip(cls, stream):
+        """ Move past a value without decoding it """
+        if cls.format is not None:
+            stream.skip(struct.calcsize('>' + cls.format))
+        else:
+            cls.read(stream)
+
 
 class Boolean(Type):
+    format = '?'
+
     @staticmethod
     def read(stream):
         return struct.unpack('?', stream.read(1))[0]
@@ -32,6 +45,8 @@ class Boolean(Type):
 
 
 class UnsignedByte(Type):
+    format = 'B'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>B', stream.read(1))[0]
@@ -41,7 +56,13 @@ class UnsignedByte(Type):
         return stream.write(struct.pack('>B', value))
 
 
+class Angle(UnsignedByte):
+    """ A rotation in steps of 1/256 of a full turn, kept as the raw step count """
+
+
 class Byte(Type):
+    format = 'b'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>b', stream.read(1))[0]
@@ -52,6 +73,8 @@ class Byte(Type):
 
 
 class Short(Type):
+    format = 'h'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>h', stream.read(2))[0]
@@ -62,6 +85,8 @@ class Short(Type):
 
 
 class UnsignedShort(Type):
+    format = 'H'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>H', stream.read(2))[0]
@@ -72,6 +97,8 @@ class UnsignedShort(Type):
 
 
 class Integer(Type):
+    format = 'i'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>i', stream.read(4))[0]
@@ -91,66 +118,130 @@ class FixedPointInteger(Type):
         return Integer.write(int(value * 32), stream)
 
 
-class VarInt(Type):
-    @staticmethod
-    def read(stream):
-        number = 0
-        # Limit of 5 bytes, otherwise its possible to cause
-        # a DOS attack by sending VarInts that just keep
-        # going
-        bytes_encountered = 0
+class VarNumber(Type):
+    """ Base of the protocol's variable-length two's complement integers
+        Seven bits per byte, least significant group first
+    """
+    bits = None
+    max_bytes = None
+
+    @classmethod
+    def read(cls, stream):
+        byte = stream.read(1)
+        if len(byte) < 1:
+            raise EOFError("Unexpected end of message.")
+
+        byte = byte[0]
+        if byte < 0x80:  # Single byte fast path
+            return byte
+
+        number = byte & 0x7F
+        shift = 7
+        # Limit the amount of bytes, otherwise its possible to cause
+        # a DOS attack by sending VarInts that just keep going
         while True:
+            if shift >= cls.max_bytes * 7:
+                raise ValueError("Tried to read too long of a %s" % cls.__name__)
+
             byte = stream.read(1)
             if len(byte) < 1:
                 raise EOFError("Unexpected end of message.")
 
-            byte = ord(byte)
-            number |= (byte & 0x7F) << 7 * bytes_encountered
+            byte = byte[0]
+            number |= (byte & 0x7F) << shift
             if not byte & 0x80:
                 break
+            shift += 7
+        return cls.signed(number)
 
-            bytes_encountered += 1
-            if bytes_encountered > 5:
-                raise ValueError("Tried to read too long of a VarInt")
-        return number
+    @classmethod
+    def read_buffer(cls, buf, offset=0, end=None):
+        """ Read from a bytes-like object in place, returns (value, offset past it) """
+        if end is None:
+            end = len(buf)
 
-    @staticmethod
-    def write(value, stream):
-        out = bytes()
+        if offset < end:
+            byte = buf[offset]
+            if byte < 0x80:  # Single byte fast path
+                return byte, offset + 1
+
+        number = 0
+        shift = 0
+        limit = cls.max_bytes * 7
         while True:
-            byte = value & 0x7F
-            value >>= 7
-            out += struct.pack("B", byte | (0x80 if value > 0 else 0))
-            if value == 0:
+            if offset >= end:
+                raise EOFError("Unexpected end of message.")
+
+            byte = buf[offset]
+            offset += 1
+            number |= (byte & 0x7F) << shift
+            if not byte & 0x80:
                 break
-        return stream.write(out)
 
-    @staticmethod
-    def size(value):
-        for max_value, size in VARINT_SIZE_TABLE.items():
-            if value < max_value:
-                return size
-        raise ValueError("Integer too large")
+            shift += 7
+            if shift >= limit:
+                raise ValueError("Tried to read too long of a %s" % cls.__name__)
+        return cls.signed(number), offset
+
+    @classmethod
+    def signed(cls, number):
+        number &= (1 << cls.bits) - 1
+        if number >> (cls.bits - 1):
+            number -= 1 << cls.bits
+        return number
+
+    @classmethod
+    def encode(cls, value):
+        if 0 <= value < 0x80:
+            return SINGLE_BYTE_TABLE[value]
+
+        if value < 0:
+            if value < -(1 << (cls.bits - 1)):
+                raise ValueError("Integer too small")
+            value &= (1 << cls.bits) - 1  # Negative numbers use all the bytes
+        elif value >> cls.bits:
+            raise ValueError("Integer too large")
+
+        out = bytearray()
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+        return bytes(out)
+
+    @classmethod
+    def write(cls, value, stream):
+        return stream.write(cls.encode(value))
+
+    @classmethod
+    def size(cls, value):
+        if value < 0:
+            return cls.max_bytes
+        if value >> cls.bits:
+            raise ValueError("Integer too large")
+        return VARNUM_SIZE_TABLE[value.bit_length()]
+
+
+class VarInt(VarNumber):
+    bits = 32
+    max_bytes = 5
+
 
+class VarLong(VarNumber):
+    bits = 64
+    max_bytes = 10
 
-# Maps (maximum integer value -> size of VarInt in bytes)
-VARINT_SIZE_TABLE = {
-    2 ** 7: 1,
-    2 ** 14: 2,
-    2 ** 21: 3,
-    2 ** 28: 4,
-    2 ** 35: 5,
-    2 ** 42: 6,
-    2 ** 49: 7,
-    2 ** 56: 8,
-    2 ** 63: 9,
-    2 ** 70: 10,
-    2 ** 77: 11,
-    2 ** 84: 12
-}
+
+# Values 0-127 encode to themselves
+SINGLE_BYTE_TABLE = tuple(bytes((value,)) for value in range(0x80))
+
+# Maps (bit length of a non-negative integer -> size of its encoding in bytes)
+VARNUM_SIZE_TABLE = tuple(max(1, (bit_length + 6) // 7) for bit_length in range(65))
 
 
 class Long(Type):
+    format = 'q'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>q', stream.read(8))[0]
@@ -161,6 +252,8 @@ class Long(Type):
 
 
 class UnsignedLong(Type):
+    format = 'Q'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>Q', stream.read(8))[0]
@@ -171,6 +264,8 @@ class UnsignedLong(Type):
 
 
 class Float(Type):
+    format = 'f'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>f', stream.read(4))[0]
@@ -181,6 +276,8 @@ class Float(Type):
 
 
 class Double(Type):
+    format = 'd'
+
     @staticmethod
     def read(stream):
         return struct.unpack('>d', stream.read(8))[0]
@@ -213,6 +310,10 @@ class ShortPrefixedByteArray(Type):
         length = Short.read(stream)
         return struct.unpack(str(length) + "s", stream.read(length))[0]
 
+    @staticmethod
+    def skip(stream):
+        stream.skip(Short.read(stream))
+
     @staticmethod
     def write(value, stream):
         return Short.write(len(value), stream) + stream.write(value)
@@ -224,6 +325,10 @@ class VarIntPrefixedByteArray(Type):
         length = VarInt.read(stream)
         return struct.unpack(str(length) + "s", stream.read(length))[0]
 
+    @staticmethod
+    def skip(stream):
+        stream.skip(VarInt.read(stream))
+
     @staticmethod
     def write(value, stream):
         return VarInt.write(len(value), stream) + stream.write(struct.pack(str(len(value)) + "s", value))
@@ -248,6 +353,10 @@ class String(Type):
         length = VarInt.read(stream)
         return stream.read(length).decode("utf-8")
 
+    @staticmethod
+    def skip(stream):
+        stream.skip(VarInt.read(stream))
+
     @staticmethod
     def write(value, stream):
         value = value.encode('utf-8')
@@ -1,16 +1,85 @@
+import socket
 import threading
+import time
 
-from multiprocessing import Queue
+from .packet_queue import PacketQueue
+
+
+# What to do with a frame that doesn't fit a full queue
+BLOCK = 'block'  # Queue it anyway, whoever produces the frames waits in pace() until the queue drains
+DROP = 'drop'  # Drop droppable frames, disconnect if the frame can't be dropped
+DISCONNECT = 'disconnect'  # Disconnect the socket that isn't keeping up
+POLICIES = (BLOCK, DROP, DISCONNECT)
+
+
+def batches(frames, max_batch_size):
+    """ Join frames into contiguous chunks of at most max_batch_size bytes
+        A single frame larger than that is its own chunk
+    """
+    chunk = []
+    size = 0
+    for frame in frames:
+        chunk.append(frame)
+        size += len(frame)
+        if size >= max_batch_size:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk[0] if len(chunk) == 1 else b''.join(chunk)
+
+
+def send_batches(sock, chunks):
+    """ sendall() every chunk, an encrypted socket encrypts the next one while the last is sent """
+    sendall_many = getattr(sock, 'sendall_many', None)
+    if sendall_many is not None:
+        sendall_many(chunks)
+        return
+    for chunk in chunks:
+        sock.sendall(chunk)
 
 
 class UpstreamThread(threading.Thread):
-    def __init__(self):
+    """ Writes queued frames to a socket, coalescing whatever is pending
+        into as few encrypt + sendall calls as possible
+
+        max_batch_size bounds how many bytes go out in one write
+        flush_latency is how long (in seconds) to keep collecting frames
+        before writing a batch that isn't full yet, 0 writes immediately
+
+        While paused frames are queued up but not written, so something else
+        (like the world replay) can write to the socket first
+
+        max_bytes bounds the bytes waiting to be written (0 is unbounded) and
+        `policy` says what happens to a frame that doesn't fit, see POLICIES
+        Frames queued while paused aren't bounded, after resuming that backlog is
+        allowed on top of max_bytes until it's written out
+    """
+    def __init__(self, max_batch_size=1 << 18, flush_latency=0.0, max_bytes=0, policy=BLOCK):
         threading.Thread.__init__(self, daemon=True)
-        self.queue = Queue()
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy %s" % policy)
+
+        self.max_batch_size = max_batch_size
+        self.flush_latency = flush_latency
+        self.policy = policy
+        self.queue = PacketQueue(max_bytes, len)
         self.socket = None
         self.socket_lock = threading.RLock()
         self.running = True
 
+        # Frames (and their bytes) that were never written, and how often the queue overflowed
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.overflows = 0
+
+        # Bytes allowed over max_bytes, None while paused
+        self.allowance = 0
+        self.allowance_lock = threading.Lock()
+
+        self.unpaused = threading.Event()
+        self.unpaused.set()
+
     def set_socket(self, socket):
         self.clear()
         with self.socket_lock:
@@ -20,26 +89,115 @@ class UpstreamThread(threading.Thread):
         with self.socket_lock:
             return self.socket is not None
 
-    def put(self, b):
-        self.queue.put(b)
+    def depth(self):
+        """ Bytes waiting to be written """
+        return self.queue.nbytes
+
+    def generation(self):
+        """ Pass this to put() to drop the frame if the queue is cleared in the meantime """
+        return self.queue.generation
+
+    def put(self, b, droppable=False, generation=None):
+        """ Queue a frame, returns False if it was dropped because the queue is full
+            or because it was cleared since `generation`
+        """
+        allowance = self.allowance
+        if allowance is None or self.policy == BLOCK or self.queue.has_room(len(b) - allowance):
+            return self.queue.put(b, generation)
+
+        if self.policy == DROP and droppable:
+            self.drop(b)
+            return False
+
+        self.overflows += 1
+        print("Upstream queue is full (%s bytes), disconnecting" % self.queue.nbytes, flush=True)
+        self.disconnect()
+        self.drop(b)
+        return False
+
+    def pace(self):
+        """ With the block policy wait while more than max_bytes is queued
+            Call this where the frames come from (e.g before reading the next packet), never while
+            holding a lock or on a thread that has to keep answering the server
+        """
+        if self.policy != BLOCK or not self.queue.max_bytes:
+            return
+        while self.running:
+            allowance = self.allowance
+            # The backlog of a paused upstream is written once it resumes, don't wait on it
+            if allowance is None or self.queue.wait_for_room(-allowance, 1.0):
+                return
+
+    def drop(self, b):
+        self.dropped += 1
+        self.dropped_bytes += len(b)
+
+    def disconnect(self):
+        """ Shut the socket down, whoever reads from it sees the disconnect and cleans up
+            The writer can be stuck in sendall holding the socket lock, shutting down unblocks it
+        """
+        sock = self.socket
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.clear()
 
     def clear(self):
-        while not self.queue.empty():
-            self.queue.get()
+        count, size = self.queue.clear()
+        self.dropped += count
+        self.dropped_bytes += size
+
+    def pause(self):
+        with self.allowance_lock:
+            self.allowance = None
+        self.unpaused.clear()
+
+    def resume(self):
+        with self.allowance_lock:
+            self.allowance = self.queue.nbytes
+        self.unpaused.set()
 
     def stop(self):
         self.set_socket(None)
         self.running = False
+        self.queue.close()
+        self.resume()
+
+    def collect(self):
+        """ Wait for frames and return a batch of them, possibly empty """
+        batch = self.queue.get_batch()
+        if batch and self.flush_latency > 0:
+            size = sum(len(pkt) for pkt in batch)
+            deadline = time.monotonic() + self.flush_latency
+            while size < self.max_batch_size and self.running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                more = self.queue.get_batch(remaining)
+                batch.extend(more)
+                size += sum(len(pkt) for pkt in more)
+        return batch
+
+    def write(self, batch):
+        """ Write frames as contiguous chunks of at most max_batch_size bytes """
+        send_batches(self.socket, batches(batch, self.max_batch_size))
 
     def run(self):
         while self.running:
-            if not self.queue.empty():
+            # Blocks until there is something to send or we're stopped
+            batch = self.collect()
+            if batch:
+                self.unpaused.wait()
                 # Acquire the lock since socket can be None when set in another thread
                 with self.socket_lock:
                     if self.socket:
-                        while not self.queue.empty():
-                            pkt = self.queue.get()
-                            try:
-                                self.socket.send(pkt)
-                            except Exception as _:
-                                pass # Keep on throwing exceptions until we get a new socket
+                        try:
+                            self.write(batch)
+                        except Exception as _:
+                            pass # Keep on throwing exceptions until we get a new socket
+
+                with self.allowance_lock:
+                    if self.allowance:
+                        self.allowance = max(0, self.allowance - sum(len(b) for b in batch))
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Done:
+    """ The result of work that was done inline, looks like a finished Future """
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class WorkerPool:
+    """ A few threads for bulk zlib and AES work
+
+        zlib and the cryptography AES backend release the GIL on large buffers, so inflating
+        cached chunks or encrypting a batch on a worker overlaps with parsing and socket writes
+        on the connection's own threads instead of stacking up behind them.
+
+        Only buffers of at least min_size bytes are handed off, for anything smaller the hop
+        costs more than it saves. Without workers (size 0) everything runs inline.
+
+        The AES stream ciphers are stateful so one connection's data must be encrypted in order,
+        pipeline() keeps that order while the caller sends one result as the next is worked out.
+    """
+    def __init__(self, size=0, min_size=1 << 15):
+        self.size = 0
+        self.min_size = min_size
+        self.executor = None
+        self.lock = threading.Lock()
+        self.configure(size)
+
+    def configure(self, size=None, min_size=None):
+        with self.lock:
+            if min_size is not None:
+                self.min_size = min_size
+            if size is not None and size != self.size:
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                self.size = size
+                self.executor = ThreadPoolExecutor(size, thread_name_prefix='mcidle-worker') if size > 0 else None
+
+    def offloads(self, data):
+        return self.executor is not None and len(data) >= self.min_size
+
+    def submit(self, fn, data):
+        """ fn(data) on a worker if data is large enough, returns something with a result() """
+        executor = self.executor
+        if executor is not None and len(data) >= self.min_size:
+            return executor.submit(fn, data)
+        return Done(fn(data))
+
+    def map(self, fn, items):
+        """ [fn(item) for item in items], with the large items worked on in parallel """
+        return [future.result() for future in [self.submit(fn, item) for item in items]]
+
+    def pipeline(self, fn, items):
+        """ Yield fn(item) for every item in order, calling fn one item at a time
+            The next item is worked on while the caller uses the current result
+        """
+        pending = None
+        for item in items:
+            if pending is not None:
+                result = pending.result()
+                pending = self.submit(fn, item)
+                yield result
+            else:
+                pending = self.submit(fn, item)
+        if pending is not None:
+            yield pending.result()
+
+    async def run(self, fn, data):
+        """ fn(data) without blocking the event loop if data is large enough """
+        executor = self.executor
+        if executor is None or len(data) < self.min_size:
+            return fn(data)
+        return await asyncio.get_event_loop().run_in_executor(executor, fn, data)
+
+    def shutdown(self):
+        self.configure(0)
+
+
+# Shared by every session in the process
+workers = WorkerPool()
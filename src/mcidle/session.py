@@ -0,0 +1,281 @@
+import json
+import threading
+import time
+
+from mcidle.networking.auth import Auth
+from mcidle.networking.auth.auth import CREDENTIALS_FILENAME, request_counts
+from mcidle.networking.encryption import keypool
+from mcidle.networking.workers import workers
+
+
+class Account:
+    """ Everything needed to keep one account idling: its login, its target server and local port """
+    def __init__(self, ip, port=25565, dport=1337, protocol=340, username=None, password=None, \
+                 credentials=CREDENTIALS_FILENAME, bindip='', reconnect=10):
+        if ip is None:
+            raise RuntimeError("Please specify an ip address!")
+
+        self.ip = ip
+        self.port = port
+        self.dport = dport
+        self.protocol = protocol
+        self.username = username
+        self.password = password
+        self.credentials = credentials
+        self.bindip = bindip
+        self.reconnect = reconnect
+
+    @property
+    def name(self):
+        return "%s@%s:%s" % (self.username or self.credentials, self.ip, self.dport)
+
+    @staticmethod
+    def load(filename):
+        """ Read a list of accounts from a JSON file, for example
+            [{"ip": "2b2t.org", "dport": 1337, "username": "a@example.com", "password": "pw"}, ...]
+            Accounts without a "credentials" file get their own, named after their local port
+        """
+        with open(filename, 'r') as infile:
+            entries = json.load(infile)
+
+        accounts = []
+        for entry in entries:
+            entry = dict(entry)
+            entry.setdefault('credentials', './credentials_%s.json' % entry.get('dport', 1337))
+            accounts.append(Account(**entry))
+
+        dports = [(account.bindip, account.dport) for account in accounts]
+        if len(set(dports)) != len(dports):
+            raise ValueError("Every account needs its own local port (dport)")
+        return accounts
+
+
+class SessionStatus:
+    """ What one account's session is doing right now, read by whoever reports on it """
+    def __init__(self, account):
+        self.name = account.name
+        self.state = 'starting'
+        self.connection = None
+        self.reconnects = 0
+
+    def set_connection(self, connection):
+        self.connection = connection
+        self.state = 'connected' if connection else 'reconnecting'
+
+    def snapshot(self):
+        connection = self.connection
+        snapshot = {
+            'name': self.name,
+            'state': self.state,
+            'connected': connection is not None,
+            'client_attached': connection is not None and connection.client_attached(),
+            'chunks': len(connection.game_state.chunks) if connection else 0,
+            'chunk_bytes': connection.game_state.chunks.memory() if connection else 0,
+            'entities': len(connection.game_state.entities) if connection else 0,
+            'entity_bytes': connection.game_state.entities.memory() if connection else 0,
+            'keep_alive_age': None,
+            'reconnects': self.reconnects,
+            'client_queue': 0,
+            'server_queue': 0,
+            'dropped': 0,
+            'dropped_bytes': 0,
+            'queue_overflows': 0,
+        }
+        if connection:
+            snapshot.update(connection.queue_stats())
+            snapshot['metrics'] = connection.metrics.snapshot()
+            last_keep_alive = connection.game_state.last_keep_alive
+            if last_keep_alive is not None:
+                snapshot['keep_alive_age'] = time.monotonic() - last_keep_alive
+        return snapshot
+
+
+def process_stats():
+    """ Counters shared by every session in this process """
+    return {'auth_requests': dict(request_counts)}
+
+
+def update_credentials(account):
+    if not Auth.has_credentials(account.credentials):
+        if account.username is None or account.password is None:
+            raise ValueError("Please provide both your username and password.")
+
+        auth = Auth()
+        Auth.save_to_disk(auth.authenticate(username=account.username, password=account.password), \
+                          account.credentials)
+
+
+def try_auth(account):
+    try:
+        credentials = Auth.read_from_disk(account.credentials)
+    except FileNotFoundError:
+        print("Credentials not found..", flush=True)
+        try:
+            update_credentials(account)
+            credentials = Auth.read_from_disk(account.credentials)
+        except Exception as e:
+            return None
+
+    auth = Auth().assign_profile(credentials)
+
+    if not auth.validate():
+        Auth.delete_credentials(account.credentials)
+        return None # Invalid credentials
+    else:
+        print("Credentials are valid!", flush=True)
+    return credentials
+
+
+class SessionThread(threading.Thread):
+    """ Keeps one account connected with the threaded engine, reconnecting on its own timer
+
+        We loop because the session information may be invalidated at any point
+        Due to restarting the Minecraft client over and over
+        So when we reconnect we need to generate potentially new credentials to avoid session errors
+    """
+    def __init__(self, account, listen_port, status=None, **connection_options):
+        threading.Thread.__init__(self, daemon=True)
+        self.account = account
+        self.listen_port = listen_port
+        self.status = status or SessionStatus(account)
+        self.connection_options = connection_options
+        self.running = True
+
+    def run(self):
+        from mcidle.networking.connection import MinecraftConnection
+
+        account = self.account
+        status = self.status
+        while self.running:
+            status.state = 'auth'
+            print("[%s] Trying to auth.." % account.name, flush=True)
+            credentials = None
+            try:
+                credentials = try_auth(account)  # Make sure we can still auth
+            except:
+                print("[%s] Invalid password or blocked from auth server for reconnecting too fast.." \
+                      % account.name, flush=True)
+
+            print("[%s] Finished auth" % account.name, flush=True)
+            if credentials:
+                print("[%s] Starting.." % account.name, flush=True)
+                self.listen_port.set_server(None)
+                conn = MinecraftConnection(ip=account.ip, port=account.port, server_port=account.dport, \
+                                           protocol=account.protocol, username=credentials['selectedProfile']['name'], \
+                                           profile=credentials, listen_thread=self.listen_port, \
+                                           **self.connection_options)
+                status.set_connection(conn)
+                conn.run_handler()
+                conn.stop()
+                conn.game_state.close()
+                status.set_connection(None)
+                status.reconnects += 1
+                print("[%s] Disconnected..reconnecting in %s seconds" % (account.name, account.reconnect), flush=True)
+                time.sleep(account.reconnect)
+                print("[%s] Reconnecting.." % account.name, flush=True)
+            else:
+                if not account.username or not account.password:
+                    print("[%s] Can't re-auth user because no user or password provided!" % account.name, flush=True)
+                    status.state = 'stopped'
+                    return
+                print("[%s] Username or password wrong, waiting 15 seconds before reconnecting.." % account.name, \
+                      flush=True)
+                time.sleep(15)
+
+
+# The connection options the asyncio engine understands, the rest tune the threaded engine's sockets
+ASYNC_OPTIONS = ('chunk_budget', 'chunk_radius', 'spill_dir', 'client_queue_limit', 'client_queue_policy', \
+                 'server_queue_limit', 'server_queue_policy', 'compression_level', 'client_compression_level', \
+                 'loopback_uncompressed', 'max_batch_size')
+
+
+async def run_session_async(account, status=None, **connection_options):
+    """ Keeps one account connected with the asyncio engine, reconnecting on its own timer """
+    import asyncio
+    from mcidle.networking.aio import AsyncListener, AsyncMinecraftConnection
+
+    loop = asyncio.get_event_loop()
+
+    # We use this to listen for incoming connections
+    listener = AsyncListener(address=(account.bindip, account.dport))
+    await listener.start()
+
+    status = status or SessionStatus(account)
+    while True:
+        status.state = 'auth'
+        print("[%s] Trying to auth.." % account.name, flush=True)
+        credentials = None
+        try:
+            # Make sure we can still auth, the auth server is slow so don't block the loop
+            credentials = await loop.run_in_executor(None, try_auth, account)
+        except:
+            print("[%s] Invalid password or blocked from auth server for reconnecting too fast.." \
+                  % account.name, flush=True)
+
+        print("[%s] Finished auth" % account.name, flush=True)
+        if credentials:
+            print("[%s] Starting.." % account.name, flush=True)
+            conn = AsyncMinecraftConnection(ip=account.ip, port=account.port, protocol=account.protocol, \
+                                            username=credentials['selectedProfile']['name'], profile=credentials, \
+                                            listener=listener, **connection_options)
+            status.set_connection(conn)
+            await conn.run()
+            status.set_connection(None)
+            status.reconnects += 1
+            print("[%s] Disconnected..reconnecting in %s seconds" % (account.name, account.reconnect), flush=True)
+            await asyncio.sleep(account.reconnect)
+            print("[%s] Reconnecting.." % account.name, flush=True)
+        else:
+            if not account.username or not account.password:
+                print("[%s] Can't re-auth user because no user or password provided!" % account.name, flush=True)
+                status.state = 'stopped'
+                listener.close()
+                return
+            print("[%s] Username or password wrong, waiting 15 seconds before reconnecting.." % account.name, \
+                  flush=True)
+            await asyncio.sleep(15)
+
+
+def run_accounts(accounts, engine='threaded', statuses=None, key_rotation=0, worker_threads=0, metrics_address=None, \
+                 **connection_options):
+    """ Idle every account from this one process until they all give up
+        statuses, if given, holds one SessionStatus per account (in the same order) to report through
+        key_rotation is how many local client logins share an RSA keypair, 0 keeps one for good
+        worker_threads is how many threads inflate chunks and encrypt batches, 0 does it inline
+        metrics_address, an (ip, port), serves the sessions' metrics for Prometheus to scrape
+    """
+    # Have a keypair ready before the first client shows up
+    keypool.configure(max_uses=key_rotation)
+    keypool.warm()
+
+    workers.configure(worker_threads)
+
+    if statuses is None:
+        statuses = [SessionStatus(account) for account in accounts]
+
+    if metrics_address:
+        from mcidle.exporter import MetricsServer, render
+        MetricsServer(metrics_address, lambda: render([status.snapshot() for status in statuses], \
+                                                      process_stats()['auth_requests'])).start()
+
+    if engine == 'asyncio':
+        import asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        options = {key: value for key, value in connection_options.items() if key in ASYNC_OPTIONS}
+        loop.run_until_complete(asyncio.gather(*[run_session_async(account, status, **options) \
+                                                 for account, status in zip(accounts, statuses)]))
+        return
+
+    from mcidle.networking.listen_thread import ListenThread
+
+    # A single thread accepts clients for every account's local port
+    listen_thread = ListenThread()
+    sessions = [SessionThread(account, listen_thread.listen((account.bindip, account.dport)), status, \
+                              **connection_options) for account, status in zip(accounts, statuses)]
+    listen_thread.start()
+
+    for session in sessions:
+        session.start()
+    for session in sessions:
+        session.join()
@@ -0,0 +1,178 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from mcidle.session import SessionStatus, run_accounts, process_stats
+
+
+def shard_of(account, shards):
+    """ The shard an account always runs on, it only depends on the account's local port
+        so the same account lands on the same process across restarts and reordered account files
+        Local ports are usually consecutive which spreads them evenly
+    """
+    return account.dport % shards
+
+
+def report_status(index, statuses, reports, rate):
+    """ Periodically send the parent a snapshot of every session in this shard """
+    pid = os.getpid()
+    while True:
+        reports.put((index, pid, [status.snapshot() for status in statuses], process_stats()))
+        time.sleep(rate)
+
+
+def run_shard(index, accounts, engine, reports, report_rate, connection_options):
+    """ Entry point of a shard process, idles its accounts exactly like a single mcidle process would """
+    statuses = [SessionStatus(account) for account in accounts]
+    threading.Thread(target=report_status, args=(index, statuses, reports, report_rate), daemon=True).start()
+    run_accounts(accounts, engine, statuses=statuses, **connection_options)
+
+
+class Supervisor:
+    """ Spreads accounts over several processes so zlib and AES work isn't serialized by one GIL
+
+        Every account is pinned to a shard by shard_of(), a shard that dies is restarted
+        with the same accounts (and so the same local ports) after restart_delay seconds
+        Shards report their sessions back here where they are aggregated into one status line
+    """
+    def __init__(self, accounts, shards, engine='threaded', report_rate=10, restart_delay=5, metrics_address=None, \
+                 **connection_options):
+        if shards < 1:
+            raise ValueError("Need at least one shard")
+
+        self.engine = engine
+        self.report_rate = report_rate
+        self.restart_delay = restart_delay
+        self.connection_options = connection_options
+        self.metrics_address = metrics_address
+
+        self.assignments = {}
+        for account in accounts:
+            self.assignments.setdefault(shard_of(account, shards), []).append(account)
+
+        self.reports = multiprocessing.Queue()
+        self.processes = {}
+        self.died_at = {}
+        self.restarts = {index: 0 for index in self.assignments}
+
+        # Latest snapshot of every session, keyed by account name
+        self.sessions = {}
+        # Latest process_stats() of every shard
+        self.shard_stats = {}
+
+    def start_shard(self, index):
+        accounts = self.assignments[index]
+        process = multiprocessing.Process(target=run_shard, name="mcidle-shard-%s" % index, daemon=True, \
+                                          args=(index, accounts, self.engine, self.reports, self.report_rate, \
+                                                self.connection_options))
+        process.start()
+        self.processes[index] = process
+        print("[supervisor] Started shard %s (pid %s) with %s account(s) on port(s) %s" \
+              % (index, process.pid, len(accounts), ", ".join(str(account.dport) for account in accounts)), flush=True)
+
+    def check_shards(self):
+        """ Restart shards that crashed, shards that exit cleanly have no accounts left to idle """
+        now = time.time()
+        for index, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+
+            if process.exitcode == 0:
+                print("[supervisor] Shard %s finished" % index, flush=True)
+                del self.processes[index]
+                continue
+
+            if index not in self.died_at:
+                print("[supervisor] Shard %s died with exit code %s, restarting in %s seconds" \
+                      % (index, process.exitcode, self.restart_delay), flush=True)
+                self.died_at[index] = now
+                for account in self.assignments[index]:
+                    self.sessions.pop(account.name, None)
+            elif now - self.died_at[index] >= self.restart_delay:
+                del self.died_at[index]
+                self.restarts[index] += 1
+                self.start_shard(index)
+
+    def collect_reports(self, timeout):
+        """ Drain the shard reports for up to timeout seconds """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                index, pid, snapshots, stats = self.reports.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                return
+
+            self.shard_stats[index] = stats
+            for snapshot in snapshots:
+                snapshot['shard'] = index
+                snapshot['pid'] = pid
+                self.sessions[snapshot['name']] = snapshot
+
+    def status(self):
+        """ Aggregated status of every shard and session """
+        sessions = list(self.sessions.values())
+        return {
+            'shards': len(self.processes),
+            'shard_restarts': sum(self.restarts.values()),
+            'accounts': sum(len(accounts) for accounts in self.assignments.values()),
+            'connected': sum(1 for session in sessions if session['connected']),
+            'clients_attached': sum(1 for session in sessions if session['client_attached']),
+            'reconnects': sum(session['reconnects'] for session in sessions),
+            'chunks': sum(session['chunks'] for session in sessions),
+            'chunk_mb': sum(session['chunk_bytes'] for session in sessions) / float(1 << 20),
+            'queued_mb': sum(session['client_queue'] + session['server_queue'] for session in sessions) / float(1 << 20),
+            'dropped': sum(session['dropped'] for session in sessions),
+        }
+
+    def render_metrics(self):
+        """ Every shard's sessions in the Prometheus text format, plus the supervisor's own counts
+            Sessions are as of their shard's last report
+        """
+        from mcidle.exporter import render
+
+        auth_requests = {}
+        for stats in list(self.shard_stats.values()):
+            for endpoint, count in stats['auth_requests'].items():
+                auth_requests[endpoint] = auth_requests.get(endpoint, 0) + count
+
+        status = self.status()
+        return render(list(self.sessions.values()), auth_requests, [
+            ('mcidle_shards', 'gauge', 'Shard processes running', status['shards']),
+            ('mcidle_shard_restarts_total', 'counter', 'Times a shard process was restarted', status['shard_restarts']),
+        ])
+
+    def print_status(self):
+        print("[supervisor] %(connected)s/%(accounts)s accounts connected, %(clients_attached)s client(s) attached, "
+              "%(reconnects)s reconnect(s), %(chunks)s chunk(s) in %(chunk_mb).1f MB, " \
+              "%(queued_mb).1f MB queued, %(dropped)s packet(s) dropped, " \
+              "%(shards)s shard(s) running, %(shard_restarts)s shard restart(s)" \
+              % self.status(), flush=True)
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes.values():
+            process.join()
+
+    def run(self):
+        if self.metrics_address:
+            from mcidle.exporter import MetricsServer
+            MetricsServer(self.metrics_address, self.render_metrics).start()
+
+        for index in sorted(self.assignments):
+            self.start_shard(index)
+
+        last_print = time.time()
+        try:
+            while self.processes:
+                self.collect_reports(1.0)
+                self.check_shards()
+
+                if time.time() - last_print >= self.report_rate:
+                    self.print_status()
+                    last_print = time.time()
+        finally:
+            self.stop()
@@ -0,0 +1,90 @@
+from zlib import decompress
+
+from mcidle.networking.chunk_store import ChunkStore, nearest_first
+
+
+class Frame:
+    """ Just what ChunkStore.add needs of a RawPacket """
+    def __init__(self, frame, data_length=1):
+        self.frame = frame
+        self.data_length = data_length
+
+
+def frame(key, size=100):
+    # Already compressed by the server so it's stored as-is
+    return Frame(bytes([key[0] & 0xFF, key[1] & 0xFF]) * (size // 2))
+
+
+def test_nearest_first():
+    keys = [(2, 0), (0, 0), (1, 1), (-1, 0), (0, 2), (2, 2), (1, 0)]
+    # Chebyshev rings, each from its middle out
+    assert nearest_first(keys, (0, 0)) == [(0, 0), (-1, 0), (1, 0), (1, 1), (2, 0), (0, 2), (2, 2)]
+    assert nearest_first(keys, None) == keys
+
+
+def test_budget_evicts_farthest_down_to_low_water():
+    store = ChunkStore(budget=1000, low_water=0.5)
+    store.set_center(0, 0)
+    keys = [(x, 0) for x in range(10)]
+    for key in keys:
+        store.add(key, frame(key))
+    assert len(store) == 10 and store.evicted == 0
+
+    # One over the budget drops enough of the farthest to get down to half of it
+    store.add((-1, 0), frame((-1, 0)))
+    assert store.nbytes == 500 == store.memory()
+    assert sorted(store.keys()) == [(-1, 0), (0, 0), (1, 0), (2, 0), (3, 0)]
+    assert store.evicted == 6
+
+    # So the next chunks don't evict anything
+    store.add((0, 1), frame((0, 1)))
+    assert store.evicted == 6
+
+
+def test_budget_keeps_the_last_chunk():
+    store = ChunkStore(budget=10)
+    store.add((0, 0), frame((0, 0), 100))
+    assert len(store) == 1
+    store.add((5, 5), frame((5, 5), 100))
+    assert len(store) == 1 and store.evicted == 1
+
+
+def test_radius_on_move():
+    store = ChunkStore(radius=1)
+    for key in [(0, 0), (1, 1), (2, 0), (-2, -2)]:
+        store.add(key, frame(key))
+    # Without a budget nothing is dropped until the player moves
+    assert len(store) == 4
+
+    store.set_center(8, 8)  # Still chunk 0, 0
+    assert sorted(store.keys()) == [(0, 0), (1, 1)]
+    store.set_center(16 * 2, 0)
+    assert sorted(store.keys()) == [(1, 1)]
+
+
+def test_radius_before_budget():
+    store = ChunkStore(budget=350, radius=1, low_water=1)
+    store.set_center(0, 0)
+    for key in [(0, 0), (1, 0), (5, 5)]:
+        store.add(key, frame(key))
+    # Beyond the radius goes first, that's enough to get under budget
+    store.add((0, 1), frame((0, 1)))
+    assert sorted(store.keys()) == [(0, 0), (0, 1), (1, 0)]
+
+
+def test_uncompressed_chunks_are_packed():
+    store = ChunkStore()
+    data = b'\0' * 4096
+    store.add((0, 0), Frame(data, 0))
+    assert store.memory() < len(data)
+    assert decompress(store.storage[(0, 0)]) == data
+    assert store.frame((0, 0)) == data
+
+
+def test_frames_nearest_first():
+    store = ChunkStore()
+    store.add((3, 3), Frame(b'\0' * 4096, 0))
+    store.add((0, 0), frame((0, 0)))
+    store.add((1, 0), frame((1, 0)))
+    store.set_center(0, 0)
+    assert store.frames() == [frame((0, 0)).frame, frame((1, 0)).frame, b'\0' * 4096]
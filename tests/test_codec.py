@@ -0,0 +1,184 @@
+from mcidle.networking.packet_handler.packet_stream_reader import PacketStreamReader
+from mcidle.networking.packets.clientbound import ChunkData, JoinGame, PlayerListItem
+from mcidle.networking.packets.codec import PacketCodec
+from mcidle.networking.packets.packet import Packet
+from mcidle.networking.packets.packet_buffer import PacketBuffer
+from mcidle.networking.types import Boolean, Byte, Double, Float, Integer, Long, String, TrailingByteArray, UUID, \
+    VarInt
+
+
+class Sample(Packet):
+    id = 0x7F
+    definition = {
+        "Name": String,
+        "Count": VarInt,
+        "Motd": String,
+        "X": Double,
+        "Y": Double,
+        "Z": Double,
+        "Yaw": Float,
+        "Pitch": Float,
+        "OnGround": Boolean,
+        "Tail": String,
+    }
+
+
+class Chunk(Packet):
+    id = 0x20
+    definition = {
+        "ChunkX": Integer,
+        "ChunkZ": Integer,
+        "Data": TrailingByteArray,
+    }
+    required = ("ChunkX", "ChunkZ")
+
+
+SAMPLE = dict(Name='Notch', Count=300, Motd='§aHello world ' * 20, X=1.5, Y=-64.25, Z=1e9, Yaw=90.0, \
+              Pitch=-45.0, OnGround=True, Tail='end')
+
+
+def body(packet):
+    """ The fields of a packet as they're written on the wire, without the packet ID """
+    packet_buffer = PacketBuffer()
+    packet.codec.write(packet, packet_buffer)
+    return packet_buffer.bytes
+
+
+def read(codec, data):
+    packet = Sample()
+    stream = PacketBuffer(data)
+    codec.read_required(packet, stream)
+    return packet, stream
+
+
+def test_full_codec_round_trip():
+    packet = Sample()
+    stream = PacketBuffer(body(Sample(**SAMPLE)))
+    Sample.codec.read(packet, stream)
+    for name, value in SAMPLE.items():
+        assert getattr(packet, name) == value
+    assert stream.read() == b''
+
+
+def test_skipped_strings():
+    codec = PacketCodec.compile(Sample.definition, ("Count", "X"))
+    packet, stream = read(codec, body(Sample(**SAMPLE)))
+
+    assert (packet.Count, packet.X) == (300, 1.5)
+    # The strings around Count are skipped, not decoded
+    assert not hasattr(packet, 'Name') and not hasattr(packet, 'Motd')
+    # Reading stops after the last required field
+    assert stream.read() == body(Sample(**SAMPLE))[-(8 + 8 + 4 + 4 + 1 + 4):]
+
+
+def test_fixed_width_run_with_padding():
+    codec = PacketCodec.compile(Sample.definition, ("Y", "Pitch"))
+
+    # The run from X to Pitch is one struct, the skipped fields are padding
+    compiled, names, _ = codec.read_steps[-1]
+    assert compiled.format in ('>8xd8x4xf', b'>8xd8x4xf')
+    assert names == ('Y', 'Pitch')
+
+    packet, stream = read(codec, body(Sample(**SAMPLE)))
+    assert (packet.Y, packet.Pitch) == (-64.25, -45.0)
+    assert not hasattr(packet, 'X') and not hasattr(packet, 'Yaw')
+    assert stream.read() == body(Sample(**SAMPLE))[-(1 + 4):]
+
+
+def test_head_size():
+    # Only known when every field up to the last required one has a fixed width
+    assert PacketCodec.compile(Sample.definition, ("Y",)).head_size is None
+    assert Chunk.codec.head_size == 8
+    assert PacketCodec.compile({"A": Byte, "B": Long, "C": String}, ("B",)).head_size == 9
+    # Without required fields everything is read
+    assert Sample.codec.head_size is None
+
+
+def test_head_size_on_compressed_frame():
+    data = bytes(range(256)) * 64
+    frame = Chunk(ChunkX=-3, ChunkZ=1 << 20, Data=data).write(256).bytes
+
+    stream = PacketStreamReader()
+    stream.feed(frame)
+    raw = stream.next_packet(256)
+    assert raw.data_length == 1 + 8 + len(data)
+
+    head = raw.head(VarInt.size(Chunk.id) + Chunk.codec.head_size)
+    assert len(head) == 1 + 8
+
+    chunk = Chunk.decode(raw)
+    assert (chunk.ChunkX, chunk.ChunkZ) == (-3, 1 << 20)
+    # Only the head was inflated
+    assert raw.packet_buffer_ is None
+
+    assert ChunkData.decode(raw).ChunkZ == 1 << 20
+    assert raw.packet_buffer.bytes[9:] == data
+
+    # read() still decodes every field
+    assert Chunk().read(raw.packet_buffer).Data == data
+
+
+def test_read_decodes_every_field():
+    join_game = JoinGame(EntityID=7, Gamemode=1, Dimension=-1, Difficulty=2, MaxPlayers=20, LevelType='default', \
+                         Debug=False)
+    stream = PacketStreamReader()
+    stream.feed(join_game.write().bytes)
+    raw = stream.next_packet()
+
+    decoded = JoinGame.decode(raw)
+    assert decoded.Gamemode == 1 and not hasattr(decoded, 'Dimension')
+
+    packet = JoinGame().read(raw.packet_buffer)
+    for name in JoinGame.definition:
+        assert getattr(packet, name) == getattr(join_game, name)
+
+
+def test_type_skip():
+    stream = PacketBuffer()
+    String.write('skipped', stream)
+    Double.write(2.0, stream)
+    Boolean.write(False, stream)
+    VarInt.write(-1, stream)
+    Integer.write(7, stream)
+
+    stream = PacketBuffer(stream.bytes)
+    String.skip(stream)
+    Double.skip(stream)
+    Boolean.skip(stream)
+    VarInt.skip(stream)
+    assert Integer.read(stream) == 7
+
+
+def add_player(uuid, name, gamemode, ping, display_name=None):
+    stream = PacketBuffer()
+    VarInt.write(PlayerListItem.id, stream)
+    VarInt.write(0, stream)  # Add Player
+    VarInt.write(1, stream)
+    UUID.write(uuid, stream)
+    String.write(name, stream)
+    VarInt.write(1, stream)  # One property, signed
+    String.write('textures', stream)
+    String.write('e30=', stream)
+    Boolean.write(True, stream)
+    String.write('signature', stream)
+    VarInt.write(gamemode, stream)
+    VarInt.write(ping, stream)
+    Boolean.write(display_name is not None, stream)
+    if display_name is not None:
+        String.write(display_name, stream)
+    return PacketBuffer(stream.bytes)
+
+
+def test_player_list_entry_fields():
+    uuid = '069a79f4-44e9-4726-a5be-fca90e38aaf5'
+    # What decode() reads
+    packet = PlayerListItem().read(add_player(uuid, 'Notch', 1, 25, 'The Notch'), True)
+    assert packet.Players == [[uuid, (None, None, 1, None, None)]]
+    # Sub-entry fields aren't packet fields, the packet has no codec to skip with
+    assert PlayerListItem.required is None and PlayerListItem.codec is None
+
+
+def test_player_list_all_entry_fields():
+    uuid = '069a79f4-44e9-4726-a5be-fca90e38aaf5'
+    packet = PlayerListItem().read(add_player(uuid, 'Notch', 1, 25, 'The Notch'))
+    assert packet.Players == [[uuid, ('Notch', [('textures', 'e30=', 'signature')], 1, 25, 'The Notch')]]
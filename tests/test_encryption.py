@@ -0,0 +1,104 @@
+import io
+import socket
+import threading
+
+from mcidle.networking.encryption import create_AES_cipher, EncryptedFileObjectWrapper, EncryptedSocketWrapper
+
+SECRET = bytes(range(16))
+DATA = bytes(range(256)) * 40
+
+
+def encrypt(data):
+    return create_AES_cipher(SECRET).encryptor().update(data)
+
+
+class Stream(io.RawIOBase):
+    """ A raw stream that counts the reads off it """
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+        self.reads = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        self.reads += 1
+        return self.data.readinto(b)
+
+
+def wrapper(data, read_size=1 << 16):
+    stream = Stream(encrypt(data))
+    return stream, EncryptedFileObjectWrapper(stream, create_AES_cipher(SECRET).decryptor(), read_size)
+
+
+def test_small_reads_are_served_from_the_buffer():
+    stream, wrapped = wrapper(DATA)
+    assert wrapped.read(1) == DATA[:1]
+    # The whole stream was decrypted ahead in one read
+    assert stream.reads == 1 and wrapped.available() == len(DATA) - 1
+
+    assert wrapped.peek(2) == DATA[1:3]
+    assert wrapped.read(2) == DATA[1:3]
+    buf = bytearray(100)
+    assert wrapped.readinto(buf) == 100 and bytes(buf) == DATA[3:103]
+    assert stream.reads == 1
+
+    assert wrapped.read(len(DATA)) == DATA[103:]
+    assert wrapped.read(1) == b'' and wrapped.peek() == b''
+
+
+def test_reads_stop_at_the_buffer():
+    stream, wrapped = wrapper(DATA, read_size=100)
+    # Like a raw stream, at most one read off the stream for each call
+    assert wrapped.read(150) == DATA[:100]
+    assert wrapped.read(150) == DATA[100:200]
+    assert stream.reads == 2
+
+
+def test_large_readinto_decrypts_in_place():
+    stream, wrapped = wrapper(DATA, read_size=64)
+    assert wrapped.read(10) == DATA[:10]
+
+    # What's buffered is handed out first
+    buf = bytearray(256)
+    assert wrapped.readinto(buf) == 54 and bytes(buf[:54]) == DATA[10:64]
+    # Then the caller's buffer is read into and decrypted directly
+    assert wrapped.readinto(buf) == 256 and bytes(buf) == DATA[64:320]
+    assert wrapped.available() == 0 and stream.reads == 2
+
+    # The cipher stream carries on across both paths
+    rest = bytearray()
+    while True:
+        data = wrapped.read(1000)
+        if not data:
+            break
+        rest += data
+    assert bytes(rest) == DATA[320:]
+
+
+def test_sendall_many_round_trip():
+    a, b = socket.socketpair()
+    try:
+        cipher = create_AES_cipher(SECRET)
+        wrapped = EncryptedSocketWrapper(a, cipher.encryptor(), cipher.decryptor())
+        chunks = [DATA[i:i + 1000] for i in range(0, len(DATA), 1000)]
+
+        received = bytearray()
+
+        def receive():
+            while len(received) < 7 + len(DATA):
+                data = b.recv(1 << 16)
+                if not data:
+                    return
+                received.extend(data)
+        reader = threading.Thread(target=receive, daemon=True)
+        reader.start()
+
+        # The chunks are encrypted in order on the pool, continuing the cipher stream of sendall()
+        wrapped.sendall(b'prefix!')
+        wrapped.sendall_many(chunks)
+        reader.join(5)
+        assert bytes(received) == encrypt(b'prefix!' + DATA)
+    finally:
+        a.close()
+        b.close()
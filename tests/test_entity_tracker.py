@@ -0,0 +1,120 @@
+import pytest
+
+from mcidle.networking.entity_tracker import EntityTracker, metadata_entries
+from mcidle.networking.packet_handler.packet_stream_reader import PacketStreamReader
+from mcidle.networking.packets.registry import registry, PLAY, CLIENTBOUND
+from mcidle.networking.spill import SpillFile
+
+packets = registry.resolve(340, PLAY, CLIENTBOUND)
+
+UUID = '069a79f4-44e9-4726-a5be-fca90e38aaf5'
+
+# Entity metadata entries: index, type and value
+ON_FIRE = b'\x00\x00\x01'  # Byte
+NOT_ON_FIRE = b'\x00\x00\x00'
+NAME = b'\x02\x03\x05Steve'  # String
+SILENT = b'\x04\x06\x01'  # Boolean
+
+
+def raw(packet):
+    stream = PacketStreamReader()
+    stream.feed(packet.write().bytes)
+    return stream.next_packet()
+
+
+def replay(tracker):
+    """ Decode the frames a joining client would get """
+    stream = PacketStreamReader()
+    for frame in tracker.frames():
+        stream.feed(bytes(frame))
+    decoded = []
+    while True:
+        packet = stream.next_packet()
+        if packet is None:
+            return decoded
+        decoded.append(packets.by_id[packet.id]().read(packet.packet_buffer))
+
+
+def spawn_mob(entity_id, metadata):
+    return raw(packets.SpawnMob(EntityID=entity_id, EntityUUID=UUID, Type=54, X=0.5, Y=64.0, Z=-0.5, Yaw=64,
+                                Pitch=0, HeadPitch=32, VelocityX=0, VelocityY=0, VelocityZ=0,
+                                Metadata=metadata + b'\xff'))
+
+
+@pytest.fixture(params=['dict', 'spill'])
+def tracker(request, tmp_path):
+    storage = SpillFile(str(tmp_path), min_compact=16) if request.param == 'spill' else None
+    tracker = EntityTracker(storage)
+    yield tracker
+    tracker.close()
+
+
+def test_spawn_move_replay(tracker):
+    tracker.spawn(spawn_mob(1, ON_FIRE + NAME))
+    # 1/4096 block steps add up exactly
+    assert tracker.update(raw(packets.EntityRelativeMove(EntityID=1, DeltaX=4096, DeltaY=-2048, DeltaZ=1, \
+                                                         OnGround=True)))
+    assert tracker.update(raw(packets.EntityHeadLook(EntityID=1, HeadYaw=96)))
+    # Not one we track
+    assert not tracker.update(raw(packets.EntityHeadLook(EntityID=2, HeadYaw=96)))
+
+    [mob] = replay(tracker)
+    assert (mob.EntityID, mob.EntityUUID, mob.Type) == (1, UUID, 54)
+    assert (mob.X, mob.Y, mob.Z) == (1.5, 63.5, -0.5 + 1 / 4096.0)
+    assert (mob.Yaw, mob.HeadPitch) == (64, 96)
+    assert mob.Metadata == ON_FIRE + NAME + b'\xff'
+
+
+def test_metadata_merge(tracker):
+    tracker.spawn(spawn_mob(1, ON_FIRE + NAME))
+    tracker.update(raw(packets.EntityMetadata(EntityID=1, Metadata=NOT_ON_FIRE + SILENT + b'\xff')))
+    # Later entries replace earlier ones with the same index
+    assert metadata_entries(bytes(tracker.storage[1])) == {0: NOT_ON_FIRE, 2: NAME, 4: SILENT}
+    assert tracker.memory() == len(NOT_ON_FIRE + NAME + SILENT)
+
+    [mob] = replay(tracker)
+    assert metadata_entries(mob.Metadata) == {0: NOT_ON_FIRE, 2: NAME, 4: SILENT}
+
+
+def test_metadata_after_spawn_without_room(tracker):
+    # Objects can't carry metadata in their spawn packet, it follows it
+    tracker.spawn(raw(packets.SpawnObject(EntityID=5, ObjectUUID=UUID, Type=2, X=1.0, Y=2.0, Z=3.0, Pitch=0, \
+                                          Yaw=0, Data=1, VelocityX=10, VelocityY=20, VelocityZ=30)))
+    tracker.update(raw(packets.EntityMetadata(EntityID=5, Metadata=SILENT + b'\xff')))
+    tracker.update(raw(packets.EntityTeleport(EntityID=5, X=-8.0, Y=70.0, Z=8.0, Yaw=128, Pitch=0, \
+                                              OnGround=False)))
+
+    spawn, metadata = replay(tracker)
+    assert (spawn.EntityID, spawn.Data) == (5, 1)
+    assert (spawn.X, spawn.Y, spawn.Z, spawn.Yaw) == (-8.0, 70.0, 8.0, 128)
+    assert (spawn.VelocityX, spawn.VelocityY, spawn.VelocityZ) == (10, 20, 30)
+    assert (metadata.EntityID, metadata.Metadata) == (5, SILENT + b'\xff')
+
+
+def test_despawn(tracker):
+    tracker.spawn(spawn_mob(1, NAME))
+    tracker.spawn(spawn_mob(2, ON_FIRE))
+    del tracker[1]
+    assert 1 not in tracker and 1 not in tracker.storage
+    assert tracker.memory() == len(ON_FIRE)
+    assert [mob.EntityID for mob in replay(tracker)] == [2]
+
+    # A spawn for a tracked ID replaces the entity, its old metadata goes with it
+    tracker.spawn(spawn_mob(2, SILENT))
+    [mob] = replay(tracker)
+    assert mob.Metadata == SILENT + b'\xff'
+    assert tracker.memory() == len(SILENT)
+
+
+def test_snapshot_is_a_copy(tracker):
+    tracker.spawn(spawn_mob(1, ON_FIRE))
+    snapshot = tracker.snapshot()
+    tracker.update(raw(packets.EntityRelativeMove(EntityID=1, DeltaX=4096, DeltaY=0, DeltaZ=0, OnGround=True)))
+    tracker.update(raw(packets.EntityMetadata(EntityID=1, Metadata=NOT_ON_FIRE + b'\xff')))
+    del tracker[1]
+
+    stream = PacketStreamReader()
+    for frame in tracker.build(snapshot):
+        stream.feed(bytes(frame))
+    mob = packets.SpawnMob().read(stream.next_packet().packet_buffer)
+    assert (mob.X, mob.Metadata) == (0.5, ON_FIRE + b'\xff')
@@ -0,0 +1,78 @@
+import pytest
+
+from mcidle.exporter import render
+from mcidle.networking.metrics import Metrics, Histogram
+
+
+def session(name, **status):
+    return dict(name=name, **status)
+
+
+def samples(text):
+    """ Sample lines as {name and labels: value} """
+    return dict(line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#'))
+
+
+def test_session_gauges():
+    text = render([session('alice', connected=True, client_attached=False, chunks=12, chunk_bytes=4096,
+                           keep_alive_age=1.5, reconnects=2, entity_bytes=None)])
+    assert samples(text) == {
+        'mcidle_connected{account="alice"}': '1',
+        'mcidle_client_attached{account="alice"}': '0',
+        'mcidle_chunks{account="alice"}': '12',
+        'mcidle_chunk_bytes{account="alice"}': '4096',
+        'mcidle_keep_alive_age_seconds{account="alice"}': '1.5',
+        'mcidle_reconnects_total{account="alice"}': '2',
+    }
+    assert '# HELP mcidle_chunks Chunks cached for the account\n# TYPE mcidle_chunks gauge\n' in text
+    assert '# TYPE mcidle_reconnects_total counter' in text
+    assert text.endswith('\n')
+
+
+def test_families_are_grouped():
+    text = render([session('alice', chunks=1), session('bob', chunks=2)])
+    # One HELP and TYPE per metric, followed by every account's sample
+    assert text == '# HELP mcidle_chunks Chunks cached for the account\n' \
+                   '# TYPE mcidle_chunks gauge\n' \
+                   'mcidle_chunks{account="alice"} 1\n' \
+                   'mcidle_chunks{account="bob"} 2\n'
+
+
+def test_labels_are_escaped():
+    text = render([session('a"b\\c\nd', chunks=0)])
+    assert 'mcidle_chunks{account="a\\"b\\\\c\\nd"} 0' in text
+
+
+def test_connection_metrics():
+    metrics = Metrics()
+    metrics.clientbound.count(0x20, 1000)
+    metrics.clientbound.count(0x20, 500)
+    metrics.clientbound.count(1000, 7)  # Past the last packet ID
+    metrics.serverbound.count(0x0B, 9)
+    metrics.gauge('worker_queue', lambda: 3)
+    metrics.decode = Histogram((0.001, 0.01))
+    for value in (0.0005, 0.005, 0.005, 1.0):
+        metrics.decode.observe(value)
+
+    lines = samples(render([session('alice', metrics=metrics.snapshot())]))
+    assert lines['mcidle_worker_queue_packets{account="alice"}'] == '3'
+    assert lines['mcidle_packets_total{account="alice",direction="clientbound",id="0x20"}'] == '2'
+    assert lines['mcidle_packet_bytes_total{account="alice",direction="clientbound",id="0x20"}'] == '1500'
+    assert lines['mcidle_packets_total{account="alice",direction="clientbound",id="other"}'] == '1'
+    assert lines['mcidle_packet_bytes_total{account="alice",direction="serverbound",id="0x0B"}'] == '9'
+
+    # Buckets are cumulative and end with +Inf
+    assert lines['mcidle_decode_seconds_bucket{account="alice",le="0.001"}'] == '1'
+    assert lines['mcidle_decode_seconds_bucket{account="alice",le="0.01"}'] == '3'
+    assert lines['mcidle_decode_seconds_bucket{account="alice",le="+Inf"}'] == '4'
+    assert lines['mcidle_decode_seconds_count{account="alice"}'] == '4'
+    assert float(lines['mcidle_decode_seconds_sum{account="alice"}']) == pytest.approx(1.0105)
+
+
+def test_auth_requests_and_extra():
+    text = render([], {'session': 3, 'authenticate': 1}, [('mcidle_up', 'gauge', 'Whether mcidle is up', 1)])
+    assert samples(text) == {
+        'mcidle_auth_requests_total{endpoint="authenticate"}': '1',
+        'mcidle_auth_requests_total{endpoint="session"}': '3',
+        'mcidle_up': '1',
+    }
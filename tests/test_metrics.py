@@ -0,0 +1,12 @@
+from mcidle.networking.metrics import MAX_PACKET_ID, OVERFLOW, PacketCounters
+
+
+def test_packet_counters_overflow_slot():
+    counters = PacketCounters()
+    counters.count(0, 2)
+    counters.count(MAX_PACKET_ID, 3)
+    counters.count(MAX_PACKET_ID + 1, 5)
+    counters.count(-1, 7)
+
+    # The largest packet ID has its own slot, the out of range IDs share the overflow slot
+    assert counters.snapshot() == {0: (1, 2), MAX_PACKET_ID: (1, 3), OVERFLOW: (2, 12)}
@@ -0,0 +1,61 @@
+import pytest
+
+from mcidle.networking.packet_handler.packet_stream_reader import PacketStreamReader
+from mcidle.networking.packets import clientbound, serverbound
+from mcidle.networking.packets.registry import registry, PacketRegistry, UnsupportedProtocol, HANDSHAKING, LOGIN, \
+    PLAY, CLIENTBOUND, SERVERBOUND
+
+STATES = [(HANDSHAKING, SERVERBOUND), (LOGIN, SERVERBOUND), (LOGIN, CLIENTBOUND), (PLAY, CLIENTBOUND),
+          (PLAY, SERVERBOUND)]
+
+
+def test_338_derived_from_340():
+    assert registry.protocols() == [338, 340]
+    for state, direction in STATES:
+        base, derived = registry.resolve(340, state, direction), registry.resolve(338, state, direction)
+        assert set(derived.by_name) == set(base.by_name)
+        for name, packet_class in base.by_name.items():
+            assert derived.by_name[name].id == packet_class.id
+            if name != 'KeepAlive':
+                assert derived.by_name[name] is packet_class
+
+
+def test_338_keep_alive_is_a_varint():
+    assert registry.resolve(340, PLAY, CLIENTBOUND).KeepAlive is clientbound.KeepAlive
+    assert registry.resolve(338, PLAY, CLIENTBOUND).KeepAlive is clientbound.KeepAliveVarInt
+    assert registry.resolve(338, PLAY, SERVERBOUND).KeepAlive is serverbound.KeepAliveVarInt
+
+    packets = registry.resolve(338, PLAY, CLIENTBOUND)
+    frame = packets.KeepAlive(KeepAliveID=300).write().bytes
+    # Packet length, packet ID and a two byte VarInt instead of a Long
+    assert len(frame) == 1 + 1 + 2
+
+    stream = PacketStreamReader()
+    stream.feed(frame)
+    packet = stream.next_packet()
+    assert packets[packet.id] is packets.KeepAlive
+    assert packets.KeepAlive().read(packet.packet_buffer).KeepAliveID == 300
+
+
+def test_tables_are_shared():
+    assert registry.resolve(338, PLAY, CLIENTBOUND) is registry.resolve(338, PLAY, CLIENTBOUND)
+    assert registry.resolve(340, PLAY, CLIENTBOUND)[0xFF] is None
+
+
+def test_unsupported_protocol():
+    with pytest.raises(UnsupportedProtocol):
+        registry.resolve(47, PLAY, CLIENTBOUND)
+
+
+def test_derive_moves_an_id():
+    packets = PacketRegistry()
+    packets.register(1, PLAY, CLIENTBOUND, clientbound.KeepAlive)
+    packets.register(1, PLAY, CLIENTBOUND, clientbound.ChatMessage)
+    packets.derive(2, 1, [(PLAY, CLIENTBOUND, 'ChatMessage', clientbound.ChatMessage, 0x7E)])
+
+    table = packets.resolve(2, PLAY, CLIENTBOUND)
+    # Subclassed with the new ID so writing it puts that on the wire
+    assert table.ChatMessage.id == 0x7E and issubclass(table.ChatMessage, clientbound.ChatMessage)
+    assert table[0x7E] is table.ChatMessage and table[clientbound.ChatMessage.id] is None
+    assert packets.resolve(1, PLAY, CLIENTBOUND).ChatMessage is clientbound.ChatMessage
+    assert table.ids('KeepAlive', 'Missing') == [clientbound.KeepAlive.id]
@@ -0,0 +1,110 @@
+from mcidle.networking.game_state import GameState
+from mcidle.networking.packet_handler.packet_stream_reader import PacketStreamReader
+
+
+def decode(frames):
+    """ The packets a joining client would get """
+    packets = GameState().packets
+    stream = PacketStreamReader()
+    for frame in frames:
+        stream.feed(bytes(frame))
+    decoded = []
+    while True:
+        packet = stream.next_packet()
+        if packet is None:
+            return decoded
+        decoded.append(packets.by_id[packet.id]().read(packet.packet_buffer))
+
+
+def raw(packet):
+    stream = PacketStreamReader()
+    stream.feed(packet.write().bytes)
+    return stream.next_packet()
+
+
+def spawn(game_state, entity_id):
+    packets = game_state.packets
+    game_state.entities.spawn(raw(packets.SpawnExperienceOrb(EntityID=entity_id, X=0.0, Y=64.0, Z=0.0, Count=1)))
+    game_state.touch('entities')
+
+
+def names(frames):
+    return [type(packet).__name__ for packet in decode(frames)]
+
+
+def test_segments_are_cached_until_touched():
+    game_state = GameState()
+    replay = game_state.replay
+    game_state.held_item_slot = 3
+    assert decode(replay.snapshot().frames())[-1].Slot == 3
+
+    # Not touched, the segment built before is handed out again
+    game_state.held_item_slot = 5
+    assert decode(replay.snapshot().frames())[-1].Slot == 3
+    assert replay.segments['held_item']
+
+    game_state.touch('held_item')
+    assert 'held_item' not in replay.segments
+    assert decode(replay.snapshot().frames())[-1].Slot == 5
+
+
+def test_position_is_built_every_time():
+    game_state = GameState()
+    game_state.packet_log[game_state.packets.PlayerPositionAndLook.id] = None
+    game_state.last_pos_packet = game_state.packets.PlayerPositionAndLook(X=1.0, Y=2.0, Z=3.0, Yaw=0.0, \
+                                                                          Pitch=0.0, Flags=0, TeleportID=0)
+    first, second = [[packet for packet in decode(game_state.replay.snapshot().frames()) \
+                      if type(packet).__name__ == 'PlayerPositionAndLook'][0] for _ in range(2)]
+    # Every join gets a new teleport ID
+    assert (first.TeleportID, second.TeleportID) == (0, 1)
+    assert 'position' not in game_state.replay.segments
+
+
+def test_deferred_segment_is_stored_after_building():
+    game_state = GameState()
+    spawn(game_state, 1)
+    replay = game_state.replay
+    snapshot = replay.snapshot()
+    assert 'entities' not in replay.segments
+    assert names(snapshot.frames()).count('SpawnExperienceOrb') == 1
+    assert len(replay.segments['entities']) == 1
+
+
+def test_deferred_segment_touched_while_building_is_not_stored():
+    game_state = GameState()
+    spawn(game_state, 1)
+    replay = game_state.replay
+    snapshot = replay.snapshot()
+    spawn(game_state, 2)
+    # Built from the records taken before the second spawn, it's stale now
+    assert names(snapshot.frames()).count('SpawnExperienceOrb') == 1
+    assert 'entities' not in replay.segments
+    assert names(replay.snapshot().frames()).count('SpawnExperienceOrb') == 2
+
+
+def test_snapshot_unaffected_by_later_changes():
+    game_state = GameState()
+    spawn(game_state, 1)
+    game_state.held_item_slot = 1
+    snapshot = game_state.replay.snapshot()
+
+    del game_state.entities[1]
+    spawn(game_state, 2)
+    game_state.held_item_slot = 2
+    game_state.touch('held_item')
+
+    packets = decode(snapshot.frames())
+    assert [packet.EntityID for packet in packets if type(packet).__name__ == 'SpawnExperienceOrb'] == [1]
+    assert packets[-1].Slot == 1
+
+
+def test_compression_change_rebuilds():
+    game_state = GameState()
+    replay = game_state.replay
+    plain = replay.snapshot().frames()
+    assert replay.segments['held_item'] == tuple(plain[-1:])
+
+    compressed = replay.snapshot(256, 1).frames()
+    # Written with a compression header
+    assert compressed[-1] != plain[-1]
+    assert replay.segments['held_item'] == tuple(compressed[-1:])
@@ -0,0 +1,84 @@
+import pytest
+
+from mcidle.networking.spill import SpillFile
+
+
+@pytest.fixture
+def spill(tmp_path):
+    spill = SpillFile(str(tmp_path), min_compact=64)
+    yield spill
+    spill.close()
+
+
+def test_dict_like(spill):
+    spill['a'] = b'hello'
+    spill[(1, 2)] = b'world!'
+    assert len(spill) == 2 and 'a' in spill and 'b' not in spill
+    assert bytes(spill['a']) == b'hello'
+    assert isinstance(spill[(1, 2)], memoryview)
+    assert sorted((str(key), bytes(data)) for key, data in spill.items()) == [('(1, 2)', b'world!'), ('a', b'hello')]
+    assert spill.memory() == 11
+
+    del spill['a']
+    assert 'a' not in spill and spill.memory() == 6
+    with pytest.raises(KeyError):
+        spill['a']
+
+
+def test_remap_on_append(spill):
+    spill['a'] = b'x' * 10
+    first = spill['a']
+    mapped = spill.mapped
+    # Past the end of the map, it's mapped again to cover the new frame
+    spill['b'] = b'y' * 10
+    assert bytes(spill['b']) == b'y' * 10
+    assert spill.mapped > mapped
+    # A view taken before still reads the old map
+    assert bytes(first) == b'x' * 10
+
+
+def test_replaced_frames_compact(spill):
+    spill['keep'] = b'k' * 16
+    for i in range(4):
+        spill['hot'] = bytes([i]) * 16
+    assert spill.compactions == 0 and spill.size - spill.live == 48
+
+    # More dead space than live data and at least min_compact of it
+    spill['hot'] = b'h' * 16
+    assert spill.compactions == 1
+    assert spill.size == spill.live == 32
+    assert bytes(spill['keep']) == b'k' * 16
+    assert bytes(spill['hot']) == b'h' * 16
+
+
+def test_compact_keeps_views_valid(spill):
+    for i in range(4):
+        spill[i] = bytes([i]) * 32
+    views = [spill[i] for i in range(4)]
+    for i in range(3):
+        del spill[i]
+    # The old segment stays mapped while views of it are alive
+    assert spill.compactions == 1 and spill.size == 32
+    assert [bytes(view) for view in views] == [bytes([i]) * 32 for i in range(4)]
+    assert bytes(spill[3]) == b'\x03' * 32
+
+
+def test_no_compaction_under_min_compact(tmp_path):
+    spill = SpillFile(str(tmp_path), min_compact=1 << 20)
+    try:
+        for _ in range(10):
+            spill['a'] = b'a' * 100
+        assert spill.compactions == 0 and spill.size == 1000 and spill.live == 100
+    finally:
+        spill.close()
+
+
+def test_closed(tmp_path):
+    spill = SpillFile(str(tmp_path))
+    spill['a'] = b'a'
+    spill.close()
+    assert len(spill) == 0 and spill.memory() == 0
+    with pytest.raises(ValueError):
+        spill['b'] = b'b'
+    # Nothing is left behind
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,97 @@
+import pytest
+
+from mcidle.networking.packets.packet_buffer import PacketBuffer
+from mcidle.networking.types import VarInt, VarLong
+
+INT_MIN, INT_MAX = -(1 << 31), (1 << 31) - 1
+LONG_MIN, LONG_MAX = -(1 << 63), (1 << 63) - 1
+
+VARINT_VALUES = [0, 1, 127, 128, 255, 300, 16383, 16384, 2097151, 2097152, 268435455, 268435456, INT_MAX, \
+                 -1, -128, -129, INT_MIN]
+VARLONG_VALUES = VARINT_VALUES[:-1] + [INT_MAX + 1, (1 << 56) - 1, 1 << 56, LONG_MAX, INT_MIN, INT_MIN - 1, LONG_MIN]
+
+# Examples from the protocol documentation
+VARINT_ENCODINGS = [
+    (0, b'\x00'),
+    (1, b'\x01'),
+    (127, b'\x7f'),
+    (128, b'\x80\x01'),
+    (255, b'\xff\x01'),
+    (25565, b'\xdd\xc7\x01'),
+    (2097151, b'\xff\xff\x7f'),
+    (INT_MAX, b'\xff\xff\xff\xff\x07'),
+    (-1, b'\xff\xff\xff\xff\x0f'),
+    (INT_MIN, b'\x80\x80\x80\x80\x08'),
+]
+VARLONG_ENCODINGS = [
+    (0, b'\x00'),
+    (128, b'\x80\x01'),
+    (INT_MAX, b'\xff\xff\xff\xff\x07'),
+    (LONG_MAX, b'\xff\xff\xff\xff\xff\xff\xff\xff\x7f'),
+    (-1, b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\x01'),
+    (INT_MIN, b'\x80\x80\x80\x80\xf8\xff\xff\xff\xff\x01'),
+    (LONG_MIN, b'\x80\x80\x80\x80\x80\x80\x80\x80\x80\x01'),
+]
+
+
+@pytest.mark.parametrize('var_type, values', [(VarInt, VARINT_VALUES), (VarLong, VARLONG_VALUES)])
+def test_round_trip(var_type, values):
+    for value in values:
+        stream = PacketBuffer()
+        size = var_type.write(value, stream)
+        data = stream.bytes
+
+        assert size == len(data) == var_type.size(value)
+        assert var_type.read(PacketBuffer(data)) == value
+        assert var_type.read_buffer(data) == (value, len(data))
+        # Reading in place from the middle of a buffer
+        assert var_type.read_buffer(b'\x01' + data + b'\x02', 1) == (value, len(data) + 1)
+
+
+@pytest.mark.parametrize('var_type, encodings', [(VarInt, VARINT_ENCODINGS), (VarLong, VARLONG_ENCODINGS)])
+def test_encodings(var_type, encodings):
+    for value, data in encodings:
+        assert var_type.encode(value) == data
+        assert var_type.read(PacketBuffer(data)) == value
+
+
+@pytest.mark.parametrize('var_type, minimum, maximum', [(VarInt, INT_MIN, INT_MAX), (VarLong, LONG_MIN, LONG_MAX)])
+def test_maxima(var_type, minimum, maximum):
+    # Negative numbers take all of the bytes, 5 for a VarInt and 10 for a VarLong
+    max_bytes = var_type.max_bytes
+    assert len(var_type.encode(-1)) == len(var_type.encode(minimum)) == max_bytes
+    assert var_type.size(-1) == max_bytes
+    assert len(var_type.encode(maximum)) == var_type.size(maximum) == {VarInt: 5, VarLong: 9}[var_type]
+
+    # Unsigned values that fit in the bits wrap around like a cast in Java, anything wider is an error
+    unsigned = (1 << var_type.bits) - 1
+    assert var_type.encode(unsigned) == var_type.encode(-1)
+    assert var_type.read(PacketBuffer(var_type.encode(maximum + 1))) == minimum
+    with pytest.raises(ValueError):
+        var_type.encode(unsigned + 1)
+    with pytest.raises(ValueError):
+        var_type.encode(minimum - 1)
+    with pytest.raises(ValueError):
+        var_type.size(unsigned + 1)
+
+
+@pytest.mark.parametrize('var_type', [VarInt, VarLong])
+def test_too_long(var_type):
+    # One continuation byte too many
+    data = b'\x80' * var_type.max_bytes + b'\x00'
+    with pytest.raises(ValueError):
+        var_type.read(PacketBuffer(data))
+    with pytest.raises(ValueError):
+        var_type.read_buffer(data)
+
+
+@pytest.mark.parametrize('var_type', [VarInt, VarLong])
+def test_truncated(var_type):
+    for data in (b'', b'\x80', b'\xff\xff'):
+        with pytest.raises(EOFError):
+            var_type.read(PacketBuffer(data))
+        with pytest.raises(EOFError):
+            var_type.read_buffer(data)
+    # The end of a frame bounds reading in place
+    with pytest.raises(EOFError):
+        var_type.read_buffer(b'\x80\x01', 0, 1)
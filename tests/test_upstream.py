@@ -0,0 +1,166 @@
+import socket
+import threading
+
+import pytest
+
+from mcidle.networking.packet_queue import PacketQueue
+from mcidle.networking.upstream import UpstreamThread, BLOCK, DROP, DISCONNECT
+
+
+def test_queue_counts_bytes():
+    queue = PacketQueue(10, len)
+    assert queue.put(b'abcd') and queue.put(b'ef')
+    assert queue.nbytes == 6
+    assert queue.has_room(4) and not queue.has_room(5)
+    assert queue.get_batch(0, 1) == [b'abcd']
+    assert queue.nbytes == 2
+    assert queue.get_batch(0) == [b'ef']
+    assert queue.nbytes == 0 and queue.empty()
+
+
+def test_single_item_fits_empty_queue():
+    queue = PacketQueue(10, len)
+    assert queue.has_room(100)
+    queue.put(b'x' * 100)
+    assert not queue.has_room(1)
+
+
+def test_put_for_stale_generation_is_dropped():
+    queue = PacketQueue(10, len)
+    generation = queue.generation
+    queue.put(b'old', generation)
+    assert queue.clear() == (1, 3)
+    # Decided on before the clear, it must not slip in after it
+    assert not queue.put(b'stale', generation)
+    assert queue.empty() and queue.nbytes == 0
+    assert queue.put(b'new', queue.generation)
+    assert queue.get_batch(0) == [b'new']
+
+
+def test_wait_for_room():
+    queue = PacketQueue(4, len)
+    queue.put(b'abcd')
+    assert not queue.wait_for_room(1, 0.05)
+
+    waited = []
+    waiter = threading.Thread(target=lambda: waited.append(queue.wait_for_room(1)), daemon=True)
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    queue.get_batch(0)
+    waiter.join(5)
+    assert waited == [True]
+
+
+def test_wait_for_room_ends_on_clear_and_close():
+    for end in (PacketQueue.clear, PacketQueue.close):
+        queue = PacketQueue(4, len)
+        queue.put(b'abcd')
+        waiter = threading.Thread(target=queue.wait_for_room, args=(1,), daemon=True)
+        waiter.start()
+        waiter.join(0.1)
+        assert waiter.is_alive()
+        end(queue)
+        waiter.join(5)
+        assert not waiter.is_alive()
+
+
+def test_block_queues_over_the_limit_and_paces():
+    # The writer isn't started, nothing drains the queue
+    upstream = UpstreamThread(max_bytes=8, policy=BLOCK)
+    assert upstream.put(b'x' * 8)
+    # Never dropped, whoever produces the frames waits instead
+    assert upstream.put(b'y' * 8)
+    assert upstream.depth() == 16 and upstream.dropped == 0
+
+    paced = threading.Event()
+    reader = threading.Thread(target=lambda: (upstream.pace(), paced.set()), daemon=True)
+    reader.start()
+    assert not paced.wait(0.2)
+    upstream.queue.get_batch(0)
+    assert paced.wait(5)
+    upstream.stop()
+
+
+def test_pace_ignores_backlog_while_paused():
+    upstream = UpstreamThread(max_bytes=8, policy=BLOCK)
+    upstream.pause()
+    upstream.put(b'x' * 32)
+    upstream.pace()  # Doesn't wait on the backlog
+
+    # After resuming the backlog is allowed on top of max_bytes
+    upstream.resume()
+    assert upstream.allowance == 32
+    upstream.pace()
+    upstream.stop()
+
+
+def test_drop_policy():
+    a, b = socket.socketpair()
+    try:
+        upstream = UpstreamThread(max_bytes=8, policy=DROP)
+        upstream.set_socket(a)
+        assert upstream.put(b'x' * 8)
+        # Droppable frames that don't fit are dropped, the socket stays up
+        assert not upstream.put(b'y' * 4, droppable=True)
+        assert (upstream.dropped, upstream.dropped_bytes, upstream.overflows) == (1, 4, 0)
+        assert upstream.depth() == 8
+
+        # A frame that can't be dropped disconnects
+        assert not upstream.put(b'z' * 4)
+        assert upstream.overflows == 1
+        assert upstream.depth() == 0 and upstream.dropped_bytes == 4 + 8 + 4
+        assert b.recv(1) == b''
+    finally:
+        a.close()
+        b.close()
+
+
+def test_disconnect_policy():
+    a, b = socket.socketpair()
+    try:
+        upstream = UpstreamThread(max_bytes=8, policy=DISCONNECT)
+        upstream.set_socket(a)
+        upstream.put(b'x' * 8)
+        assert not upstream.put(b'y', droppable=True)
+        assert upstream.overflows == 1 and upstream.depth() == 0
+        assert b.recv(1) == b''
+    finally:
+        a.close()
+        b.close()
+
+
+def test_stale_generation_after_set_socket():
+    upstream = UpstreamThread()
+    generation = upstream.generation()
+    upstream.put(b'frame', generation=generation)
+    # A new socket clears what was queued for the old one
+    upstream.set_socket(None)
+    assert upstream.dropped == 1
+    assert not upstream.put(b'late', generation=generation)
+    assert upstream.depth() == 0
+
+
+def test_writes_batches():
+    a, b = socket.socketpair()
+    try:
+        upstream = UpstreamThread(max_batch_size=4)
+        upstream.set_socket(a)
+        upstream.start()
+        for frame in (b'ab', b'cd', b'efgh', b'i'):
+            upstream.put(frame)
+
+        data = b''
+        b.settimeout(5)
+        while len(data) < 9:
+            data += b.recv(64)
+        assert data == b'abcdefghi'
+        upstream.stop()
+    finally:
+        a.close()
+        b.close()
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        UpstreamThread(policy='wait')
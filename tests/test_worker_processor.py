@@ -0,0 +1,67 @@
+import threading
+
+from mcidle.networking.connection import MinecraftConnection
+from mcidle.networking.game_state import GameState
+from mcidle.networking.metrics import Metrics
+from mcidle.networking.packet_handler.packet_processor import ClientboundProcessor
+from mcidle.networking.packet_handler.packet_stream_reader import PacketStreamReader
+from mcidle.networking.packet_handler.worker_processor import WorkerProcessor
+from mcidle.networking.packets.registry import registry, PLAY, CLIENTBOUND
+from mcidle.networking.upstream import UpstreamThread, BLOCK
+
+packets = registry.resolve(340, PLAY, CLIENTBOUND)
+
+
+class Connection:
+    """ Just what the WorkerProcessor needs of a MinecraftConnection, with a client attached """
+    client_target = MinecraftConnection.client_target
+    send_to_client = MinecraftConnection.send_to_client
+    pace = MinecraftConnection.pace
+    client_upstream = MinecraftConnection.client_upstream
+
+    def __init__(self, upstream):
+        self.metrics = Metrics()
+        self.droppable_clientbound = set()
+        self.local_client_upstream = upstream
+        self.client_upstream_lock = threading.RLock()
+        self.responses = []
+        self.answered = threading.Event()
+
+    def send_packet(self, packet):
+        self.responses.append(packet)
+        self.answered.set()
+
+
+def raw(packet):
+    stream = PacketStreamReader()
+    stream.feed(packet.write().bytes)
+    return stream.next_packet()
+
+
+def test_keep_alive_answered_while_client_queue_is_full():
+    # The writer isn't started, so nothing drains the client's queue
+    upstream = UpstreamThread(max_bytes=64, policy=BLOCK)
+    connection = Connection(upstream)
+    worker = WorkerProcessor(connection, ClientboundProcessor(GameState()))
+    worker.start()
+    try:
+        upstream.put(b'\0' * 64)  # The client is behind already
+        chat = packets.ChatMessage(Chat='{"text":"%s"}' % ('x' * 100), Position=0)
+        worker.enqueue(raw(chat))
+        worker.enqueue(raw(packets.KeepAlive(KeepAliveID=1234)))
+
+        assert connection.answered.wait(5)
+        assert connection.responses[0].KeepAliveID == 1234
+        # The chat message was queued for the client even though it's over the limit
+        assert upstream.depth() > upstream.queue.max_bytes
+
+        # The reader is the one that waits for the client to catch up
+        waited = threading.Event()
+        reader = threading.Thread(target=lambda: (connection.pace(), waited.set()), daemon=True)
+        reader.start()
+        assert not waited.wait(0.2)
+        upstream.queue.get_batch()
+        assert waited.wait(5)
+    finally:
+        worker.stop()
+        upstream.stop()